@@ -0,0 +1,2 @@
+cd C:\ERMES\products\scripts
+python sweepMosaicDatasets.py . *_2016_folders*.txt ALL_2016_sweep.log 16 REMOVE REPAIR DEEP
\ No newline at end of file
@@ -0,0 +1,2 @@
+cd C:\ERMES\products\scripts
+python updateAllMosaicDatasets.py . *_2016_folders*.txt ALL_2016.log 4
\ No newline at end of file
@@ -0,0 +1,2 @@
+cd C:\ERMES\products\scripts
+python watchMosaicDatasets.py . *_2016_folders*.txt ALL_2016_watch.log 60 30
\ No newline at end of file
@@ -0,0 +1,169 @@
+# Author:   GEOTEC, UJI
+# Date:     March 2016
+#
+# Purpose:  This script replays a crop season of daily updates against the geoprocessing simulator of gpBackend
+#           (StubBackend), so that the growth of update times can be measured while mosaic data sets go from 0 to
+#           ~365 items each. It reads the real folders files (*_2016_folders*.txt), creates every mosaic data set
+#           in a temporary workspace and then, for every simulated day:
+#           1/ drops the raster files of that day into every source folder, with names that follow the naming
+#              convention of each product family (see rasterNames):
+#              IT_Monitoring_NDVI_2016_001.tif, IT_MSAVI_CLUSTER_2016_001.tif,
+#              IT_avg_Monitoring_NDVI_2003_2015_001.tif, IT_Meteo_Forecast_TMax_2016_001_plus1.tif
+#           2/ runs the update script of each folders file (plain, _LOCAL, _LTA, _FORE) on every line, as
+#              updateAllMosaicDatasets.py does
+#           3/ prints wall time, tool calls, cursor rows read and written, and items in catalogs
+#           At the end, tool calls and time spent per tool over the whole season.
+#
+# Note:     Tool latencies are those of benchmarkUpdates.py times <scale>, plus a cost per cursor row, so that
+#           the growth curve shows up. Figures measure the update logic, not arcpy itself.
+#
+# Usage:    python benchmarkSeason.py [<days> [<scale> [<folders_files>]]]
+#           <folders_files>: comma separated, all *_2016_folders*.txt next to this script by default
+# Example:  python benchmarkSeason.py 365 0.1
+# Example:  python benchmarkSeason.py 30 1 IT_2016_folders.txt,IT_2016_folders_FORE.txt
+
+import collections
+import glob
+import logging
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+import benchmarkUpdates
+import createMosaicDatasets
+import folderConfig
+import folderManifest
+import gpBackend
+import rasterNames
+import updateAllMosaicDatasets
+
+YEAR = 2016
+FORECAST_DAYS = 4  # forecasts published per day after the one of the day (_plus1 ... _plus4)
+ITEM_LATENCY = {"search_cursor": 0.0002, "update_cursor": 0.0002}  # per row read
+
+# Variant of folders files --> product family of raster names
+FAMILIES = {updateAllMosaicDatasets.REGIONAL: rasterNames.MONITORING, updateAllMosaicDatasets.LOCAL: rasterNames.LOCAL,
+            updateAllMosaicDatasets.LTA: rasterNames.LTA, updateAllMosaicDatasets.FORE: rasterNames.FORECAST}
+_LTA_YEARS_PATTERN = re.compile(r"^\d{4}_\d{4}$")
+
+
+def daily_names(_family, _country, _source_folder, _day):
+    """Names of the raster files that arrive in a source folder on a day of year
+
+    :param _family: MONITORING, LOCAL, LTA or FORECAST
+    :param _country: Ex: IT
+    :param _source_folder: as in folders files. Ex: C:/ERMES/data/IT/Regional/IT_EP_R4_Meteo/2016/TMax
+    :param _day: day of year
+    :return: list of filenames
+    """
+    folder = os.path.basename(_source_folder)
+    parent = os.path.basename(os.path.dirname(_source_folder))
+    if _family == rasterNames.MONITORING:
+        product = "Meteo" if "Meteo" in _source_folder else "Monitoring"
+        return ["%s_%s_%s_%d_%03d.tif" % (_country, product, folder, YEAR, _day)]
+    if _family == rasterNames.LOCAL:
+        return ["%s_%s_%s_%d_%03d.tif" % (_country, parent, folder.replace("_", "").upper(), YEAR, _day)]
+    if _family == rasterNames.LTA:
+        years = parent if _LTA_YEARS_PATTERN.match(parent) else "2003_2015"
+        return ["%s_%s_Monitoring_%s_%s_%03d.tif" % (_country, statistic, folder, years, _day)
+                for statistic in ["avg", "std"]]
+    if _family == rasterNames.FORECAST:
+        name = "%s_Meteo_Forecast_%s_%d_%03d" % (_country, parent, YEAR, _day)
+        return [name + ".tif"] + ["%s_plus%d.tif" % (name, plus) for plus in range(1, FORECAST_DAYS + 1)]
+    raise ValueError("Unknown product family: %s" % _family)
+
+
+def read_season(_mosaics_filenames, _root):
+    """Jobs of the folders files, with source folders moved under the temporary workspace
+
+    :param _mosaics_filenames:
+    :param _root: temporary workspace
+    :return: (env_path, list of (family, country, database_path, mosaic_name, source_folder, original folder,
+             nodata, variant))
+    """
+    env_path = os.path.join(_root, "products")
+    jobs = []
+    for mosaics_filename in _mosaics_filenames:
+        variant = updateAllMosaicDatasets.variant_of(mosaics_filename)
+        family = FAMILIES[variant]
+        for config in folderConfig.read_config(mosaics_filename):
+            source_folder = os.path.join(_root, "data", os.path.splitdrive(config.source_folder)[1].lstrip("/\\"))
+            jobs.append((family, config.country, folderConfig.database_path(env_path, config), config.mosaic_name,
+                         source_folder, config.source_folder, config.nodata, variant))
+    return env_path, jobs
+
+
+def run_season(_mosaics_filenames, _days, _scale):
+    """Create the mosaic data sets of the folders files and replay _days daily updates
+
+    :param _mosaics_filenames:
+    :param _days:
+    :param _scale: factor applied to tool latencies
+    :return: list of per day dictionaries (day, seconds, calls, rows_read, rows_written, items)
+    """
+    root = tempfile.mkdtemp(prefix="ermes_season_")
+    try:
+        env_path, jobs = read_season(_mosaics_filenames, root)
+        database_root = os.path.join(root, "gdb")
+        os.makedirs(database_root)
+        logging.basicConfig(level=logging.DEBUG, filename=os.path.join(root, "season.log"),
+                            format=createMosaicDatasets.LOG_FORMAT)
+        manifest_folder = folderManifest.manifest_folder_of(os.path.join(root, "season.log"))
+
+        # Mosaic data sets are created without latency, only updates are timed
+        createMosaicDatasets.gp = gpBackend.create_backend("stub", _root=database_root)
+        for family, country, database_path, mosaic_name, source_folder, folder, nodata, variant in jobs:
+            createMosaicDatasets.create_mosaic(database_path, mosaic_name, nodata)
+
+        latency = dict((tool, seconds * _scale) for tool, seconds in benchmarkUpdates.LATENCY.items())
+        item_latency = dict((tool, seconds * _scale) for tool, seconds in benchmarkUpdates.ITEM_LATENCY.items())
+        item_latency.update((tool, seconds * _scale) for tool, seconds in ITEM_LATENCY.items())
+        gp = gpBackend.create_backend("stub", _root=database_root, _latency=latency, _item_latency=item_latency)
+        updateAllMosaicDatasets.set_backend(gp)
+
+        results = []
+        tool_times = collections.Counter()
+        print("day\tseconds\ttool calls\trows read\trows written\tcatalog items")
+        for day in range(1, _days + 1):
+            for family, country, database_path, mosaic_name, source_folder, folder, nodata, variant in jobs:
+                benchmarkUpdates.make_rasters(source_folder, daily_names(family, country, folder, day))
+            calls = gp.calls.copy()
+            items = gp.items.copy()
+            start = time.time()
+            for family, country, database_path, mosaic_name, source_folder, folder, nodata, variant in jobs:
+                updateAllMosaicDatasets.update_mosaic(variant, database_path, mosaic_name, source_folder,
+                                                      manifest_folder)
+            elapsed = time.time() - start
+            calls = gp.calls - calls
+            items = gp.items - items
+            for tool, count in calls.items():
+                tool_times[tool] += count * latency.get(tool, 0.0) + items[tool] * item_latency.get(tool, 0.0)
+            result = {"day": day, "seconds": elapsed, "calls": sum(calls.values()),
+                      "rows_read": items["search_cursor"] + items["update_cursor"],
+                      "rows_written": calls["update_row"] + items["calculate_fields"],
+                      "items": sum(createMosaicDatasets.gp.get_count(os.path.join(job[2], job[3])) for job in jobs)}
+            results.append(result)
+            print("%(day)d\t%(seconds).2f\t%(calls)d\t%(rows_read)d\t%(rows_written)d\t%(items)d" % result)
+
+        print("\n%d mosaic data sets, %d days: %.2f s" % (len(jobs), _days, sum(r["seconds"] for r in results)))
+        print("tool\tcalls\tsimulated seconds")
+        for tool, seconds in tool_times.most_common():
+            print("%s\t%d\t%.2f" % (tool, gp.calls[tool], seconds))
+        return results
+    finally:
+        logging.shutdown()
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    DAYS = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    SCALE = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+    SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+    if len(sys.argv) > 3:
+        MOSAICS_FILENAMES = [os.path.join(SCRIPT_FOLDER, filename) for filename in sys.argv[3].split(",")]
+    else:
+        MOSAICS_FILENAMES = sorted(glob.glob(os.path.join(SCRIPT_FOLDER, "*_%d_folders*.txt" % YEAR)))
+    run_season(MOSAICS_FILENAMES, DAYS, SCALE)
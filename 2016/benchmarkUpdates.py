@@ -0,0 +1,934 @@
+# Author:   GEOTEC, UJI
+# Date:     March 2016
+#
+# Purpose:  This script times the update scripts against the geoprocessing simulator of gpBackend (StubBackend),
+#           so that it can be run on machines without ArcGIS. It does not touch any real geo database.
+#           Each scenario builds a temporary workspace with synthetic raster files (small GeoTIFF files of zeros
+#           named after the ERMES naming convention), runs the update logic and prints wall times and tool calls.
+#           Scenarios:
+#           1/ scheduler: updates mosaic data sets of several geo databases with 1 and <workers> processes
+#           2/ manifest: daily update after one new raster per source folder, with and without manifests
+#           3/ newrows: detection of new entries, GetCount before/after the add step versus catalogQuery
+#           4/ names: parsing of <count> synthetic raster names, split per row versus rasterNames
+#           5/ writes: custom fields of an LTA mosaic data set of <days> x avg/std rows, per row versus fieldWriter
+#           6/ preprocess: pyramids and statistics built by the add step versus beforehand with <workers> processes
+#           7/ create: creation of every mosaic data set from scratch versus from a template, with 1 and <workers>
+#              processes
+#           8/ projections: coordinate system parsed for every mosaic data set and add step versus once per process
+#              (spatialReferences), over the creation and <days> daily updates of every mosaic data set
+#           9/ watch: <count> raster files copied slowly (in two halves) into source folders while
+#              watchMosaicDatasets.watch polls them; delay from end of copy to catalog, and no half copied file added
+#           10/ locks: daily update while another application holds a schema lock on a geo database for <seconds>,
+#              failing at once versus trying again with backoff (gpRetry)
+#           11/ reconcile: new NoData for mosaic data sets of <days> rasters, deleted, created and filled again
+#              versus reconciled in place (createMosaicDatasets.py RECONCILE)
+#           12/ headers: GeoTIFF headers of <count> synthetic rasters read by geotiffHeader, and daily update of
+#              mosaic data sets of <count> rasters with the boundary and cell size ranges computed again versus kept
+#              when the new rasters lie on the grid of the mosaic (mosaicGrid)
+#           13/ integrity: <count> new raster files, some of them truncated or not TIFF files, checked before the add
+#              step (rasterIntegrity) with 1 to 16 threads, reading each header through a simulated network drive
+#           14/ sweep: mosaic data sets of <days> rasters, some of them deleted, overwritten or with stale pyramids,
+#              checked by AnalyzeMosaicDataset versus swept (catalogHealth), then repaired and swept again
+#           15/ statistics: a season of <days> synthetic rasters (numpy arrays) arriving one a day, statistics of the
+#              mosaic computed again from every cell versus merged from per raster statistics (itemStatistics)
+#           16/ dates: mosaic data sets of <days> rasters, dates available in a month and latest date of a PARAMNAME
+#              asked to the catalog (search cursor) versus to the temporal index of the update scripts (temporalIndex)
+#
+# Note:     Tool latencies are simulated with time.sleep, so figures measure scheduling, not arcpy itself.
+#
+# Usage:    python benchmarkUpdates.py <scenario> [<workers>|<days>|<count>|<seconds>]
+# Example:  python benchmarkUpdates.py scheduler 4
+
+import datetime
+import logging
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+import catalogHealth
+import catalogQuery
+import createMosaicDatasets
+import fieldWriter
+import folderManifest
+import geotiffHeader
+import gpBackend
+import gpRetry
+import itemStatistics
+import mosaicGrid
+import mosaicSchema
+import rasterIntegrity
+import rasterNames
+import rasterPreprocessing
+import runCheckpoint
+import spatialReferences
+import sweepMosaicDatasets
+import temporalIndex
+import toolMetrics
+import updateAllMosaicDatasets
+import updateMosaicDatasets
+import watchMosaicDatasets
+
+COUNTRIES = ["IT", "ES", "GR", "GM"]
+PARAMETERS = ["NDVI", "TMAX", "TMIN", "RAD"]
+LATENCY = {"add_rasters": 0.2, "get_count": 0.05, "update_cursor": 0.05, "search_cursor": 0.01,
+           "calculate_fields": 0.2, "update_row": 0.001, "build_pyramids_and_statistics": 0.05,
+           "create_mosaic_dataset": 0.5, "delete_mosaic": 0.1, "copy": 0.2, "define_nodata": 0.1,
+           "add_fields": 0.1, "assign_default": 0.1, "spatial_reference": 0.01, "calculate_statistics": 0.1,
+           "analyze_mosaic": 0.1}
+ITEM_LATENCY = {"add_rasters": 0.02, "add_fields": 0.05}
+GRID_ITEM_LATENCY = {"update_boundary": 0.002, "update_cell_sizes": 0.001}  # per catalog item, headers scenario
+SWEEP_LATENCY = {"export_paths": 0.2}  # sweep scenario
+SWEEP_ITEM_LATENCY = {"analyze_mosaic": 0.01, "export_paths": 0.0002}  # per catalog item, sweep scenario
+
+
+def make_rasters(_folder, _filenames):
+    """Create small GeoTIFF files, all alike: only their names matter to the simulator. They were last modified an
+    hour ago, as rasters copied before the update starts
+
+    :param _folder:
+    :param _filenames:
+    :return:
+    """
+    if not os.path.isdir(_folder):
+        os.makedirs(_folder)
+    data = geotiff_bytes()
+    modified = time.time() - 3600
+    for filename in _filenames:
+        path = os.path.join(_folder, filename)
+        with open(path, "wb") as f:
+            f.write(data)
+        os.utime(path, (modified, modified))
+
+
+def geotiff_bytes(_width=64, _height=32, _cell_size=500.0, _origin=(300000.0, 4600000.0), _nodata="-32768"):
+    """Content of a little endian GeoTIFF of 16 bit signed zeros in a single strip, projected in UTM 32N (EPSG 32632)
+
+    :param _width:
+    :param _height:
+    :param _cell_size:
+    :param _origin: coordinates of the upper left corner
+    :param _nodata:
+    :return: bytes
+    """
+    pixels = b"\0" * (_width * _height * 2)
+    nodata = _nodata.encode("ascii") + b"\0"
+    # (tag, field type, values). Values of more than 4 bytes are written after the directory
+    entries = [(256, 3, [_width]), (257, 3, [_height]), (258, 3, [16]), (259, 3, [1]), (262, 3, [1]),
+               (273, 4, [0]), (277, 3, [1]), (278, 3, [_height]), (279, 4, [len(pixels)]), (339, 3, [2]),
+               (33550, 12, [_cell_size, _cell_size, 0.0]), (33922, 12, [0.0, 0.0, 0.0, _origin[0], _origin[1], 0.0]),
+               (34735, 3, [1, 1, 0, 2, 1024, 0, 1, 1, 3072, 0, 1, 32632]), (42113, 2, nodata)]
+    formats = {3: "H", 4: "I", 12: "d"}
+    offset = 8 + 2 + 12 * len(entries) + 4  # values written after the directory start here
+    directory, blocks = [], []
+    for tag, field_type, values in entries:
+        data = values if field_type == 2 else struct.pack("<%d%s" % (len(values), formats[field_type]), *values)
+        if len(data) > 4:
+            directory.append([tag, field_type, len(values), struct.pack("<I", offset)])
+            blocks.append(data)
+            offset += len(data)
+        else:
+            directory.append([tag, field_type, len(values), data.ljust(4, b"\0")])
+    directory[[entry[0] for entry in directory].index(273)][3] = struct.pack("<I", offset)  # pixels come last
+    return b"".join([b"II", struct.pack("<HIH", 42, 8, len(entries))] +
+                    [struct.pack("<HHI4s", *entry) for entry in directory] + [struct.pack("<I", 0)] + blocks + [pixels])
+
+
+def write_geotiff(_path, **_options):
+    """Write a GeoTIFF file, see geotiff_bytes for _options"""
+    with open(_path, "wb") as f:
+        f.write(geotiff_bytes(**_options))
+
+
+def make_workspace(_root, _days=10):
+    """Create source folders, folders files and empty mosaic data sets for every country and parameter
+
+    :param _root:
+    :param _days: number of daily rasters per source folder
+    :return: (env_path, list of folders files, stub backend options)
+    """
+    env_path = os.path.join(_root, "products")
+    options = {"_root": os.path.join(_root, "gdb"), "_latency": LATENCY, "_item_latency": ITEM_LATENCY}
+    os.makedirs(options["_root"])
+    gp = gpBackend.create_backend("stub", **options)
+
+    mosaics_filenames = []
+    for country in COUNTRIES:
+        database_name = "%s_2016.gdb" % country
+        database_path = os.path.join(env_path, country, database_name)
+        lines = []
+        for parameter in PARAMETERS:
+            source_folder = os.path.join(_root, "data", country, "2016", parameter)
+            make_rasters(source_folder, ["%s_Monitoring_%s_2016_%03d.tif" % (country, parameter, day)
+                                         for day in range(1, _days + 1)])
+            mosaic_name = "REGIONAL_MONITORING_%s" % parameter
+            gp.create_mosaic(database_path, mosaic_name)
+            lines.append(";".join([source_folder, database_name, mosaic_name, "32767"]))
+        mosaics_filename = os.path.join(_root, "%s_2016_folders.txt" % country)
+        with open(mosaics_filename, "w") as f:
+            f.write("\n".join(lines))
+        mosaics_filenames.append(mosaics_filename)
+    return env_path, mosaics_filenames, options
+
+
+def benchmark_scheduler(_workers):
+    """Update the same synthetic workspace sequentially and with _workers processes
+
+    :param _workers:
+    :return:
+    """
+    timings = []
+    for workers in [1, _workers]:
+        root = tempfile.mkdtemp(prefix="ermes_benchmark_")
+        try:
+            env_path, mosaics_filenames, options = make_workspace(root)
+            log_filename = os.path.join(root, "benchmark.log")
+            updateMosaicDatasets.init_worker("stub", options, env_path, log_filename)
+            jobs = []
+            for mosaics_filename in mosaics_filenames:
+                jobs.extend(updateMosaicDatasets.read_jobs(env_path, mosaics_filename))
+
+            start = time.time()
+            updateMosaicDatasets.mosaicScheduler.run_jobs(
+                jobs, updateMosaicDatasets.update_job, workers,
+                _initializer=updateMosaicDatasets.init_worker,
+                _initargs=("stub", options, env_path, log_filename))
+            elapsed = time.time() - start
+            timings.append(elapsed)
+            print("%d mosaic data sets, %d geo databases, %d worker(s): %.2f s"
+                  % (len(jobs), len(COUNTRIES), workers, elapsed))
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+    print("Speedup: %.2fx" % (timings[0] / timings[1]))
+
+
+def benchmark_manifest(_days):
+    """Time the update of a day in which only one raster arrives per source folder, with and without manifests
+
+    :param _days: rasters already in every mosaic data set
+    :return:
+    """
+    for use_manifests in [False, True]:
+        root = tempfile.mkdtemp(prefix="ermes_benchmark_")
+        try:
+            env_path, mosaics_filenames, options = make_workspace(root, _days)
+            log_filename = os.path.join(root, "benchmark.log")
+            updateMosaicDatasets.init_worker("stub", options, env_path, log_filename)
+            gp = updateMosaicDatasets.gp
+            manifest_folder = updateMosaicDatasets.manifest_folder if use_manifests else None
+            jobs = []
+            for mosaics_filename in mosaics_filenames:
+                jobs.extend(updateMosaicDatasets.read_jobs(env_path, mosaics_filename))
+            for database_path, mosaic_name, source_folder in jobs:
+                updateMosaicDatasets.update_mosaic(database_path, mosaic_name, source_folder, manifest_folder)
+
+            # Next day: one new raster in every source folder
+            for database_path, mosaic_name, source_folder in jobs:
+                country = os.path.basename(os.path.dirname(database_path))
+                parameter = os.path.basename(source_folder)
+                make_rasters(source_folder, ["%s_Monitoring_%s_2016_%03d.tif" % (country, parameter, _days + 1)])
+            gp.calls.clear()
+            start = time.time()
+            for database_path, mosaic_name, source_folder in jobs:
+                updateMosaicDatasets.update_mosaic(database_path, mosaic_name, source_folder, manifest_folder)
+            elapsed = time.time() - start
+            print("%d mosaic data sets of %d rasters, manifests %s: %.2f s, tool calls %s"
+                  % (len(jobs), _days, "on" if use_manifests else "off", elapsed, dict(gp.calls)))
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+def benchmark_new_rows(_days):
+    """Count tool calls and time spent per mosaic data set to find out the entries added by the add step
+
+    :param _days: rasters added to every mosaic data set
+    :return:
+    """
+    root = tempfile.mkdtemp(prefix="ermes_benchmark_")
+    try:
+        env_path, mosaics_filenames, options = make_workspace(root, _days)
+        gp = gpBackend.create_backend("stub", **options)
+        jobs = []
+        for mosaics_filename in mosaics_filenames:
+            jobs.extend(updateMosaicDatasets.read_jobs(env_path, mosaics_filename))
+
+        timings = {"GetCount before/after": 0.0, "catalogQuery.new_rows": 0.0}
+        calls = {}
+        for database_path, mosaic_name, source_folder in jobs:
+            mosaic_path = os.path.join(database_path, mosaic_name)
+
+            gp.calls.clear()
+            start = time.time()
+            counts_before = gp.get_count(mosaic_path)
+            timings["GetCount before/after"] += time.time() - start
+            gp.add_rasters(mosaic_path, source_folder)
+            start = time.time()
+            counts_after = gp.get_count(mosaic_path)
+            timings["GetCount before/after"] += time.time() - start
+            calls["GetCount before/after"] = dict(gp.calls)
+
+            gp.calls.clear()
+            start = time.time()
+            rows = catalogQuery.new_rows(gp, mosaic_path, ["Name"], catalogQuery.sentinel_clause(gp, database_path))
+            timings["catalogQuery.new_rows"] += time.time() - start
+            calls["catalogQuery.new_rows"] = dict(gp.calls)
+            assert len(rows) == counts_after - counts_before
+        for method in sorted(timings):
+            print("%s: %.3f s per mosaic data set, tool calls per mosaic data set %s"
+                  % (method, timings[method] / len(jobs), calls[method]))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def benchmark_names(_count):
+    """Parse _count raster names as the update scripts did (split and date computation per row) and with rasterNames
+
+    :param _count:
+    :return:
+    """
+    names = ["IT_Monitoring_NDVI_%d_%03d" % (2016 - i % 3, i % 365 + 1) for i in range(_count)]
+
+    start = time.time()
+    split_values = []
+    for raster_filename in names:
+        parts = raster_filename.split("_")
+        day = int(parts[4])
+        date_value = datetime.datetime(int(parts[3]), 1, 1) + datetime.timedelta(day - 1)
+        split_values.append((parts[2], parts[3], date_value.strftime('%Y/%m/%d'), date_value))
+    split_time = time.time() - start
+
+    start = time.time()
+    raster_names, unparsed = rasterNames.parse_names(names, rasterNames.MONITORING)
+    parse_time = time.time() - start
+
+    assert not unparsed and [raster_name[1:] for raster_name in raster_names] == split_values
+    print("%d names, split per row: %.2f s" % (_count, split_time))
+    print("%d names, rasterNames: %.2f s (%.2fx)" % (_count, parse_time, split_time / parse_time))
+
+
+def benchmark_writes(_days):
+    """Write custom fields of every row of an LTA mosaic data set with a per row cursor and with fieldWriter
+
+    :param _days: days of year per statistic (avg and std)
+    :return:
+    """
+    root = tempfile.mkdtemp(prefix="ermes_benchmark_")
+    try:
+        gp = gpBackend.create_backend("stub", _root=root, _latency=LATENCY, _item_latency=ITEM_LATENCY)
+        database_path = os.path.join(root, "IT", "IT_2016.gdb")
+        gp.create_mosaic(database_path, "REGIONAL_MONITORING_NDVI_LTA")
+        mosaic_path = os.path.join(database_path, "REGIONAL_MONITORING_NDVI_LTA")
+        gp.add_rasters(mosaic_path, ["IT_%s_Monitoring_NDVI_2003_2015_%03d.tif" % (statistic, day)
+                                     for statistic in ["avg", "std"] for day in range(1, _days + 1)])
+        gp.env.workspace = database_path
+        parse = rasterNames.parser_of(rasterNames.LTA)
+
+        gp.calls.clear()
+        start = time.time()
+        with gp.update_cursor(mosaic_path, ["Name"] + fieldWriter.CUSTOM_FIELDS) as cursor:
+            for row in cursor:
+                raster_name = parse(row[0])
+                row[1:] = [raster_name.paramname, raster_name.year, raster_name.sdate, raster_name.date]
+                cursor.updateRow(row)
+        print("%d rows, update cursor per row: %.2f s, tool calls %s"
+              % (2 * _days, time.time() - start, dict(gp.calls)))
+
+        with gp.update_cursor(mosaic_path, ["OID@"] + fieldWriter.CUSTOM_FIELDS) as cursor:
+            for row in cursor:
+                cursor.updateRow([row[0], catalogQuery.SENTINEL_VALUE, None, None, None])  # new rows again
+
+        gp.calls.clear()
+        start = time.time()
+        new_entries_expr = catalogQuery.sentinel_clause(gp, database_path)  # as the update scripts
+        values, unparsed = fieldWriter.compute_values(catalogQuery.new_rows(gp, mosaic_path, ["Name"],
+                                                                            new_entries_expr), parse)
+        bulk_rows, cursor_rows = fieldWriter.write_values(gp, mosaic_path, fieldWriter.CUSTOM_FIELDS, values,
+                                                          new_entries_expr)
+        print("%d rows, fieldWriter (%d in bulk, %d with cursor): %.2f s, tool calls %s"
+              % (2 * _days, bulk_rows, cursor_rows, time.time() - start, dict(gp.calls)))
+        with gp.search_cursor(mosaic_path, ["OID@"] + fieldWriter.CUSTOM_FIELDS) as cursor:
+            written = dict((row[0], tuple(row[1:])) for row in cursor)
+        assert not unparsed and len(values) == 2 * _days and bulk_rows + cursor_rows == len(values)
+        assert all(written[object_id] == values[object_id] for object_id in values), "custom fields not written"
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def benchmark_preprocess(_workers):
+    """Update the same synthetic workspace with pyramids and statistics built inline and beforehand
+
+    :param _workers:
+    :return:
+    """
+    for preprocess in [False, True]:
+        root = tempfile.mkdtemp(prefix="ermes_benchmark_")
+        try:
+            env_path, mosaics_filenames, options = make_workspace(root)
+            log_filename = os.path.join(root, "benchmark.log")
+            updateMosaicDatasets.init_worker("stub", options, env_path, log_filename)
+            jobs = []
+            for mosaics_filename in mosaics_filenames:
+                jobs.extend(updateMosaicDatasets.read_jobs(env_path, mosaics_filename))
+
+            start = time.time()
+            add_parameters = {}
+            if preprocess:
+                rasters = updateMosaicDatasets.pending_rasters(jobs)
+                rasterPreprocessing.preprocess(rasters, _workers, "stub", options)
+                add_parameters = rasterPreprocessing.REGISTER_ONLY
+            for database_path, mosaic_name, source_folder in jobs:
+                updateMosaicDatasets.update_mosaic(database_path, mosaic_name, source_folder, None, add_parameters)
+            print("%d mosaic data sets, pyramids and statistics %s: %.2f s"
+                  % (len(jobs), "beforehand with %d workers" % _workers if preprocess else "inline",
+                     time.time() - start))
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+def benchmark_create(_workers):
+    """Create the mosaic data sets of every country from scratch and from a template, with 1 and _workers processes
+
+    :param _workers:
+    :return:
+    """
+    for use_template, workers in [(False, 1), (True, 1), (True, _workers)]:
+        root = tempfile.mkdtemp(prefix="ermes_benchmark_")
+        try:
+            env_path, mosaics_filenames, options = make_workspace(root, 0)
+            log_filename = os.path.join(root, "benchmark.log")
+            createMosaicDatasets.init_worker("stub", options, env_path, log_filename, use_template)
+            jobs = []
+            for mosaics_filename in mosaics_filenames:
+                jobs.extend(createMosaicDatasets.read_jobs(env_path, mosaics_filename))
+
+            start = time.time()
+            createMosaicDatasets.mosaicScheduler.run_jobs(
+                jobs, createMosaicDatasets.create_job, workers,
+                _initializer=createMosaicDatasets.init_worker,
+                _initargs=("stub", options, env_path, log_filename, use_template))
+            if use_template:
+                createMosaicDatasets.delete_templates(jobs)
+            print("%d mosaic data sets, %s, %d worker(s): %.2f s"
+                  % (len(jobs), "from template" if use_template else "from scratch", workers,
+                     time.time() - start))
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+def benchmark_reconcile(_days):
+    """Apply the NoData value of the folders files to mosaic data sets already holding _days rasters, by creating
+    them again and adding their rasters again, and by reconciling them in place
+
+    :param _days:
+    :return:
+    """
+    for reconcile in [False, True]:
+        root = tempfile.mkdtemp(prefix="ermes_benchmark_")
+        try:
+            env_path, mosaics_filenames, options = make_workspace(root, _days)
+            log_filename = os.path.join(root, "benchmark.log")
+            updateMosaicDatasets.init_worker("stub", options, env_path, log_filename)
+            createMosaicDatasets.init_worker("stub", options, env_path, log_filename, False, reconcile)
+            gp = createMosaicDatasets.gp
+            jobs = []
+            for mosaics_filename in mosaics_filenames:
+                jobs.extend(updateMosaicDatasets.read_jobs(env_path, mosaics_filename))
+            for job in jobs:
+                updateMosaicDatasets.update_job(job)
+
+            create_jobs = []
+            for mosaics_filename in mosaics_filenames:
+                create_jobs.extend(createMosaicDatasets.read_jobs(env_path, mosaics_filename))
+            start = time.time()
+            for job in create_jobs:
+                createMosaicDatasets.create_job(job)
+            if not reconcile:
+                updateMosaicDatasets.manifest_folder = None  # manifests no longer match the new catalogs
+                for job in jobs:
+                    updateMosaicDatasets.update_job(job)
+            elapsed = time.time() - start
+            items = sum(gp.get_count(os.path.join(job[0], job[1])) for job in jobs)
+            print("%d mosaic data sets of %d rasters, %s: %.2f s, %d catalog items"
+                  % (len(jobs), _days, "reconciled" if reconcile else "created and filled again", elapsed, items))
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+def benchmark_headers(_count):
+    """Time the reading of GeoTIFF headers, and the update of a day in which one raster arrives per source folder
+    with the boundary and cell size ranges computed again over the whole catalog versus kept (mosaicGrid)
+
+    :param _count: rasters read, and rasters already in every mosaic data set
+    :return:
+    """
+    root = tempfile.mkdtemp(prefix="ermes_benchmark_")
+    try:
+        paths = [os.path.join(root, "IT_Monitoring_NDVI_%05d.tif" % number) for number in range(_count)]
+        make_rasters(root, [os.path.basename(path) for path in paths])
+        start = time.time()
+        headers = [geotiffHeader.read_header(path) for path in paths]
+        elapsed = time.time() - start
+        print("%d GeoTIFF headers read in %.3f s, %.1f us per header: %s x %s cells of %s, %s, NoData %s"
+              % (len(headers), elapsed, 1e6 * elapsed / len(headers), headers[0].width, headers[0].height,
+                 headers[0].cell_size, headers[0].pixel_type, headers[0].nodata))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    for use_grid in [False, True]:
+        root = tempfile.mkdtemp(prefix="ermes_benchmark_")
+        try:
+            env_path, mosaics_filenames, options = make_workspace(root, _count)
+            # Mosaic data sets filled without latency, only the next day is timed
+            log_filename = os.path.join(root, "benchmark.log")
+            updateMosaicDatasets.init_worker("stub", dict(options, _latency={}, _item_latency={}), env_path,
+                                             log_filename)
+            manifest_folder = updateMosaicDatasets.manifest_folder
+            jobs = []
+            for mosaics_filename in mosaics_filenames:
+                jobs.extend(updateMosaicDatasets.read_jobs(env_path, mosaics_filename))
+            for database_path, mosaic_name, source_folder in jobs:
+                updateMosaicDatasets.update_mosaic(database_path, mosaic_name, source_folder, manifest_folder)
+            if not use_grid:
+                for filename in os.listdir(manifest_folder):
+                    if filename.endswith(mosaicGrid.GRID_EXTENSION):
+                        os.remove(os.path.join(manifest_folder, filename))
+
+            # Next day: one new raster in every source folder, on the grid of the others
+            for database_path, mosaic_name, source_folder in jobs:
+                country = os.path.basename(os.path.dirname(database_path))
+                parameter = os.path.basename(source_folder)
+                make_rasters(source_folder, ["%s_Monitoring_%s_2016_%03d.tif" % (country, parameter, _count + 1)])
+            item_latency = dict(ITEM_LATENCY, **GRID_ITEM_LATENCY)
+            updateMosaicDatasets.init_worker("stub", dict(options, _item_latency=item_latency), env_path, log_filename)
+            gp = updateMosaicDatasets.gp
+            start = time.time()
+            for database_path, mosaic_name, source_folder in jobs:
+                updateMosaicDatasets.update_mosaic(database_path, mosaic_name, source_folder, manifest_folder)
+            elapsed = time.time() - start
+            print("%d mosaic data sets of %d rasters, grid signature %s: %.2f s, boundary updates %d, "
+                  "cell size updates %d" % (len(jobs), _count, "on" if use_grid else "off", elapsed,
+                                            gp.calls["update_boundary"], gp.calls["update_cell_sizes"]))
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+def benchmark_integrity(_count):
+    """Check _count new raster files, one in ten truncated and one in twenty not a TIFF file, with 1 to 16 threads.
+    Every header is read through a simulated network drive (10 ms per file). Broken files are then moved to
+    quarantine
+
+    :param _count:
+    :return:
+    """
+    root = tempfile.mkdtemp(prefix="ermes_benchmark_")
+    read_header = geotiffHeader.read_header
+
+    def network_read_header(_path):
+        time.sleep(0.01)
+        return read_header(_path)
+
+    try:
+        logging.basicConfig(level=logging.INFO, filename=os.path.join(root, "benchmark.log"))
+        source_folder = os.path.join(root, "data")
+        filenames = ["IT_Monitoring_NDVI_2016_%03d_%d.tif" % (number % 366 + 1, number) for number in range(_count)]
+        make_rasters(source_folder, filenames)
+        data = geotiff_bytes()
+        for number, filename in enumerate(filenames):
+            if number % 10 == 5:
+                with open(os.path.join(source_folder, filename), "wb") as f:
+                    f.write(data[:len(data) // 2])  # copy cut short
+            elif number % 20 == 7:
+                with open(os.path.join(source_folder, filename), "wb") as f:
+                    f.write(b"<html>Proxy error</html>")
+        modified = time.time() - 3600
+        for filename in filenames:
+            os.utime(os.path.join(source_folder, filename), (modified, modified))
+        scan = folderManifest.scan_folder(source_folder)
+
+        geotiffHeader.read_header = network_read_header
+        try:
+            for workers in [1, 2, 4, 8, 16]:
+                start = time.time()
+                validation = rasterIntegrity.validate(source_folder, filenames, scan, workers)
+                elapsed = time.time() - start
+                print("%d raster files checked with %2d threads: %.2f s, %.0f files/s, %d clean, %d held back, "
+                      "%d broken" % (_count, workers, elapsed, _count / elapsed, len(validation.clean),
+                                     len(validation.held_back), len(validation.bad)))
+        finally:
+            geotiffHeader.read_header = read_header
+        moved = rasterIntegrity.quarantine(source_folder, validation.bad, os.path.join(root, "quarantine"))
+        reasons = sorted(set(reason.split(":")[0] for reason in validation.bad.values()))
+        print("%d broken files moved to quarantine (%s), %d raster files left for the add step"
+              % (len(moved), ", ".join(reasons), len(folderManifest.scan_folder(source_folder))))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def benchmark_sweep(_days):
+    """Delete, overwrite and touch some raster files of mosaic data sets of _days rasters, then time the checks of
+    AnalyzeMosaicDataset against the sweep of catalogHealth. Items are then removed or repaired, the next update adds
+    the overwritten rasters again and a second sweep finds every item sound
+
+    :param _days:
+    :return:
+    """
+    root = tempfile.mkdtemp(prefix="ermes_benchmark_")
+    try:
+        env_path, mosaics_filenames, options = make_workspace(root, _days)
+        log_filename = os.path.join(root, "benchmark.log")
+        updateMosaicDatasets.init_worker("stub", dict(options, _latency={}, _item_latency={}), env_path, log_filename)
+        jobs = []
+        for mosaics_filename in mosaics_filenames:
+            jobs.extend(updateMosaicDatasets.read_jobs(env_path, mosaics_filename))
+        for job in jobs:
+            updateMosaicDatasets.update_job(job)
+
+        # A raster deleted, one overwritten and one with pyramids and statistics older than the raster per folder
+        earlier = time.time() - 7200
+        for database_path, mosaic_name, source_folder in jobs:
+            rasters = sorted(filename for filename in os.listdir(source_folder) if filename.endswith(".tif"))
+            os.remove(os.path.join(source_folder, rasters[0]))
+            with open(os.path.join(source_folder, rasters[1]), "ab") as f:
+                f.write(b"\0" * 100)
+            for extension in catalogHealth.SIDECAR_EXTENSIONS:
+                os.utime(os.path.join(source_folder, rasters[2] + extension), (earlier, earlier))
+
+        latency = dict(LATENCY, **SWEEP_LATENCY)
+        item_latency = dict(ITEM_LATENCY, **SWEEP_ITEM_LATENCY)
+        updateMosaicDatasets.init_worker("stub", dict(options, _latency=latency, _item_latency=item_latency),
+                                         env_path, log_filename)
+        gp = sweepMosaicDatasets.gp = updateMosaicDatasets.gp
+        manifest_folder = updateMosaicDatasets.manifest_folder
+        start = time.time()
+        for database_path, mosaic_name, source_folder in jobs:
+            gp.analyze_mosaic(os.path.join(database_path, mosaic_name), mosaicSchema.ANALYZE_KEYWORDS)
+        print("%d mosaic data sets of %d rasters, AnalyzeMosaicDataset: %.2f s"
+              % (len(jobs), _days, time.time() - start))
+        for options in [{}, {"_remove": True, "_repair": True}]:
+            start = time.time()
+            found = [sweepMosaicDatasets.sweep_mosaic(database_path, mosaic_name, manifest_folder, **options)
+                     for database_path, mosaic_name, source_folder in jobs]
+            elapsed = time.time() - start
+            print("%d mosaic data sets of %d rasters, sweep%s: %.2f s, %d missing, %d modified, %d stale"
+                  % (len(jobs), _days, " and repair" if options else "", elapsed,
+                     sum(len(health.missing) for health in found), sum(len(health.modified) for health in found),
+                     sum(len(health.stale) for health in found)))
+        for job in jobs:
+            updateMosaicDatasets.update_job(job)
+        found = [sweepMosaicDatasets.sweep_mosaic(database_path, mosaic_name, manifest_folder)
+                 for database_path, mosaic_name, source_folder in jobs]
+        print("After the next update: %d catalog items, %d missing, %d modified, %d stale"
+              % (sum(health.items for health in found), sum(len(health.missing) for health in found),
+                 sum(len(health.modified) for health in found), sum(len(health.stale) for health in found)))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def benchmark_statistics(_days):
+    """Add one synthetic raster a day (256 x 256 cells of 32 bit floats, one in ten NoData) for _days days, and time
+    the statistics of the mosaic at some days: computed again from every cell, as CalculateStatistics over the
+    footprint, versus the statistics of the new raster merged with those kept for the others (itemStatistics).
+    Histograms of the rasters have ranges of their own, rebinned by the merge: the largest difference with the
+    histogram of every cell is printed, as a share of the cells
+
+    :param _days:
+    :return:
+    """
+    if itemStatistics.numpy is None:
+        sys.exit("The statistics scenario requires numpy")
+    numpy = itemStatistics.numpy
+    nodata = -32768.0
+    generator = numpy.random.RandomState(2016)
+    arrays, items = [], []
+    reports = sorted(set([1, 30, 90, 180, _days]) & set(range(1, _days + 1)))
+    for day in range(1, _days + 1):
+        array = numpy.clip(generator.normal(0.2 + 0.3 * numpy.sin(day / 58.0), 0.2, (256, 256)), -1.0, 1.0)
+        array = array.astype(numpy.float32)
+        array[generator.random_sample(array.shape) < 0.1] = nodata
+        arrays.append(array)
+
+        start = time.time()
+        items.append(itemStatistics.item_statistics(itemStatistics.valid_cells(array, nodata)))
+        merged = itemStatistics.merge(items)
+        incremental = time.time() - start
+        if day not in reports:
+            continue
+
+        start = time.time()
+        values = numpy.concatenate([itemStatistics.valid_cells(each, nodata) for each in arrays])
+        histogram = numpy.histogram(values, bins=itemStatistics.BINS, range=merged["range"])[0]
+        full = {"min": values.min(), "max": values.max(), "mean": values.mean(), "std": values.std()}
+        full_seconds = time.time() - start
+        difference = max(abs(merged[key] - full[key]) / max(abs(full[key]), 1e-12) for key in full)
+        histogram_difference = numpy.abs(histogram - numpy.array(merged["histogram"])).max() / float(len(values))
+        print("Day %3d, %9d cells: every cell %7.1f ms, merged %5.2f ms (x%.0f), relative difference %.1e, "
+              "histogram bins %.1e" % (day, merged["count"], 1000 * full_seconds, 1000 * incremental,
+                                       full_seconds / incremental, difference, histogram_difference))
+
+
+def benchmark_dates(_days):
+    """Ask which dates of May are available and which is the latest date of NDVI, to the catalog of a mosaic data set
+    of _days rasters (search cursor through every row, as the web application does) and to its temporal index, opened
+    for every question. Indexes are built by a first update and kept up to date by the update of the next day. Every
+    index is checked against the catalog, as updated and once rebuilt from it
+
+    :param _days:
+    :return:
+    """
+    root = tempfile.mkdtemp(prefix="ermes_benchmark_")
+    try:
+        env_path, mosaics_filenames, options = make_workspace(root, _days)
+        log_filename = os.path.join(root, "benchmark.log")
+        updateMosaicDatasets.init_worker("stub", dict(options, _latency={}, _item_latency={}), env_path, log_filename)
+        gp = updateMosaicDatasets.gp
+        jobs = updateMosaicDatasets.read_jobs(env_path, mosaics_filenames[0])
+        for job in jobs:
+            updateMosaicDatasets.update_job(job)
+        for database_path, mosaic_name, source_folder in jobs:
+            country = os.path.basename(os.path.dirname(database_path))
+            make_rasters(source_folder, ["%s_Monitoring_%s_2016_%03d.tif" % (country, os.path.basename(source_folder),
+                                                                               _days + 1)])
+        start = time.time()
+        for job in jobs:
+            updateMosaicDatasets.update_job(job)
+        print("Next day update of %d mosaic data sets with temporal indexes: %.2f s"
+              % (len(jobs), time.time() - start))
+
+        # Indexes kept up to date from the values written by fieldWriter, then rebuilt: both as in the catalog
+        def index_entries(_index_path):
+            with temporalIndex.TemporalIndex(_index_path) as index:
+                return dict((paramname, index.dates(paramname)) for paramname in index.paramnames())
+
+        for rebuild in [False, True]:
+            for database_path, mosaic_name, _ in jobs:
+                mosaic_path = os.path.join(database_path, mosaic_name)
+                index_path = temporalIndex.index_path(folderManifest.manifest_path(
+                    updateMosaicDatasets.manifest_folder, database_path, mosaic_name))
+                if rebuild:
+                    temporalIndex.update(gp, mosaic_path, index_path, {}, _rebuild=True)
+                catalog = {}
+                with gp.search_cursor(mosaic_path, ["OID@", "PARAMNAME", "DATE"]) as cursor:
+                    for object_id, paramname, date in cursor:
+                        catalog.setdefault(paramname, []).append((date.date(), object_id))
+                assert index_entries(index_path) == dict((paramname, sorted(entries))
+                                                         for paramname, entries in catalog.items()), mosaic_name
+        print("Temporal indexes as in the catalog, updated and rebuilt: True")
+
+        database_path, mosaic_name, _ = [job for job in jobs if job[1].endswith("NDVI")][0]
+        mosaic_path = os.path.join(database_path, mosaic_name)
+        index_path = temporalIndex.index_path(folderManifest.manifest_path(updateMosaicDatasets.manifest_folder,
+                                                                           database_path, mosaic_name))
+        first, last = datetime.date(2016, 5, 1), datetime.date(2016, 5, 31)
+        paramname_expr = "%s = 'NDVI'" % gp.add_field_delimiters(database_path, "PARAMNAME")
+
+        def catalog_questions():
+            with gp.search_cursor(mosaic_path, ["OID@", "DATE"], paramname_expr) as cursor:
+                rows = [(date.date(), object_id) for object_id, date in cursor]
+            in_may = sorted(row for row in rows if first <= row[0] <= last)
+            return in_may, max(rows)
+
+        def index_questions():
+            with temporalIndex.TemporalIndex(index_path) as index:
+                return index.dates("NDVI", first, last), index.latest("NDVI")[0]
+
+        open_index = temporalIndex.TemporalIndex(index_path)
+
+        def open_index_questions():
+            return open_index.dates("NDVI", first, last), open_index.latest("NDVI")[0]
+
+        results = []
+        for name, questions, repeat in [("catalog", catalog_questions, 200),
+                                        ("temporal index opened per question", index_questions, 5000),
+                                        ("temporal index kept open", open_index_questions, 5000)]:
+            start = time.time()
+            for _ in range(repeat):
+                answer = questions()
+            elapsed = (time.time() - start) / repeat
+            results.append(answer)
+            print("%s, %d items: dates of May (%d) and latest date (%s) in %.1f us"
+                  % (name, gp.get_count(mosaic_path), len(answer[0]), answer[1][0], 1e6 * elapsed))
+        open_index.close()
+        print("Same answers: %s (the catalog pays %.0f ms more per search cursor in LATENCY)"
+              % (results[0] == results[1] == results[2], 1000 * LATENCY["search_cursor"]))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def benchmark_projections(_days):
+    """Count coordinate system parsing (SpatialReference + loadFromString) and time spent creating every mosaic
+    data set and then updating them _days times, with the registry of spatialReferences cleared before every
+    mosaic data set (as if each one parsed its own) and kept
+
+    :param _days:
+    :return:
+    """
+    for use_registry in [False, True]:
+        root = tempfile.mkdtemp(prefix="ermes_benchmark_")
+        try:
+            env_path, mosaics_filenames, options = make_workspace(root, 1)
+            log_filename = os.path.join(root, "benchmark.log")
+            createMosaicDatasets.init_worker("stub", options, env_path, log_filename)
+            updateMosaicDatasets.gp = gp = createMosaicDatasets.gp
+            spatialReferences.clear()
+            jobs = []
+            for mosaics_filename in mosaics_filenames:
+                jobs.extend(updateMosaicDatasets.read_jobs(env_path, mosaics_filename))
+
+            start = time.time()
+            for database_path, mosaic_name, source_folder in jobs:
+                if not use_registry:
+                    spatialReferences.clear()
+                createMosaicDatasets.create_mosaic(database_path, mosaic_name, "32767")
+            for day in range(_days):
+                for database_path, mosaic_name, source_folder in jobs:
+                    if not use_registry:
+                        spatialReferences.clear()
+                    updateMosaicDatasets.update_mosaic(database_path, mosaic_name, source_folder)
+            print("%d mosaic data sets, %d updates, coordinate system parsed %s: %d parse(s), %.2f s"
+                  % (len(jobs), _days, "once per process" if use_registry else "per mosaic data set",
+                     gp.calls["spatial_reference"], time.time() - start))
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+def benchmark_watch(_count):
+    """Copy _count raster files into the source folders, each one in two halves 0.3 s apart, while watching them
+    (poll every 0.1 s, settle after 0.5 s). Print the delay from the end of each copy until its raster is in the
+    catalog, which must never be before the end of the copy
+
+    :param _count:
+    :return:
+    """
+    root = tempfile.mkdtemp(prefix="ermes_benchmark_")
+    try:
+        env_path, mosaics_filenames, options = make_workspace(root, 0)
+        options = dict(options, _latency={}, _item_latency={})
+        log_filename = os.path.join(root, "benchmark.log")
+        updateAllMosaicDatasets.init_worker("stub", options, env_path, log_filename)
+        jobs = []
+        for mosaics_filename in mosaics_filenames:
+            jobs.extend(updateAllMosaicDatasets.read_jobs(env_path, mosaics_filename))
+        reader = gpBackend.create_backend("stub", **options)  # catalogs seen from outside the watcher
+
+        rasterIntegrity.POLL_SECONDS = 0.2  # polls scaled down as the watch
+        data = geotiff_bytes()
+        copied = {}  # raster name --> end of copy
+        cataloged = {}  # raster name --> first time seen in the catalog
+
+        def copy_rasters():
+            for i in range(_count):
+                database_path, mosaic_name, source_folder, variant = jobs[i % len(jobs)]
+                name = "%s_Monitoring_%s_2016_%03d" % (os.path.basename(database_path)[:2],
+                                                       os.path.basename(source_folder), i // len(jobs) + 1)
+                with open(os.path.join(source_folder, name + ".tif"), "wb") as f:
+                    f.write(data[:len(data) // 2])
+                    f.flush()
+                    time.sleep(0.3)
+                    f.write(data[len(data) // 2:])
+                copied[name] = time.time()
+                time.sleep(0.05)
+
+        def sleep_and_look(_seconds):
+            time.sleep(_seconds)
+            for database_path, mosaic_name, source_folder, variant in jobs:
+                with reader.search_cursor(os.path.join(database_path, mosaic_name), ["Name"]) as cursor:
+                    for row in cursor:
+                        cataloged.setdefault(row[0], time.time())
+
+        writer = threading.Thread(target=copy_rasters)
+        writer.start()
+        polls = int((_count * 0.35 + 2) / 0.1)
+        updates = watchMosaicDatasets.watch(jobs, 0.1, 0.5, polls, sleep_and_look)
+        writer.join()
+
+        delays = sorted(cataloged[name] - copied[name] for name in copied if name in cataloged)
+        early = [delay for delay in delays if delay < 0]
+        print("%d raster files copied, %d cataloged by %d updates, %d before the end of their copy"
+              % (len(copied), len(delays), updates, len(early)))
+        if delays:
+            print("Delay from end of copy to catalog: median %.2f s, max %.2f s (poll 0.1 s, settle 0.5 s)"
+                  % (delays[len(delays) // 2], delays[-1]))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def benchmark_locks(_seconds):
+    """Update every mosaic data set while the first geo database is locked by another application for _seconds,
+    once failing at once and once trying again with backoff. Print mosaic data sets updated and time waited
+
+    :param _seconds:
+    :return:
+    """
+    for retry in [False, True]:
+        root = tempfile.mkdtemp(prefix="ermes_benchmark_")
+        try:
+            env_path, mosaics_filenames, options = make_workspace(root)
+            log_filename = os.path.join(root, "benchmark.log")
+            metrics_filename = toolMetrics.metrics_filename_of(log_filename)
+            updateMosaicDatasets.init_worker("stub", options, env_path, log_filename)
+            gp = updateMosaicDatasets.gp.gp  # instrumented, without retries
+            if retry:
+                gp = gpRetry.retrying(gp, metrics_filename, _base_delay=0.25, _max_delay=2.0, _deadline=10 * _seconds)
+            updateMosaicDatasets.gp = gp
+            jobs = []
+            for mosaics_filename in mosaics_filenames:
+                jobs.extend(updateMosaicDatasets.read_jobs(env_path, mosaics_filename))
+
+            # The image service holds a schema lock on the first geo database for _seconds
+            lock_path = gpBackend.create_backend("stub", **options).lock_path(jobs[0][0])
+            open(lock_path, "w").close()
+            release = threading.Timer(_seconds, os.remove, [lock_path])
+            release.start()
+            checkpoint = runCheckpoint.Checkpoint(runCheckpoint.checkpoint_filename_of(log_filename))
+            start = time.time()
+            outcomes = [checkpoint.run(updateMosaicDatasets.update_job, job) for job in jobs]
+            elapsed = time.time() - start
+            release.join()
+            waits = [record["seconds"] for record in toolMetrics.read_metrics(metrics_filename)
+                     if record["tool"].endswith(toolMetrics.LOCK_WAIT_SUFFIX)]
+            print("Lock of %s s, retries %s: %d of %d mosaic data sets updated in %.2f s, %d lock waits, %.2f s"
+                  % (_seconds, "on" if retry else "off", outcomes.count(runCheckpoint.DONE), len(jobs), elapsed,
+                     len(waits), sum(waits)))
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    SCENARIO = sys.argv[1]
+    if SCENARIO == "scheduler":
+        benchmark_scheduler(int(sys.argv[2]) if len(sys.argv) > 2 else len(COUNTRIES))
+    elif SCENARIO == "manifest":
+        benchmark_manifest(int(sys.argv[2]) if len(sys.argv) > 2 else 30)
+    elif SCENARIO == "newrows":
+        benchmark_new_rows(int(sys.argv[2]) if len(sys.argv) > 2 else 30)
+    elif SCENARIO == "names":
+        benchmark_names(int(sys.argv[2]) if len(sys.argv) > 2 else 1000000)
+    elif SCENARIO == "writes":
+        benchmark_writes(int(sys.argv[2]) if len(sys.argv) > 2 else 365)
+    elif SCENARIO == "preprocess":
+        benchmark_preprocess(int(sys.argv[2]) if len(sys.argv) > 2 else 4)
+    elif SCENARIO == "create":
+        benchmark_create(int(sys.argv[2]) if len(sys.argv) > 2 else len(COUNTRIES))
+    elif SCENARIO == "projections":
+        benchmark_projections(int(sys.argv[2]) if len(sys.argv) > 2 else 10)
+    elif SCENARIO == "watch":
+        benchmark_watch(int(sys.argv[2]) if len(sys.argv) > 2 else 20)
+    elif SCENARIO == "reconcile":
+        benchmark_reconcile(int(sys.argv[2]) if len(sys.argv) > 2 else 30)
+    elif SCENARIO == "headers":
+        benchmark_headers(int(sys.argv[2]) if len(sys.argv) > 2 else 365)
+    elif SCENARIO == "integrity":
+        benchmark_integrity(int(sys.argv[2]) if len(sys.argv) > 2 else 400)
+    elif SCENARIO == "sweep":
+        benchmark_sweep(int(sys.argv[2]) if len(sys.argv) > 2 else 365)
+    elif SCENARIO == "statistics":
+        benchmark_statistics(int(sys.argv[2]) if len(sys.argv) > 2 else 365)
+    elif SCENARIO == "dates":
+        benchmark_dates(int(sys.argv[2]) if len(sys.argv) > 2 else 365)
+    elif SCENARIO == "locks":
+        benchmark_locks(float(sys.argv[2]) if len(sys.argv) > 2 else 3)
+    else:
+        sys.exit("Unknown scenario: %s" % SCENARIO)
@@ -0,0 +1,195 @@
+# Author:   GEOTEC, UJI
+# Date:     March 2016
+#
+# Purpose:  Check the catalog items of a mosaic data set against their raster files in seconds, as a daily
+#           alternative to AnalyzeMosaicDataset_management with every checker keyword (see
+#           mosaicSchema.ANALYZE_KEYWORDS), which goes through every item and only reports.
+#           The paths of all items are exported at once (gp.export_paths) and their raster files are looked at by a
+#           pool of threads (os.stat only, nothing is opened). Each item is:
+#           1/ missing: its raster file no longer exists (moved, deleted, drive not mounted)
+#           2/ modified: its raster file has another size or modification time than when it was handed to the
+#              add step (see folderManifest); only known for mosaic data sets updated with manifests
+#           3/ stale: its pyramids (.ovr) or statistics (.aux.xml) are older than its raster file
+#           Missing items can be removed from the catalog (remove_missing), unless their folder is missing as well
+#           or more than MAX_MISSING_SHARE of the items are missing: an unmounted drive or a renamed source folder
+#           is logged as an error and nothing is removed. Modified items can be repaired: they are removed and
+#           forgotten by the manifest, so that the next update adds them again with their custom fields
+#           (forget_modified). Stale pyramids and statistics can be built again (rebuild_stale).
+#
+# Note:     The full analyze still catches what a look at the files cannot (footprints, functions, performance):
+#           keep it for a weekly deep check (sweepMosaicDatasets.py DEEP).
+#
+# Usage:    health = catalogHealth.sweep(gp, mosaic_path, manifest)
+#           catalogHealth.log_health(mosaic_path, health)
+#           catalogHealth.remove_missing(gp, mosaic_path, health)
+
+import collections
+import logging
+import multiprocessing.pool
+import os
+
+import fieldWriter
+
+WORKERS = 16  # threads looking at raster files at the same time
+MAX_IDS_PER_CLAUSE = 500  # OBJECTIDs per remove_rasters call
+MAX_MISSING_SHARE = 0.5  # above this share of missing items, none is removed (see remove_missing)
+SIDECAR_EXTENSIONS = [".ovr", ".aux.xml"]  # pyramids and statistics written next to a raster
+
+MISSING = "missing"
+MODIFIED = "modified"
+STALE = "stale"
+
+# Outcome of the sweep of a mosaic data set. items: number of catalog items,
+# missing, modified, stale: lists of (OBJECTID, path)
+Health = collections.namedtuple("Health", ["items", "missing", "modified", "stale"])
+
+
+def item_state(_arguments):
+    """State of the raster file of a catalog item, in a thread
+
+    :param _arguments: (path, [size, mtime] of the manifest or None)
+    :return: MISSING, MODIFIED, STALE, or None for a sound item
+    """
+    path, expected = _arguments
+    try:
+        stats = os.stat(path)
+    except OSError:
+        return MISSING
+    if expected is not None and [stats.st_size, int(stats.st_mtime)] != list(expected):
+        return MODIFIED
+    for extension in SIDECAR_EXTENSIONS:
+        try:
+            if os.stat(path + extension).st_mtime < stats.st_mtime:
+                return STALE
+        except OSError:
+            pass  # not built (Ex: rasters registered only), not stale
+    return None
+
+
+def sweep(_gp, _mosaic_path, _manifest=None, _workers=WORKERS):
+    """Look at the raster files of every catalog item of a mosaic data set
+
+    :param _gp: geoprocessing backend
+    :param _mosaic_path:
+    :param _manifest: as returned by folderManifest.load_manifest, to tell modified rasters. None does not tell them
+    :param _workers: number of threads
+    :return: Health
+    """
+    items = _gp.export_paths(_mosaic_path)
+    if not items:
+        return Health(0, [], [], [])
+    manifest = _manifest or {}
+    pool = multiprocessing.pool.ThreadPool(processes=max(1, min(_workers, len(items))))
+    try:
+        states = pool.map(item_state, [(path, manifest.get(os.path.basename(path))) for _, path in items],
+                          chunksize=max(1, len(items) // (4 * _workers)))
+    finally:
+        pool.close()
+        pool.join()
+    found = dict((state, []) for state in [MISSING, MODIFIED, STALE])
+    for item, state in zip(items, states):
+        if state is not None:
+            found[state].append(item)
+    return Health(len(items), found[MISSING], found[MODIFIED], found[STALE])
+
+
+def log_health(_mosaic_path, _health):
+    database_name, mosaic_name = os.path.split(os.path.normpath(_mosaic_path))
+    if not (_health.missing or _health.modified or _health.stale):
+        logging.info("Mosaic data set %s of %s: %s catalog items, all sound.", mosaic_name,
+                     os.path.basename(database_name), _health.items)
+        return
+    logging.warning("Mosaic data set %s of %s: %s catalog items, %s missing, %s modified, %s stale.", mosaic_name,
+                    os.path.basename(database_name), _health.items, len(_health.missing), len(_health.modified),
+                    len(_health.stale))
+    for state, items in [(MISSING, _health.missing), (MODIFIED, _health.modified), (STALE, _health.stale)]:
+        for object_id, path in items:
+            logging.info("Item %s %s: %s", object_id, state, path)
+
+
+def remove_items(_gp, _mosaic_path, _items):
+    """Remove catalog items, MAX_IDS_PER_CLAUSE at a time
+
+    :param _gp: geoprocessing backend
+    :param _mosaic_path:
+    :param _items: list of (OBJECTID, path)
+    :return:
+    """
+    object_ids = sorted(object_id for object_id, _ in _items)
+    for start in range(0, len(object_ids), MAX_IDS_PER_CLAUSE):
+        _gp.remove_rasters(_mosaic_path, fieldWriter.object_id_clause(_gp, os.path.dirname(_mosaic_path),
+                                                                      object_ids[start:start + MAX_IDS_PER_CLAUSE]))
+
+
+def remove_missing(_gp, _mosaic_path, _health, _max_share=MAX_MISSING_SHARE):
+    """Remove the items whose raster file is missing. Nothing is removed if the folder of a missing raster file is
+    missing too, or if more than _max_share of the items are missing: the files are more likely out of reach than
+    deleted
+
+    :param _gp: geoprocessing backend
+    :param _mosaic_path:
+    :param _health:
+    :param _max_share: largest share of missing items that are removed
+    :return: number of items removed
+    """
+    if not _health.missing:
+        return 0
+    folders = sorted(set(os.path.dirname(path) for _, path in _health.missing))
+    missing_folders = [folder for folder in folders if not os.path.isdir(folder)]
+    if missing_folders:
+        logging.error("Mosaic data set %s: folder %s not found. %s items with missing raster files NOT removed.",
+                      os.path.basename(_mosaic_path), ", ".join(missing_folders), len(_health.missing))
+        return 0
+    if len(_health.missing) > _max_share * _health.items:
+        logging.error("Mosaic data set %s: %s of %s items with missing raster files, more than %d%%. NOT removed, "
+                      "check the source folder.",
+                      os.path.basename(_mosaic_path), len(_health.missing), _health.items, 100 * _max_share)
+        return 0
+    remove_items(_gp, _mosaic_path, _health.missing)
+    if _health.missing:
+        logging.info("%s items with missing raster files removed.", len(_health.missing))
+    return len(_health.missing)
+
+
+def forget_modified(_gp, _mosaic_path, _health, _manifest, _index=None):
+    """Remove the items whose raster file was modified, and forget their files, so that the next update adds them
+    again with their custom fields
+
+    :param _gp: geoprocessing backend
+    :param _mosaic_path:
+    :param _health:
+    :param _manifest: manifest of the mosaic data set, modified in place (save it afterwards)
+    :param _index: fingerprint index of the mosaic data set (see rasterFingerprints), modified in place
+    :return: number of items removed
+    """
+    remove_items(_gp, _mosaic_path, _health.modified)
+    for _, path in _health.modified:
+        _manifest.pop(os.path.basename(path), None)
+        if _index is not None:
+            _index.pop(os.path.basename(path), None)
+    if _health.modified:
+        logging.info("%s items with modified raster files removed, added again by the next update.",
+                     len(_health.modified))
+    return len(_health.modified)
+
+
+def rebuild_stale(_gp, _health):
+    """Build pyramids and statistics of the stale items again
+
+    :param _gp: geoprocessing backend
+    :param _health:
+    :return: list of paths that failed
+    """
+    failed = []
+    for _, path in _health.stale:
+        try:
+            for extension in SIDECAR_EXTENSIONS:
+                if os.path.exists(path + extension):
+                    os.remove(path + extension)  # existing pyramids and statistics are skipped otherwise
+            _gp.build_pyramids_and_statistics(path)
+        except (_gp.ExecuteError, OSError) as error:
+            logging.warning("Pyramids and statistics of %s not built again: %s", path, error)
+            failed.append(path)
+    if _health.stale:
+        logging.info("Pyramids and statistics of %s stale items built again.", len(_health.stale) - len(failed))
+    return failed
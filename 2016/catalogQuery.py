@@ -0,0 +1,88 @@
+# Author:   GEOTEC, UJI
+# Date:     March 2016
+#
+# Purpose:  Find the catalog rows (raster items) that an AddRastersToMosaicDataset_management call has just added
+#           to a mosaic data set, with a single query instead of running GetCount_management before and after.
+#           Two ways of telling new rows apart:
+#           1/ sentinel: custom field PARAMNAME still holds its default value 'NA' (see createMosaicDatasets.py).
+#              It also returns rows left behind by an update that failed before filling in custom fields.
+#              Rows whose names do not follow the naming convention are marked with PARAMNAME '?' (mark_unparsed),
+#              so that they are warned about once and not taken as new by every later update.
+#           2/ watermark: OBJECTID greater than the highest OBJECTID read before the add step.
+#
+# Usage:    where_clause = catalogQuery.sentinel_clause(gp, gp.env.workspace)
+#           rows = catalogQuery.new_rows(gp, mosaic_path, ["Name"], where_clause)
+#           if rows: (update custom fields of the rows returned by where_clause)
+
+SENTINEL_FIELD = "PARAMNAME"
+SENTINEL_VALUE = "NA"  # default value of PARAMNAME, i.e. custom fields not filled in yet
+UNPARSED_VALUE = "?"  # PARAMNAME of rows whose names cannot be parsed
+
+
+def sentinel_clause(_gp, _workspace):
+    """SQL expression selecting rows whose custom fields have not been filled in. Ex: "PARAMNAME" = 'NA'
+
+    :param _gp: geoprocessing backend
+    :param _workspace:
+    :return:
+    """
+    return "%s = '%s'" % (_gp.add_field_delimiters(_workspace, SENTINEL_FIELD), SENTINEL_VALUE)
+
+
+def watermark(_gp, _mosaic_path):
+    """Highest OBJECTID of the catalog, 0 if it is empty. Read it before the add step
+
+    :param _gp: geoprocessing backend
+    :param _mosaic_path:
+    :return:
+    """
+    with _gp.search_cursor(_mosaic_path, ["OID@"], None, (None, "ORDER BY OBJECTID DESC")) as cursor:
+        for row in cursor:
+            return row[0]
+    return 0
+
+
+def watermark_clause(_gp, _workspace, _watermark):
+    """SQL expression selecting rows added after the watermark was read. Ex: "OBJECTID" > 365
+
+    :param _gp: geoprocessing backend
+    :param _workspace:
+    :param _watermark:
+    :return:
+    """
+    return "%s > %d" % (_gp.add_field_delimiters(_workspace, "OBJECTID"), _watermark)
+
+
+def new_rows(_gp, _mosaic_path, _fields, _where_clause):
+    """Rows selected by a sentinel or watermark expression, read in a single query
+
+    :param _gp: geoprocessing backend
+    :param _mosaic_path:
+    :param _fields: fields to read after OBJECTID
+    :param _where_clause:
+    :return: list of [OBJECTID, field values...]
+    """
+    with _gp.search_cursor(_mosaic_path, ["OID@"] + list(_fields), _where_clause) as cursor:
+        return [list(row) for row in cursor]
+
+
+def mark_unparsed(_gp, _mosaic_path, _rows, _values):
+    """Set PARAMNAME of new rows whose custom fields could not be computed to UNPARSED_VALUE, so that the sentinel
+    expression no longer selects them
+
+    :param _gp: geoprocessing backend
+    :param _mosaic_path:
+    :param _rows: rows returned by new_rows
+    :param _values: dictionary {OBJECTID: values} of the rows whose custom fields are written
+    :return: number of rows marked
+    """
+    object_ids = sorted(row[0] for row in _rows if row[0] not in _values)
+    if not object_ids:
+        return 0
+    where_clause = "%s IN (%s)" % (_gp.add_field_delimiters(_gp.env.workspace, "OBJECTID"),
+                                   ",".join(str(object_id) for object_id in object_ids))
+    with _gp.update_cursor(_mosaic_path, ["OID@", SENTINEL_FIELD], where_clause) as cursor:
+        for row in cursor:
+            cursor.updateRow([row[0], UNPARSED_VALUE])
+    del cursor
+    return len(object_ids)
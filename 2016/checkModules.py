@@ -0,0 +1,380 @@
+# Author:   GEOTEC, UJI
+# Date:     March 2016
+#
+# Purpose:  Checks of the modules shared by the create, update and sweep scripts, run against the geoprocessing
+#           simulator of gpBackend (StubBackend): unlike benchmarkUpdates.py and benchmarkSeason.py, which time
+#           them, every check asserts what the module writes or returns. A check per behaviour the update scripts
+#           rely on: custom fields written to every new row (fieldWriter), new rows found and rows with unparsable
+#           names marked (catalogQuery), tools tried again only when it is safe (gpRetry), statistics merged as
+#           if every cell were read (itemStatistics), dates of the index as in the catalog (temporalIndex).
+#
+# Note:     Requires numpy for the itemStatistics checks (skipped without it). Nothing is written outside a
+#           temporary folder. The checks run on Python 2 (ArcGIS Desktop) and Python 3.
+#
+# Usage:    python checkModules.py [<check name>...]
+# Example:  python checkModules.py
+# Example:  python checkModules.py FieldWriterChecks.test_dates_through_sentinel
+
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import benchmarkUpdates
+import catalogQuery
+import fieldWriter
+import gpBackend
+import gpRetry
+import itemStatistics
+import rasterNames
+import temporalIndex
+
+LTA_NAMES = ["IT_%s_Monitoring_NDVI_2003_2015_%03d.tif" % (statistic, day)
+             for statistic in ["avg", "std"] for day in range(1, 31)]
+
+
+class StubChecks(unittest.TestCase):
+    """Empty mosaic data set REGIONAL_MONITORING_NDVI in IT_2016.gdb of a StubBackend, in a temporary folder"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="ermes_check_")
+        self.gp = gpBackend.create_backend("stub", _root=self.root)
+        self.database_path = os.path.join(self.root, "IT", "IT_2016.gdb")
+        self.gp.create_mosaic(self.database_path, "REGIONAL_MONITORING_NDVI")
+        self.mosaic_path = os.path.join(self.database_path, "REGIONAL_MONITORING_NDVI")
+        self.gp.env.workspace = self.database_path
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def catalog(self, _fields):
+        """Every row of the catalog, {OBJECTID: tuple of _fields}"""
+        with self.gp.search_cursor(self.mosaic_path, ["OID@"] + list(_fields)) as cursor:
+            return dict((row[0], tuple(row[1:])) for row in cursor)
+
+    def new_values(self, _family=rasterNames.LTA):
+        """Custom field values of the rows found by the sentinel, as the update scripts compute them"""
+        where_clause = catalogQuery.sentinel_clause(self.gp, self.database_path)
+        rows = catalogQuery.new_rows(self.gp, self.mosaic_path, ["Name"], where_clause)
+        values, unparsed = fieldWriter.compute_values(rows, rasterNames.parser_of(_family))
+        return where_clause, rows, values, unparsed
+
+
+class FieldWriterChecks(StubChecks):
+
+    def test_compute_values(self):
+        values, unparsed = fieldWriter.compute_values([[1, "IT_avg_Monitoring_NDVI_2003_2015_032"], [2, "x"]],
+                                                      rasterNames.parser_of(rasterNames.LTA), (1,))
+        self.assertEqual(unparsed, ["x"])
+        self.assertEqual(values, {1: ("AVG", "2015", "2015/02/01", datetime.datetime(2015, 2, 1), 1)})
+
+    def test_dates_through_sentinel(self):
+        # As the update scripts: rows found by the sentinel, written through the sentinel expression
+        self.gp.add_rasters(self.mosaic_path, LTA_NAMES)
+        where_clause, _, values, unparsed = self.new_values()
+        self.assertEqual((len(values), unparsed), (60, []))
+        bulk_rows, cursor_rows = fieldWriter.write_values(self.gp, self.mosaic_path, fieldWriter.CUSTOM_FIELDS,
+                                                          values, where_clause)
+        self.assertEqual(bulk_rows + cursor_rows, 60)
+        catalog = self.catalog(fieldWriter.CUSTOM_FIELDS)
+        for object_id, expected in values.items():
+            self.assertEqual(catalog[object_id], expected)
+        self.assertEqual(catalogQuery.new_rows(self.gp, self.mosaic_path, ["Name"], where_clause), [])
+
+    def test_shared_fields_in_bulk(self):
+        self.gp.add_rasters(self.mosaic_path, LTA_NAMES)
+        values = dict((object_id, (1,)) for object_id in self.catalog([]))
+        self.gp.calls.clear()
+        self.assertEqual(fieldWriter.write_values(self.gp, self.mosaic_path, ["FORE"], values), (60, 0))
+        self.assertEqual(self.gp.calls["calculate_fields"], 1)
+        self.assertEqual(self.gp.calls["update_cursor"], 0)
+        self.assertEqual(set(self.catalog(["FORE"]).values()), set([(1,)]))
+
+    def test_small_groups_through_cursor(self):
+        self.gp.add_rasters(self.mosaic_path, LTA_NAMES[:5])
+        values = dict((object_id, (1,)) for object_id in self.catalog([]))
+        self.assertEqual(fieldWriter.write_values(self.gp, self.mosaic_path, ["FORE"], values), (0, 5))
+        self.assertEqual(set(self.catalog(["FORE"]).values()), set([(1,)]))
+
+
+class CatalogQueryChecks(StubChecks):
+
+    def test_watermark(self):
+        self.assertEqual(catalogQuery.watermark(self.gp, self.mosaic_path), 0)
+        self.gp.add_rasters(self.mosaic_path, LTA_NAMES[:3])
+        watermark = catalogQuery.watermark(self.gp, self.mosaic_path)
+        self.assertEqual(watermark, max(self.catalog([])))
+        self.gp.add_rasters(self.mosaic_path, LTA_NAMES[3:5])
+        rows = catalogQuery.new_rows(self.gp, self.mosaic_path, ["Name"],
+                                     catalogQuery.watermark_clause(self.gp, self.database_path, watermark))
+        self.assertEqual([row[1] for row in rows], [os.path.splitext(name)[0] for name in LTA_NAMES[3:5]])
+
+    def test_sentinel(self):
+        self.gp.add_rasters(self.mosaic_path, LTA_NAMES[:3])
+        _, rows, _, _ = self.new_values()
+        self.assertEqual(sorted(row[0] for row in rows), sorted(self.catalog([])))
+
+    def test_unparsed_rows_marked(self):
+        self.gp.add_rasters(self.mosaic_path, LTA_NAMES[:2] + ["not_an_ermes_name.tif"])
+        where_clause, rows, values, unparsed = self.new_values()
+        self.assertEqual(unparsed, ["not_an_ermes_name"])
+        fieldWriter.write_values(self.gp, self.mosaic_path, fieldWriter.CUSTOM_FIELDS, values, where_clause)
+        self.assertEqual(catalogQuery.mark_unparsed(self.gp, self.mosaic_path, rows, values), 1)
+        self.assertEqual(catalogQuery.new_rows(self.gp, self.mosaic_path, ["Name"], where_clause), [])
+        self.assertIn((catalogQuery.UNPARSED_VALUE,), self.catalog(["PARAMNAME"]).values())
+
+
+class FlakyBackend(object):
+    """Backend whose tools fail with the errors given, one per call, before they run"""
+
+    ExecuteError = gpBackend.GeoprocessingError
+
+    def __init__(self, _errors):
+        self.errors = list(_errors)
+        self.calls = []
+
+    def _call(self, _tool):
+        self.calls.append(_tool)
+        if self.errors:
+            raise self.errors.pop(0)
+
+    def search_cursor(self, _mosaic_path, _fields, _where_clause=None, _sql_clause=(None, None)):
+        self._call("search_cursor")
+
+    def calculate_fields(self, _mosaic_path, _where_clause, _values):
+        self._call("calculate_fields")
+
+
+class LockedBackend(object):
+    """Backend whose tool given fails with a lock error the first _failures times, before it runs or after it"""
+
+    def __init__(self, _gp, _tool, _failures=1, _after=False):
+        self.gp = _gp
+        self.tool = _tool
+        self.failures = _failures
+        self.after = _after
+        self.attempts = 0
+
+    def __getattr__(self, _name):
+        attribute = getattr(self.gp, _name)
+        if _name != self.tool:
+            return attribute
+
+        def locked(*_args, **_kwargs):
+            self.attempts += 1
+            if self.attempts > self.failures:
+                return attribute(*_args, **_kwargs)
+            if self.after:
+                attribute(*_args, **_kwargs)
+            raise LOCK_ERROR
+        return locked
+
+
+LOCK_ERROR = gpBackend.GeoprocessingError("ERROR 000464: Cannot get exclusive schema lock")
+
+
+def retrying(_gp):
+    return gpRetry.RetryingBackend(_gp, _sleep=lambda _seconds: None)
+
+
+class GpRetryChecks(unittest.TestCase):
+
+    def test_is_transient(self):
+        self.assertTrue(gpRetry.is_transient(LOCK_ERROR))
+        self.assertTrue(gpRetry.is_transient(Exception("database is locked")))
+        self.assertFalse(gpRetry.is_transient(Exception("ERROR 000732: Input Rasters does not exist")))
+
+    def test_lock_waited(self):
+        gp = FlakyBackend([LOCK_ERROR, LOCK_ERROR])
+        retrying(gp).search_cursor("m", ["OID@"])
+        self.assertEqual(gp.calls, ["search_cursor"] * 3)
+
+    def test_other_errors_raised_at_once(self):
+        gp = FlakyBackend([gpBackend.GeoprocessingError("ERROR 000732: Input Rasters does not exist")])
+        self.assertRaises(gpBackend.GeoprocessingError, retrying(gp).search_cursor, "m", ["OID@"])
+        self.assertEqual(gp.calls, ["search_cursor"])
+
+    def test_deadline(self):
+        gp = FlakyBackend([LOCK_ERROR] * 100)
+        backend = gpRetry.RetryingBackend(gp, _deadline=5, _sleep=lambda _seconds: None, _clock=lambda: len(gp.calls))
+        self.assertRaises(gpBackend.GeoprocessingError, backend.search_cursor, "m", ["OID@"])
+        self.assertTrue(len(gp.calls) < 100)
+
+    def test_field_calculations_never_tried_again(self):
+        gp = FlakyBackend([LOCK_ERROR])
+        self.assertRaises(gpBackend.GeoprocessingError, retrying(gp).calculate_fields, "m", None, {})
+        self.assertEqual(gp.calls, ["calculate_fields"])
+
+
+class AddStepRetryChecks(StubChecks):
+
+    def test_nothing_read_before_adding(self):
+        retrying(self.gp).add_rasters(self.mosaic_path, LTA_NAMES[:3])
+        self.assertEqual((self.gp.calls["get_count"], self.gp.calls["search_cursor"]), (0, 0))
+
+    def test_tried_again_while_nothing_added(self):
+        gp = LockedBackend(self.gp, "add_rasters", 2)
+        retrying(gp).add_rasters(self.mosaic_path, LTA_NAMES[:3])
+        self.assertEqual((gp.attempts, len(self.catalog([]))), (3, 3))
+
+    def test_not_tried_again_after_adding(self):
+        gp = LockedBackend(self.gp, "add_rasters", 1, _after=True)
+        self.assertRaises(gpBackend.GeoprocessingError, retrying(gp).add_rasters, self.mosaic_path, LTA_NAMES[:3])
+        self.assertEqual((gp.attempts, len(self.catalog([]))), (1, 3))
+
+    def test_remove_step_tried_again(self):
+        self.gp.add_rasters(self.mosaic_path, LTA_NAMES[:3])
+        gp = LockedBackend(self.gp, "remove_rasters", 1, _after=True)
+        retrying(gp).remove_rasters(self.mosaic_path, None)
+        self.assertEqual((gp.attempts, len(self.catalog([]))), (2, 0))
+
+
+@unittest.skipIf(itemStatistics.numpy is None, "itemStatistics requires numpy")
+class ItemStatisticsChecks(StubChecks):
+
+    def write_raster(self, _filename, _pixels, _nodata=-32768):
+        """16 bit raster of benchmarkUpdates with the pixels given (64 x 32)"""
+        numpy = itemStatistics.numpy
+        path = os.path.join(self.root, "source", _filename)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        data = benchmarkUpdates.geotiff_bytes(_nodata=str(_nodata))
+        pixels = numpy.asarray(_pixels, dtype="<i2").ravel()
+        with open(path, "wb") as f:
+            f.write(data[:-len(pixels) * 2] + pixels.tobytes())
+        return path
+
+    def test_merge_as_every_cell(self):
+        numpy = itemStatistics.numpy
+        generator = numpy.random.RandomState(2016)
+        arrays = [generator.normal(0.0, 1.0, 1000), generator.normal(50.0, 5.0, 1000)]  # second far out of the first
+        items = [itemStatistics.item_statistics(array) for array in arrays]
+        merged = itemStatistics.merge(items)
+        values = numpy.concatenate(arrays)
+        self.assertEqual(merged["count"], 2000)
+        self.assertEqual((merged["min"], merged["max"]), (values.min(), values.max()))
+        self.assertAlmostEqual(merged["mean"], values.mean(), 9)
+        self.assertAlmostEqual(merged["std"], values.std(), 9)
+        self.assertEqual(sum(merged["histogram"]), 2000)
+        histogram = numpy.histogram(values, bins=itemStatistics.BINS, range=merged["range"])[0]
+        cumulative = numpy.cumsum(histogram) - numpy.cumsum(merged["histogram"])
+        self.assertTrue(numpy.abs(cumulative).max() <= 0.01 * 2000)  # cells rebinned to a neighbouring bin at most
+        self.assertTrue(merged["histogram"][-1] > 0 and merged["histogram"][0] > 0)
+
+    def test_aux_statistics_as_cells(self):
+        numpy = itemStatistics.numpy
+        pixels = numpy.arange(64 * 32) % 300 - 100
+        pixels[:10] = -32768
+        path = self.write_raster("IT_Monitoring_NDVI_2016_001.tif", pixels)
+        self.gp.build_pyramids_and_statistics(path)
+        from_aux = itemStatistics.aux_statistics(path)
+        array, nodata = self.gp.raster_to_array(path)
+        from_cells = itemStatistics.item_statistics(itemStatistics.valid_cells(array, nodata))
+        for key in ["count", "min", "max", "range", "histogram"]:
+            self.assertEqual(from_aux[key], from_cells[key])
+        for key in ["sum", "sumsq"]:
+            self.assertAlmostEqual(from_aux[key] / from_cells[key], 1.0, 9)
+
+    def test_stale_aux_not_used(self):
+        path = self.write_raster("IT_Monitoring_NDVI_2016_001.tif", [1] * (64 * 32))
+        self.gp.build_pyramids_and_statistics(path)
+        modified = os.path.getmtime(path + itemStatistics.AUX_EXTENSION) + 10
+        os.utime(path, (modified, modified))
+        self.assertEqual(itemStatistics.aux_statistics(path), None)
+
+    def test_each_raster_read_once(self):
+        filenames = ["IT_Monitoring_NDVI_2016_%03d.tif" % day for day in range(1, 4)]
+        for day, filename in enumerate(filenames):
+            self.write_raster(filename, [day] * (64 * 32))
+        source_folder = os.path.join(self.root, "source")
+        scan = dict((filename, [0, 0]) for filename in filenames)
+        store = itemStatistics.update(self.gp, source_folder, {}, scan, filenames)
+        self.assertEqual(self.gp.calls["raster_to_array"], 3)
+        self.assertEqual((store["mosaic"]["min"], store["mosaic"]["max"]), (0.0, 2.0))
+        itemStatistics.update(self.gp, source_folder, store, scan, [])
+        self.assertEqual(self.gp.calls["raster_to_array"], 3)
+
+    def test_only_items_of_the_catalog(self):
+        filenames = ["IT_Monitoring_NDVI_2016_%03d.tif" % day for day in range(1, 5)]
+        for day, filename in enumerate(filenames):
+            self.write_raster(filename, [day] * (64 * 32))
+        source_folder = os.path.join(self.root, "source")
+        scan = dict((filename, [0, 0]) for filename in filenames)
+        # Files 3 and 4 are in the source folder but not handed to the add step (held back, duplicates, ...)
+        store = itemStatistics.update(self.gp, source_folder, {}, scan, filenames[:2])
+        self.assertEqual(sorted(store["items"]), filenames[:2])
+        self.assertEqual(store["mosaic"]["max"], 1.0)
+        # File 3 added, file 1 removed by the update (Ex: superseded forecast)
+        store = itemStatistics.update(self.gp, source_folder, store, scan, filenames[2:3],
+                                      [os.path.splitext(filenames[0])[0]])
+        self.assertEqual(sorted(store["items"]), filenames[1:3])
+        self.assertEqual((store["mosaic"]["min"], store["mosaic"]["max"]), (1.0, 2.0))
+
+    def test_store_built_from_the_catalog(self):
+        filenames = ["IT_Monitoring_NDVI_2016_%03d.tif" % day for day in range(1, 4)]
+        paths = [self.write_raster(filename, [day] * (64 * 32)) for day, filename in enumerate(filenames)]
+        self.gp.add_rasters(self.mosaic_path, paths[:2])
+        source_folder = os.path.dirname(paths[0])
+        scan = dict((filename, [0, 0]) for filename in filenames)
+        manifest_path = os.path.join(self.root, "manifests", "IT_2016.gdb_REGIONAL_MONITORING_NDVI.json")
+        os.makedirs(os.path.dirname(manifest_path))
+        self.assertTrue(itemStatistics.refresh(self.gp, self.mosaic_path, source_folder, manifest_path, scan, []))
+        store = itemStatistics.load_store(itemStatistics.statistics_path(manifest_path))
+        self.assertEqual(sorted(store["items"]), filenames[:2])
+
+
+class TemporalIndexChecks(StubChecks):
+
+    def setUp(self):
+        StubChecks.setUp(self)
+        self.index_path = os.path.join(self.root, "IT_2016.gdb_REGIONAL_MONITORING_NDVI.dates.idx")
+
+    def write_names(self, _names, _family=rasterNames.MONITORING):
+        self.gp.add_rasters(self.mosaic_path, _names)
+        where_clause, _, values, _ = self.new_values(_family)
+        fieldWriter.write_values(self.gp, self.mosaic_path, fieldWriter.CUSTOM_FIELDS, values, where_clause)
+        return values
+
+    def indexed(self):
+        with temporalIndex.TemporalIndex(self.index_path) as index:
+            return dict((paramname, index.dates(paramname)) for paramname in index.paramnames())
+
+    def expected(self, _values):
+        groups = {}
+        for object_id, values in _values.items():
+            groups.setdefault(values[0], []).append((values[3].date(), object_id))
+        return dict((paramname, sorted(entries)) for paramname, entries in groups.items())
+
+    def test_update_and_rebuild_match_values(self):
+        values = self.write_names(["IT_Monitoring_NDVI_2016_%03d.tif" % day for day in range(1, 31)])
+        temporalIndex.update(self.gp, self.mosaic_path, self.index_path, values)  # no index yet: from the catalog
+        self.assertEqual(self.indexed(), self.expected(values))
+        new_values = self.write_names(["IT_Monitoring_NDVI_2016_%03d.tif" % day for day in range(31, 33)])
+        temporalIndex.update(self.gp, self.mosaic_path, self.index_path, new_values)  # merged
+        values.update(new_values)
+        self.assertEqual(self.indexed(), self.expected(values))
+        temporalIndex.update(self.gp, self.mosaic_path, self.index_path, {}, _rebuild=True)
+        self.assertEqual(self.indexed(), self.expected(values))
+
+    def test_latest_forecasts(self):
+        names = ["IT_Meteo_Forecast_TMax_2016_100_plus%d.tif" % plus for plus in range(1, 4)]
+        values = self.write_names(names, rasterNames.FORECAST)
+        temporalIndex.update(self.gp, self.mosaic_path, self.index_path, values, _forecast=True)
+        later = self.write_names([name.replace("_100_", "_101_") for name in names], rasterNames.FORECAST)
+        temporalIndex.update(self.gp, self.mosaic_path, self.index_path, later, _forecast=True)
+        with temporalIndex.TemporalIndex(self.index_path) as index:
+            latest = index.latest("TMAX", 10, _forecast=True)
+        self.assertEqual(sorted(object_id for _, object_id in latest), sorted(later))
+
+    def test_forget(self):
+        values = self.write_names(["IT_Monitoring_NDVI_2016_%03d.tif" % day for day in range(1, 4)])
+        temporalIndex.update(self.gp, self.mosaic_path, self.index_path, values)
+        self.assertEqual(temporalIndex.forget(self.index_path, [min(values)]), 1)
+        del values[min(values)]
+        self.assertEqual(self.indexed(), self.expected(values))
+
+
+if __name__ == "__main__":
+    unittest.main(argv=sys.argv)
@@ -8,32 +8,45 @@
 #
 # Note:     It should be executed ONCE at the beginning of the season
 #
+# Update:   Geoprocessing through gpBackend (Mar 2016)
+#
 # Usage:    python CreateFileGeoDB.py <target_folder> <databases>
 # Example:  python CreateFileGeoDB.py c:/ERMES/PRODUCTS/SCRIPTS GeoDB_2016.txt
 
 
- # Import the modules
-import arcpy, sys, os
+# Import the modules
+import sys, os
+import gpBackend
+
+
+def read_databases(_databases_filename):
+    """Read geo databases to be created
+
+    :param _databases_filename:
+    :return: list of (target folder, geo database name)
+    """
+    databases = []
+    f = open(_databases_filename, "r")
+    for x in f.readlines():
+        line = x.strip().split(";")
+        databases.append((line[0], line[1]))
+    f.close()
+    return databases
+
 
-# Set the workspace and global variables
-ENV_PATH =  os.path.normpath(os.path.join(sys.argv[1], ".."))
-DB_FILENAME = sys.argv[2]
-arcpy.env.workspace = ENV_PATH
-arcpy.env.overwriteOutput = True
+# main programme
+if __name__ == "__main__":
+    BACKEND_NAME, BACKEND_OPTIONS = gpBackend.backend_settings()  # arcpy, see gpBackend
+    gp = gpBackend.create_backend(BACKEND_NAME, **BACKEND_OPTIONS)
 
-f = open(DB_FILENAME, "r")
-databases = []
-for x in f.readlines():
-    line = x.strip().split(";")
-    databases.append(line) 
+    # Set the workspace and global variables
+    ENV_PATH = os.path.normpath(os.path.join(sys.argv[1], ".."))
+    DB_FILENAME = sys.argv[2]
+    gp.env.workspace = ENV_PATH
+    gp.env.overwriteOutput = True
 
-# For each database create an empty File Geodatabase 
-for database in databases:
-    arcpy.CreateFileGDB_management(
-    	out_folder_path=database[0], #"C:/ERMES/products/IT", 
-		out_name=database[1], #"IT2006", 
-		out_version="CURRENT")
-        
-f.close()
+    # For each database create an empty File Geodatabase
+    for folder, database_name in read_databases(DB_FILENAME):
+        gp.create_file_gdb(folder, database_name)  # Ex: "C:/ERMES/products/IT", "IT_2016.gdb"
 
-print "Script 'CreateFileGeoDB' completed."
+    print("Script 'CreateFileGeoDB' completed.")
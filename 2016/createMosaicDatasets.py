@@ -14,169 +14,365 @@
 #
 # Update:   Define no data value; use os.path; naming convention (Jan 2016)
 # Update:   Add custom flag to be used only for mosaic data sets with forecast data (Feb 2016)
+# Update:   Geoprocessing through gpBackend; custom fields added in one go; parallel geo databases;
+#           optional template mosaic data set cloned per mosaic data set (Mar 2016)
+# Update:   Coordinate system parsed once per process, see spatialReferences (Mar 2016)
+# Update:   Every tool call timed into a metrics file next to the log file, see toolMetrics (Mar 2016)
+# Update:   Folders files checked before any mosaic data set is touched, see folderConfig (Mar 2016)
+# Update:   Tools failing on locked geo databases tried again with backoff, see gpRetry (Mar 2016)
+# Update:   RECONCILE brings existing mosaic data sets up to date instead of deleting them (Mar 2016)
+# Update:   No AnalyzeMosaicDataset of empty catalogs, left to the weekly sweepMosaicDatasets.py DEEP (Mar 2016)
+# Update:   No CalculateStatistics of empty catalogs, statistics merged by the update scripts (Mar 2016)
 #
-# Usage:    python CreateMosaicDatasets.py <target_folder> <source_folders> <log_file>
+# Usage:    python CreateMosaicDatasets.py <target_folder> <source_folders> <log_file> [<workers> [TEMPLATE]
+#           [RECONCILE]]
+#           <source_folders> may list several folders files separated by commas. Mosaic data sets of the
+#           same geo database are created one after another; up to <workers> geo databases (default 1)
+#           are set up at the same time, each one in its own process.
+#           With TEMPLATE, an empty mosaic data set with the custom fields (see mosaicSchema) is created once
+#           per geo database and copied for every mosaic data set, then deleted.
+#           With RECONCILE, existing mosaic data sets are not deleted: missing custom fields, default values and
+#           NoData are added in place and catalog items are kept (statistics are only calculated again when NoData
+#           changes). Differences that cannot be fixed in place (field types, coordinate system) are logged.
+#           Mosaic data sets that do not exist yet are created as usual.
 # Example:  python CreateMosaicDatasets.py c:/ERMES/PRODUCTS/SCRIPTS IT_2016_folders.txt IT_2016.log
+# Example:  python CreateMosaicDatasets.py c:/ERMES/PRODUCTS/SCRIPTS IT_2016_folders.txt,ES_2016_folders.txt ALL_2016.log 2 TEMPLATE
+# Example:  python CreateMosaicDatasets.py c:/ERMES/PRODUCTS/SCRIPTS IT_2016_folders_LTA.txt IT_2016_LTA.log 1 RECONCILE
+
+# Import the modules
+import logging, sys, os
+import re
+import folderConfig
+import gpBackend
+import gpRetry
+import mosaicScheduler
+import mosaicSchema
+import spatialReferences
+import toolMetrics
+
+gp = None  # geoprocessing backend (arcpy), set up by the main programme or by init_worker
+use_template = False  # copy a template mosaic data set instead of creating each one from scratch
+reconcile = False  # bring existing mosaic data sets up to date instead of deleting them
+LOG_FORMAT = '%(asctime)s %(filename)s %(levelname)-8s %(message)s'
+TEMPLATE_NAME = "ERMES_TEMPLATE"  # template mosaic data set, in each geo database while creating mosaic data sets
+_templates = set()  # geo databases where this process has created the template
 
 
 def log_tool():
     # log all informative messages returned by the last tool executed
-    if len(arcpy.GetMessages(0)) > 0:
-        logging.info(arcpy.GetMessages(0))
+    if len(gp.get_messages(0)) > 0:
+        logging.info(gp.get_messages(0))
     # Log all warnings messages returned by the last tool executed
-    if len(arcpy.GetMessages(1)) > 0:
-        logging.warning(arcpy.GetMessages(1))
+    if len(gp.get_messages(1)) > 0:
+        logging.warning(gp.get_messages(1))
+
+
+def set_up_environment(_workspace):
+    gp.env.workspace = _workspace  # Not really useful here
+    gp.env.overwriteOutput = True
+
+    # Do not spread operations across multiple processes.
+    gp.env.parallelProcessingFactor = "0"
+
+
+def init_worker(_backend_name, _backend_options, _workspace, _log_filename, _use_template=False, _reconcile=False):
+    """Set up geoprocessing backend, environment and logger of a worker process
+
+    :param _backend_name:
+    :param _backend_options:
+    :param _workspace:
+    :param _log_filename:
+    :param _use_template:
+    :param _reconcile:
+    :return:
+    """
+    global gp, use_template, reconcile
+    metrics_filename = toolMetrics.metrics_filename_of(_log_filename)
+    gp = gpRetry.retrying(toolMetrics.instrument(gpBackend.create_backend(_backend_name, **_backend_options),
+                                                 metrics_filename), metrics_filename)
+    use_template = _use_template
+    reconcile = _reconcile
+    set_up_environment(_workspace)
+    logging.basicConfig(level=logging.DEBUG,
+                        format=LOG_FORMAT.replace('%(levelname)', '%(processName)s %(levelname)'),
+                        datefmt='%d %b %Y %H:%M:%S',
+                        filename=_log_filename)
+
 
+def add_custom_fields(_mosaic_path):
+    """Add fields to mosaic data set for web application and assign their default values
+
+    :param _mosaic_path:
+    :return:
+    """
+    logging.info("Adding custom fields...")
+    gp.add_fields(_mosaic_path, mosaicSchema.CUSTOM_FIELDS)
+    log_tool()
+
+    # Assign default values to custom fields
+    for field, value in mosaicSchema.FIELD_DEFAULTS:
+        gp.assign_default(_mosaic_path, field, value)
+        log_tool()
 
-def create_mosaic(_database_path, _mosaic_name, _nodata_value):
+
+def delete_mosaic(_mosaic_path):
+    if gp.exists(_mosaic_path):
+        logging.info("Mosaic data set %s exists, will be deleted.", os.path.basename(_mosaic_path))
+        gp.delete_mosaic(_mosaic_path)
+        log_tool()
+
+
+def create_template(_database_path, _spatial_reference):
+    """Create the empty template mosaic data set of a geo database, with custom fields
+
+    :param _database_path:
+    :param _spatial_reference:
+    :return:
+    """
+    template_path = os.path.join(_database_path, TEMPLATE_NAME)
+    delete_mosaic(template_path)
+    logging.info("Creating template mosaic data set in geo database %s", os.path.basename(_database_path))
+    gp.create_mosaic_dataset(_database_path, TEMPLATE_NAME, _spatial_reference)
+    log_tool()
+    add_custom_fields(template_path)
+    _templates.add(_database_path)
+
+
+def create_mosaic(_database_path, _mosaic_name, _nodata_value, _use_template=False):
     """Create empty mosaic data sets
 
     :param _database_path:
     :param _mosaic_name:
     :param _nodata_value:
+    :param _use_template: copy the template mosaic data set of the geo database, created on first use
     :return:
     """
     mosaic_path = os.path.join(_database_path, _mosaic_name)
 
     # Set up geoprocessing environment defaults
-    arcpy.env.workspace = _database_path  # that's more useful
-    sr = arcpy.SpatialReference()
-    sr.loadFromString(
-        "PROJCS['ETRS_1989_LAEA',GEOGCS['GCS_ETRS_1989',DATUM['D_ETRS_1989',SPHEROID['GRS_1980',6378137.0,298.257222101]],PRIMEM['Greenwich',0.0],UNIT['Degree',0.0174532925199433]],PROJECTION['Lambert_Azimuthal_Equal_Area'],PARAMETER['False_Easting',4321000.0],PARAMETER['False_Northing',3210000.0],PARAMETER['Central_Meridian',10.0],PARAMETER['Latitude_Of_Origin',52.0],UNIT['Meter',1.0]];-8426600 -9526700 10000;-100000 10000;-100000 10000;0.001;0.001;0.001;IsHighPrecision")
-    arcpy.env.outputCoordinateSystem = sr
-
-    if arcpy.Exists(mosaic_path):
-        logging.info("Mosaic data set %s exists, will be deleted.", _mosaic_name)
-        arcpy.DeleteMosaicDataset_management(in_mosaic_dataset=mosaic_path,
-                                             delete_overview_images="DELETE_OVERVIEW_IMAGES",
-                                             delete_item_cache="DELETE_ITEM_CACHE")
-        log_tool()
+    gp.env.workspace = _database_path  # that's more useful
+    sr = spatialReferences.get(gp, mosaicSchema.SPATIAL_REFERENCE)
+    spatialReferences.set_output_coordinate_system(gp, sr)
 
-    logging.info("Creating mosaic data set %s in geo database %s", _mosaic_name, os.path.basename(_database_path))
-    arcpy.CreateMosaicDataset_management(in_workspace=_database_path,
-                                         in_mosaicdataset_name=_mosaic_name,
-                                         coordinate_system=sr,
-                                         num_bands="",
-                                         pixel_type="", product_definition="NONE", product_band_definitions="")
-    log_tool()
+    delete_mosaic(mosaic_path)
+
+    if _use_template:
+        if _database_path not in _templates:
+            create_template(_database_path, sr)
+        logging.info("Creating mosaic data set %s in geo database %s from template",
+                     _mosaic_name, os.path.basename(_database_path))
+        gp.copy(os.path.join(_database_path, TEMPLATE_NAME), mosaic_path)
+        log_tool()
+    else:
+        logging.info("Creating mosaic data set %s in geo database %s", _mosaic_name, os.path.basename(_database_path))
+        gp.create_mosaic_dataset(_database_path, _mosaic_name, sr)
+        log_tool()
     logging.info("Created new mosaic data set %s", _mosaic_name)
 
     if _nodata_value != "NA":
         logging.info("Define noData value of %s for %s mosaic data set.", _nodata_value, _mosaic_name)
-
-        arcpy.DefineMosaicDatasetNoData_management(
-            in_mosaic_dataset=mosaic_path,
-            num_bands="1",
-            bands_for_nodata_value=" ".join(["ALL_BANDS", _nodata_value]),
-            bands_for_valid_data_range="",
-            where_clause="",
-            Composite_nodata_value="NO_COMPOSITE_NODATA")
+        gp.define_nodata(mosaic_path, _nodata_value)
         log_tool()
 
-    # Add fields to mosaic data set for web application
-    logging.info("Adding custom fields...")
-    arcpy.AddField_management(mosaic_path, "PARAMNAME", "TEXT", "", "", 50, "PARAMNAME", "NULLABLE", "NON_REQUIRED", "")
-    arcpy.AddField_management(mosaic_path, "YEAR", "TEXT", "", "", 4, "YEAR", "NULLABLE", "NON_REQUIRED", "")
-    arcpy.AddField_management(mosaic_path, "SDATE", "TEXT", "", "", 10, "SDATE", "NULLABLE", "NON_REQUIRED", "")
-    arcpy.AddField_management(mosaic_path, "DATE", "DATE")
-    # Only for forecast data
-    arcpy.AddField_management(mosaic_path, "FORE", "SHORT", "", "", "", "FORE", "NULLABLE", "NON_REQUIRED", "")
+    # Template mosaic data sets already have custom fields
+    if not _use_template:
+        add_custom_fields(mosaic_path)
+
+
+def coordinate_system_name(_definition):
+    """Name of a coordinate system in a WKT string. Ex: PROJCS['ETRS_1989_LAEA',... --> ETRS_1989_LAEA"""
+    match = re.match(r"^\s*\w+\['([^']*)'", _definition or "")
+    return match.group(1) if match else None
 
-    # Assign default values to custom fields
-    arcpy.AssignDefaultToField_management(mosaic_path, "PARAMNAME", "NA")  # NA means no paramname
-    arcpy.AssignDefaultToField_management(mosaic_path, "FORE", 0)  # 0 = FALSE; 1 = TRUE
 
+def same_nodata(_value, _other):
+    """True if two NoData values (text) stand for the same number. Ex: 32767 and 32767.0"""
+    try:
+        return float(_value) == float(_other)
+    except (TypeError, ValueError):
+        return _value == _other
 
-def update_mosaic_statistics(_database_path, _mosaic_name):
+
+def schema_changes(_description, _nodata_value):
+    """Differences between an existing mosaic data set and the schema it should have (see mosaicSchema)
+
+    :param _description: as returned by gp.describe_mosaic
+    :param _nodata_value: from the folders file. NA if none
+    :return: (custom fields to add, (field, value) defaults to assign, NoData value to define or None,
+             problems that cannot be fixed in place)
+    """
+    fields = _description["fields"]
+    missing_fields = [field for field in mosaicSchema.CUSTOM_FIELDS if field[0].upper() not in fields]
+    problems = ["field %s is %s instead of %s" % (name, fields[name.upper()], field_type)
+                for name, field_type, length in mosaicSchema.CUSTOM_FIELDS
+                if name.upper() in fields and fields[name.upper()] != field_type]
+    defaults = [(field, value) for field, value in mosaicSchema.FIELD_DEFAULTS
+                if _description["defaults"].get(field.upper()) != str(value)]
+
+    nodata = None
+    if _nodata_value != "NA" and not same_nodata(_description["nodata"], _nodata_value):
+        nodata = _nodata_value
+    elif _nodata_value == "NA" and _description["nodata"] is not None:
+        problems.append("NoData is %s instead of none" % _description["nodata"])
+
+    expected = coordinate_system_name(mosaicSchema.SPATIAL_REFERENCE)
+    found = coordinate_system_name(_description["spatial_reference"])
+    if found is not None and found != expected:
+        problems.append("coordinate system is %s instead of %s" % (found, expected))
+    return missing_fields, defaults, nodata, problems
+
+
+def reconcile_mosaic(_database_path, _mosaic_name, _nodata_value):
+    """Bring an existing mosaic data set up to date in place: custom fields, default values and NoData
+
+    :param _database_path:
+    :param _mosaic_name:
+    :param _nodata_value:
+    :return: True if NoData changed (statistics have to be calculated again)
+    """
+    mosaic_path = os.path.join(_database_path, _mosaic_name)
+    gp.env.workspace = _database_path
+    missing_fields, defaults, nodata, problems = schema_changes(gp.describe_mosaic(mosaic_path), _nodata_value)
+    for problem in problems:
+        logging.warning("Mosaic data set %s in geo database %s: %s. It has to be deleted and created again.",
+                        _mosaic_name, os.path.basename(_database_path), problem)
+    if not (missing_fields or defaults or nodata):
+        logging.info("Mosaic data set %s in geo database %s is up to date.",
+                     _mosaic_name, os.path.basename(_database_path))
+        return False
+
+    logging.info("Reconciling mosaic data set %s in geo database %s", _mosaic_name, os.path.basename(_database_path))
+    if missing_fields:
+        logging.info("Adding custom fields %s...", ", ".join(field[0] for field in missing_fields))
+        gp.add_fields(mosaic_path, missing_fields)
+        log_tool()
+    for field, value in defaults:
+        logging.info("Assigning default value %s to field %s.", value, field)
+        gp.assign_default(mosaic_path, field, value)
+        log_tool()
+    if nodata is not None:
+        logging.info("Define noData value of %s for %s mosaic data set.", nodata, _mosaic_name)
+        gp.define_nodata(mosaic_path, nodata)
+        log_tool()
+    return nodata is not None
+
+
+def update_mosaic_statistics(_database_path, _mosaic_name, _analyze=True):
     """Before adding images to the mosaic data set, calculate statistics
 
     :param _database_path:
     :param _mosaic_name:
+    :param _analyze: also perform the final checks of AnalyzeMosaicDataset
     :return:
     """
     mosaic_path = os.path.join(_database_path, _mosaic_name)
 
-    # logging.debug("Building pyramids...")
-    # Pyramids are simply lower-resolution versions of rasters that improve drawing performance at smaller scales.
-    # arcpy.BuildPyramidsandStatistics_management(
-    #    in_workspace=_database_path,
-    #    include_subdirectories="NONE",
-    #    build_pyramids="BUILD_PYRAMIDS", 
-    #    calculate_statistics="CALCULATE_STATISTICS",
-    #    BUILD_ON_SOURCE="NONE", 
-    #    estimate_statistics="ESTIMATE_STATISTICS", 
-    #    x_skip_factor="1", y_skip_factor="1",
-    #    ignore_values="", pyramid_level="-1", 
-    #    SKIP_FIRST="NONE",
-    #    resample_technique="NEAREST", 
-    #    compression_type="DEFAULT",
-    #    compression_quality="75",
-    #    skip_existing="SKIP_EXISTING")
-
     logging.info("Calculating statistics...")
     # Statistics are required for mosaic data sets to perform certain tasks,
     # such as applying a contrast stretch or classifying data
-    arcpy.CalculateStatistics_management(
-        in_raster_dataset=mosaic_path,
-        x_skip_factor="1", y_skip_factor="1",
-        ignore_values="", skip_existing="OVERWRITE",
-        area_of_interest="".join([_mosaic_name, "\Footprint"]))
+    gp.calculate_statistics(mosaic_path, "".join([_mosaic_name, "\\Footprint"]))
     log_tool()
+    if not _analyze:
+        return
 
     logging.info("Performing final checks...")
     # Performs checks on a mosaic data set for errors and possible improvements.
-    arcpy.AnalyzeMosaicDataset_management(
-        in_mosaic_dataset=mosaic_path,
-        where_clause="",
-        checker_keywords="FOOTPRINT;FUNCTION;RASTER;PATHS;SOURCE_VALIDITY;STALE;PYRAMIDS;STATISTICS;PERFORMANCE;INFORMATION")
+    gp.analyze_mosaic(mosaic_path, mosaicSchema.ANALYZE_KEYWORDS)
     log_tool()
 
 
+def create_job(_job):
+    """Create the mosaic data set of a job. Errors are logged here, where messages of the tool are available
+
+    :param _job: (database_path, mosaic_name, nodata_value)
+    :return:
+    """
+    database_path, mosaic_name, nodata_value = _job
+    try:
+        if reconcile and gp.exists(os.path.join(database_path, mosaic_name)):
+            # Catalog items are kept: statistics only change with NoData
+            if reconcile_mosaic(database_path, mosaic_name, nodata_value):
+                update_mosaic_statistics(database_path, mosaic_name, _analyze=False)
+            return
+        create_mosaic(database_path, mosaic_name, nodata_value, use_template)
+        # Nothing to calculate nor to check in an empty catalog: statistics are merged by the update scripts as
+        # rasters are added (see itemStatistics), items checked by sweepMosaicDatasets.py, daily and DEEP once a week
+    except gp.ExecuteError:
+        logging.error(gp.get_messages(2))
+        raise
+
+
+def delete_templates(_jobs):
+    """Delete template mosaic data sets of the geo databases of the jobs
+
+    :param _jobs:
+    :return:
+    """
+    for database_path in set(job[0] for job in _jobs):
+        delete_mosaic(os.path.join(database_path, TEMPLATE_NAME))
+
+
+def read_jobs(_env_path, _mosaics_filename):
+    """Read create jobs from a folders file
+
+    :param _env_path: folder holding one sub folder per country with its geo databases
+    :param _mosaics_filename:
+    :return: list of (database_path, mosaic_name, nodata_value)
+    """
+    return [(folderConfig.database_path(_env_path, config), config.mosaic_name, config.nodata)
+            for config in folderConfig.read_config(_mosaics_filename)]
+
+
 # main programme
-try:
-    # Import the modules
-    import arcpy, logging, sys, os
+if __name__ == "__main__":
+    try:
+        BACKEND_NAME, BACKEND_OPTIONS = gpBackend.backend_settings()  # arcpy, see gpBackend
+        gp = gpBackend.create_backend(BACKEND_NAME, **BACKEND_OPTIONS)
 
-    # Set the workspace and global variables
-    ENV_PATH = os.path.normpath(os.path.join(sys.argv[1], ".."))
-    MOSAICS_FILENAME = sys.argv[2]
-    LOG_FILENAME = sys.argv[3]
-    arcpy.env.workspace = ENV_PATH  # Not really useful here
-    arcpy.env.overwriteOutput = True
+        # Set the workspace and global variables
+        ENV_PATH = os.path.normpath(os.path.join(sys.argv[1], ".."))
+        MOSAICS_FILENAMES = sys.argv[2].split(",")
+        LOG_FILENAME = sys.argv[3]
+        WORKERS = int(sys.argv[4]) if len(sys.argv) > 4 else 1
+        OPTIONS = [argument.upper() for argument in sys.argv[5:]]
+        use_template = "TEMPLATE" in OPTIONS
+        reconcile = "RECONCILE" in OPTIONS
+        set_up_environment(ENV_PATH)
 
-    # Do not spread operations across multiple processes.
-    arcpy.env.parallelProcessingFactor = "0"
+        # Create logger object
+        logging.basicConfig(level=logging.DEBUG,
+                            format=LOG_FORMAT,
+                            datefmt='%d %b %Y %H:%M:%S',
+                            filename=LOG_FILENAME)
 
-    # Create logger object 
-    logging.basicConfig(level=logging.DEBUG,
-                        format='%(asctime)s %(filename)s %(levelname)-8s %(message)s',
-                        datefmt='%d %b %Y %H:%M:%S',
-                        filename=LOG_FILENAME)
-
-    logging.info("Script initiating...")
-    f = open(MOSAICS_FILENAME, "r")
-    mosaics = []
-    for x in f.readlines():
-        line = x.strip().split(";")
-        mosaics.append(line)
-
-    # For each item, create an empty mosaic data set
-    for mosaic in mosaics:
-        database_name = mosaic[1]
-        country_code = database_name[:2]  # IT_2016.gdb --> IT
-        database_path = os.path.join(ENV_PATH, country_code, database_name)
-        mosaic_name = mosaic[2]
-        nodata_value = mosaic[3]
-        create_mosaic(database_path, mosaic_name, nodata_value)
-        update_mosaic_statistics(database_path, mosaic_name)
-
-    f.close()
-    logging.info("Script finished.")
-
-except arcpy.ExecuteError:
-    logging.info("Script did not complete.")
-    # log errors
-    logging.error(arcpy.GetMessages(2))
-
-except:
-    logging.info(arcpy.GetMessages())
+        logging.info("Script initiating...")
+        METRICS_FILENAME = toolMetrics.metrics_filename_of(LOG_FILENAME)  # time every tool, see toolMetrics
+        metrics_offset = toolMetrics.file_offset(METRICS_FILENAME)
+        gp = toolMetrics.instrument(gp, METRICS_FILENAME)
+        gp = gpRetry.retrying(gp, METRICS_FILENAME)  # wait for geo databases locked by others, see gpRetry
+        jobs = []
+        for mosaics_filename in MOSAICS_FILENAMES:
+            jobs.extend(read_jobs(ENV_PATH, mosaics_filename))
+
+        # For each item, create an empty mosaic data set
+        try:
+            mosaicScheduler.run_jobs(jobs, create_job, WORKERS, _initializer=init_worker,
+                                     _initargs=(BACKEND_NAME, BACKEND_OPTIONS, ENV_PATH, LOG_FILENAME, use_template,
+                                                reconcile))
+        finally:
+            if use_template:
+                delete_templates(jobs)
+
+        toolMetrics.log_summary(METRICS_FILENAME, metrics_offset)
+        logging.info("Script finished.")
+
+    except folderConfig.ConfigError as error:
+        logging.error("Folders file not valid, no mosaic data set touched:\n%s", error)
+
+    except gp.ExecuteError:
+        logging.info("Script did not complete.")
+        # log errors
+        logging.error(gp.get_messages(2))
+
+    except:
+        logging.info(gp.get_messages())
@@ -0,0 +1,111 @@
+# Author:   GEOTEC, UJI
+# Date:     March 2016
+#
+# Purpose:  Write the custom fields (PARAMNAME, YEAR, SDATE, DATE, FORE) of many catalog rows at once.
+#           Values of every row are computed up front from raster names (see rasterNames) and written in a single
+#           pass of an update cursor that only looks values up, so no parsing happens while rows are locked.
+#           When no field written differs from row to row (PER_ROW_FIELDS), rows sharing the same values are
+#           written in bulk instead, with one field calculation per group, and only the rest go through the cursor.
+#           If a field calculation fails, its rows go through the update cursor as well.
+#
+# Note:     A field calculation only pays off when it replaces the update of its rows: SDATE and DATE differ from
+#           row to row, so the custom fields of new rasters (CUSTOM_FIELDS) always use the cursor pass. Bulk writes
+#           serve fields shared by many rows (Ex: resetting the FORE flag).
+#
+# Usage:    values, unparsed = fieldWriter.compute_values(rows, rasterNames.parser_of(rasterNames.LTA))
+#           fieldWriter.write_values(gp, mosaic_path, fieldWriter.CUSTOM_FIELDS, values, where_clause)
+
+import collections
+import logging
+
+CUSTOM_FIELDS = ["PARAMNAME", "YEAR", "SDATE", "DATE"]
+PER_ROW_FIELDS = ["SDATE", "DATE"]  # differ from row to row: fields written with them use the cursor
+BULK_MIN_ROWS = 20  # smaller groups are not worth a field calculation, which is a geoprocessing tool
+
+
+def compute_values(_rows, _parse, _extra=()):
+    """Values of the custom fields of catalog rows, parsed from their names
+
+    :param _rows: [OBJECTID, Name] rows, as returned by catalogQuery.new_rows(gp, mosaic_path, ["Name"], ...)
+    :param _parse: raster name parser, see rasterNames.parser_of
+    :param _extra: values appended to every row after PARAMNAME, YEAR, SDATE and DATE. Ex: (1,) for FORE
+    :return: (dictionary {OBJECTID: tuple of values}, list of names that cannot be parsed)
+    """
+    values = {}
+    unparsed = []
+    for object_id, name in _rows:
+        raster_name = _parse(name)
+        if raster_name is None:
+            unparsed.append(name)
+            continue
+        values[object_id] = (raster_name.paramname, raster_name.year, raster_name.sdate, raster_name.date) + \
+            tuple(_extra)
+    return values, unparsed
+
+
+def group_rows(_values):
+    """Group rows with exactly the same values
+
+    :param _values: dictionary {OBJECTID: tuple of values}
+    :return: ordered dictionary {tuple of values: sorted list of OBJECTID}
+    """
+    groups = collections.OrderedDict()
+    for object_id in sorted(_values):
+        groups.setdefault(_values[object_id], []).append(object_id)
+    return groups
+
+
+def object_id_clause(_gp, _workspace, _object_ids):
+    """SQL expression selecting rows by OBJECTID. Ex: "OBJECTID" IN (1,2,3)
+
+    :param _gp: geoprocessing backend
+    :param _workspace:
+    :param _object_ids:
+    :return:
+    """
+    return "%s IN (%s)" % (_gp.add_field_delimiters(_workspace, "OBJECTID"),
+                           ",".join(str(object_id) for object_id in _object_ids))
+
+
+def write_values(_gp, _mosaic_path, _fields, _values, _where_clause=None, _bulk_min_rows=BULK_MIN_ROWS):
+    """Write precomputed values of custom fields, in bulk where rows share values and no field differs from row to
+    row, and with a cursor otherwise
+
+    :param _gp: geoprocessing backend
+    :param _mosaic_path:
+    :param _fields: custom fields, in the order of the values
+    :param _values: dictionary {OBJECTID: tuple of values}
+    :param _where_clause: SQL expression returning (at least) the rows of _values, for the update cursor
+    :param _bulk_min_rows: minimum size of a group of rows written with a field calculation. None disables them
+    :return: (rows written in bulk, rows written with the update cursor)
+    """
+    pending = dict(_values)
+    bulk_rows = 0
+    per_row = [field for field in _fields if field in PER_ROW_FIELDS]
+    if _bulk_min_rows is not None and not per_row and hasattr(_gp, "calculate_fields"):
+        for values, object_ids in group_rows(_values).items():
+            if len(object_ids) < _bulk_min_rows:
+                continue
+            try:
+                _gp.calculate_fields(_mosaic_path, object_id_clause(_gp, _gp.env.workspace, object_ids),
+                                     dict(zip(_fields, values)))
+            except _gp.ExecuteError:
+                logging.warning("Field calculation failed, %s rows will be updated one by one: %s",
+                                len(object_ids), _gp.get_messages(2))
+                continue
+            bulk_rows += len(object_ids)
+            for object_id in object_ids:
+                del pending[object_id]
+
+    cursor_rows = 0
+    if pending:
+        # Rows written in bulk may no longer match _where_clause (Ex: the sentinel), the pending ones still do
+        with _gp.update_cursor(_mosaic_path, ["OID@"] + list(_fields), _where_clause) as cursor:
+            for row in cursor:
+                values = pending.get(row[0])
+                if values is None:
+                    continue
+                cursor.updateRow([row[0]] + list(values))
+                cursor_rows += 1
+        del cursor
+    return bulk_rows, cursor_rows
@@ -0,0 +1,191 @@
+# Author:   GEOTEC, UJI
+# Date:     March 2016
+#
+# Purpose:  Read folders files (Ex: IT_2016_folders.txt) into mosaic data set records, one line at a time.
+#           Each line holds: source folder;geo database;mosaic data set;nodata value (NA if none). Besides:
+#           1/ blank lines and lines starting with # are skipped
+#           2/ "include <folders file>" reads another folders file (relative to the including one, wildcards
+#              allowed), so that a season file can be assembled from per country files
+#           3/ source folders may hold wildcards (*, ?, [...]); the line stands for every folder that matches.
+#              {0}, {1}... in geo database and mosaic data set names are replaced by the parts of the folder
+#              matched by the first, second... path components with wildcards. Ex:
+#              C:/ERMES/data/*/Regional/*_EI_R1_Monitoring/2016/NDVI;{0}_2016.gdb;REGIONAL_MONITORING_NDVI;32767
+#           All lines of all files are checked up front (check_config), so that a malformed line stops a script
+#           before it touches any mosaic data set; then records are read lazily (iter_config).
+#
+# Usage:    for config in folderConfig.read_config("IT_2016_folders.txt"):
+#               database_path = folderConfig.database_path(env_path, config)
+
+import collections
+import glob
+import os
+import re
+
+INCLUDE = "include"
+FIELDS = 4
+
+# Mosaic data set described by a line of a folders file. Country is the code of the geo database (IT_2016.gdb --> IT)
+MosaicConfig = collections.namedtuple("MosaicConfig", ["source_folder", "database_name", "mosaic_name", "nodata",
+                                                       "country", "filename", "line_number"])
+
+_DATABASE_PATTERN = re.compile(r"^[A-Za-z]{2}[A-Za-z0-9_]*\.gdb$")
+_MOSAIC_PATTERN = re.compile(r"^[A-Za-z][A-Za-z0-9_]*$")
+_NODATA_PATTERN = re.compile(r"^(NA|-?\d+(\.\d+)?)$")
+_PLACEHOLDER_PATTERN = re.compile(r"\{(\d+)\}")
+
+
+class ConfigError(ValueError):
+    """Malformed folders file. Holds every problem found, as "filename:line: message" strings"""
+
+    def __init__(self, _problems):
+        ValueError.__init__(self, "\n".join(_problems))
+        self.problems = list(_problems)
+
+
+def database_path(_env_path, _config):
+    """Path of the geo database of a mosaic data set. Ex: <env_path>/IT/IT_2016.gdb
+
+    :param _env_path: folder holding one sub folder per country with its geo databases
+    :param _config: MosaicConfig
+    :return:
+    """
+    return os.path.join(_env_path, _config.country, _config.database_name)
+
+
+def expand_folder(_source_folder):
+    """Folders matching a source folder with wildcards, with the parts matched by each wildcard component
+
+    :param _source_folder:
+    :return: list of (folder, tuple of matched parts), sorted by folder. [(_source_folder, ())] without wildcards
+    """
+    if not glob.has_magic(_source_folder):
+        return [(_source_folder, ())]
+    components = re.split(r"[\\/]", _source_folder)
+    wildcards = [i for i, component in enumerate(components) if glob.has_magic(component)]
+    folders = []
+    for folder in sorted(glob.glob(_source_folder)):
+        if not os.path.isdir(folder):
+            continue
+        parts = re.split(r"[\\/]", folder)
+        folders.append((folder, tuple(parts[i] for i in wildcards)))
+    return folders
+
+
+def _fill(_template, _parts):
+    return _PLACEHOLDER_PATTERN.sub(lambda match: _parts[int(match.group(1))], _template)
+
+
+def _parse(_filename, _line_number, _fields):
+    """Records of a line split by ";", or the list of its problems"""
+    where = "%s:%d:" % (_filename, _line_number)
+    if len(_fields) != FIELDS:
+        return None, ["%s %d fields instead of %d (source folder;geo database;mosaic data set;nodata)"
+                      % (where, len(_fields), FIELDS)]
+    source_folder, database_name, mosaic_name, nodata = [field.strip() for field in _fields]
+    problems = []
+    if not source_folder:
+        problems.append("%s empty source folder" % where)
+    placeholders = [int(index) for index in _PLACEHOLDER_PATTERN.findall(database_name + mosaic_name)]
+    wildcards = len([component for component in re.split(r"[\\/]", source_folder) if glob.has_magic(component)])
+    if placeholders and max(placeholders) >= wildcards:
+        problems.append("%s {%d} but only %d wildcard folder(s) in %s"
+                        % (where, max(placeholders), wildcards, source_folder))
+    if problems:
+        return None, problems
+
+    if not _NODATA_PATTERN.match(nodata):
+        problems.append("%s nodata value %s is neither NA nor a number" % (where, nodata))
+    configs = []
+    for folder, parts in expand_folder(source_folder):
+        database = _fill(database_name, parts)
+        mosaic = _fill(mosaic_name, parts)
+        if not _DATABASE_PATTERN.match(database):
+            problems.append("%s geo database %s is not <country code>....gdb (Ex: IT_2016.gdb)" % (where, database))
+        if not _MOSAIC_PATTERN.match(mosaic):
+            problems.append("%s mosaic data set name %s is not valid" % (where, mosaic))
+        configs.append(MosaicConfig(folder, database, mosaic, nodata, database[:2], _filename, _line_number))
+    if not configs:
+        problems.append("%s no folder matches %s" % (where, source_folder))
+    return configs, problems
+
+
+def _includes(_filename, _argument):
+    pattern = os.path.join(os.path.dirname(_filename), _argument)
+    return sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+
+
+def _walk(_filename, _problems, _stack=()):
+    """Records of a folders file and its includes, lazily. Problems are appended to _problems"""
+    if os.path.abspath(_filename) in _stack:
+        _problems.append("%s: included by itself (%s)" % (_filename, " > ".join(_stack)))
+        return
+    try:
+        f = open(_filename, "r")
+    except IOError as error:
+        _problems.append("%s: cannot be read: %s" % (_filename, error))
+        return
+    stack = _stack + (os.path.abspath(_filename),)
+    with f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            words = line.split(None, 1)
+            if words[0].lower() == INCLUDE and len(words) == 2 and ";" not in line:
+                for included in _includes(_filename, words[1].strip()):
+                    for config in _walk(included, _problems, stack):
+                        yield config
+                continue
+            configs, problems = _parse(_filename, line_number, line.split(";"))
+            _problems.extend(problems)
+            for config in configs or []:
+                yield config
+
+
+def check_config(_filename):
+    """Check every line of a folders file and its includes, without keeping them
+
+    :param _filename:
+    :return: number of mosaic data sets
+    :raise ConfigError: with every problem found, including mosaic data sets listed twice
+    """
+    problems = []
+    seen = {}
+    count = 0
+    for config in _walk(_filename, problems):
+        key = (config.database_name.lower(), config.mosaic_name.lower())
+        if key in seen:
+            problems.append("%s:%d: mosaic data set %s of %s already in %s" % (
+                config.filename, config.line_number, config.mosaic_name, config.database_name, seen[key]))
+        else:
+            seen[key] = "%s:%d" % (config.filename, config.line_number)
+        count += 1
+    if problems:
+        raise ConfigError(problems)
+    return count
+
+
+def iter_config(_filename):
+    """Mosaic data sets of a folders file and its includes, read lazily and not checked (see check_config)
+
+    :param _filename:
+    :return: generator of MosaicConfig
+    """
+    problems = []
+    for config in _walk(_filename, problems):
+        if problems:
+            raise ConfigError(problems)
+        yield config
+    if problems:
+        raise ConfigError(problems)
+
+
+def read_config(_filename):
+    """Check a folders file and then read its mosaic data sets lazily
+
+    :param _filename:
+    :return: generator of MosaicConfig
+    :raise ConfigError: before any record is returned, if any line is malformed
+    """
+    check_config(_filename)
+    return iter_config(_filename)
@@ -0,0 +1,103 @@
+# Author:   GEOTEC, UJI
+# Date:     March 2016
+#
+# Purpose:  Keep track of the raster files of each source folder that have already been handed to
+#           AddRastersToMosaicDataset_management. A manifest is a small JSON file per mosaic data set that stores
+#           name, size and modification time of every raster file seen in the last successful update.
+#           Comparing a source folder against its manifest tells which files are new, so that the update scripts
+#           skip mosaic data sets without new files and only pass new files to the add step.
+#
+# Note:     Manifests live in a "manifests" folder next to the log file, one per geo database and mosaic data set.
+#           Deleting a manifest is safe: the next update hands the whole folder to the add step again and
+#           "Exclude Duplicates" discards the rasters already in the mosaic data set. Forecasts removed by the
+#           retention of updateMosaicDatasetsFORE.py are skipped (see expired_files), with a warning in the log.
+#
+# Usage:    manifest_path = folderManifest.manifest_path(manifest_folder, database_path, mosaic_name)
+#           scan = folderManifest.scan_folder(source_folder)
+#           new_files = folderManifest.new_files(scan, folderManifest.load_manifest(manifest_path))
+#           ...
+#           folderManifest.save_manifest(manifest_path, scan)
+
+import fnmatch
+import json
+import os
+
+
+def manifest_folder_of(_log_filename):
+    """Folder where manifests are stored: "manifests" next to the log file
+
+    :param _log_filename:
+    :return:
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(_log_filename)), "manifests")
+
+
+def manifest_path(_manifest_folder, _database_path, _mosaic_name):
+    """Manifest file of a mosaic data set. Ex: manifests/IT_2016.gdb_REGIONAL_MONITORING_NDVI.json
+
+    :param _manifest_folder:
+    :param _database_path:
+    :param _mosaic_name:
+    :return:
+    """
+    return os.path.join(_manifest_folder,
+                        "%s_%s.json" % (os.path.basename(os.path.normpath(_database_path)), _mosaic_name))
+
+
+def scan_folder(_source_folder, _filter="*.tif"):
+    """Name, size and modification time of the raster files of a source folder (no sub folders)
+
+    :param _source_folder:
+    :param _filter: same wildcard as the "filter" parameter of AddRastersToMosaicDataset_management
+    :return: dictionary {filename: [size, mtime]}
+    """
+    scan = {}
+    for filename in os.listdir(_source_folder):
+        if not fnmatch.fnmatch(filename, _filter):
+            continue
+        stats = os.stat(os.path.join(_source_folder, filename))
+        scan[filename] = [stats.st_size, int(stats.st_mtime)]
+    return scan
+
+
+def load_manifest(_manifest_path):
+    """Read a manifest. A missing or unreadable manifest is an empty one
+
+    :param _manifest_path:
+    :return: dictionary {filename: [size, mtime]}
+    """
+    if not os.path.isfile(_manifest_path):
+        return {}
+    try:
+        with open(_manifest_path, "r") as f:
+            return json.load(f)
+    except ValueError:
+        return {}
+
+
+def save_manifest(_manifest_path, _scan):
+    """Write a manifest, replacing the previous one only once the new one is completely written
+
+    :param _manifest_path:
+    :param _scan: dictionary {filename: [size, mtime]}
+    :return:
+    """
+    folder = os.path.dirname(_manifest_path)
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder)
+    temporary_path = _manifest_path + ".tmp"
+    with open(temporary_path, "w") as f:
+        json.dump(_scan, f, sort_keys=True)
+    if os.path.exists(_manifest_path):
+        os.remove(_manifest_path)  # os.rename does not overwrite on Windows
+    os.rename(temporary_path, _manifest_path)
+
+
+def new_files(_scan, _manifest):
+    """Files of a folder scan that are not in the manifest, sorted by name
+
+    :param _scan:
+    :param _manifest:
+    :return:
+    """
+    return sorted(filename for filename in _scan if filename not in _manifest)
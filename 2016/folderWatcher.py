@@ -0,0 +1,103 @@
+# Author:   GEOTEC, UJI
+# Date:     March 2016
+#
+# Purpose:  Watch the source folders of mosaic data sets and tell when new raster files can be added to them.
+#           Folders are polled (name, size and modification time of *.tif files, see folderManifest.scan_folder).
+#           A mosaic data set is ready when its source folder holds files not added yet and has been quiet for
+#           <settle_seconds>: no file appeared or changed size since the previous poll and the newest new file was
+#           last modified <settle_seconds> ago. Files being copied keep changing, so they are not handed to the add
+#           step half written; all files that arrive together are added in the same update (micro batch).
+#
+# Note:     Polling needs no extra package and works on network drives, where change notifications are unreliable.
+#           Files added are read from manifests on start up and after every update (see folderManifest), so that
+#           a restart does not update every mosaic data set again and files held back by the update are tried again.
+#           The update step scans the source folder again: a file that appears between the poll and the update is
+#           handed to the add step as well, so keep <settle_seconds> well above the time it takes to copy a raster.
+#
+# Usage:    watcher = folderWatcher.FolderWatcher(jobs, 30, manifest_folder)
+#           for job, filenames in watcher.poll():
+#               (update the mosaic data set of the job)
+#               watcher.mark_added(job)
+
+import logging
+import time
+
+import folderManifest
+
+SETTLE_SECONDS = 30  # quiet time before a source folder is ingested
+
+
+class FolderWatcher(object):
+    """Poll source folders of update jobs and return the jobs with settled new raster files
+
+    :param _jobs: jobs starting with (database_path, mosaic_name, source_folder, ...)
+    :param _settle_seconds:
+    :param _manifest_folder: manifests of the files already added, None to start with empty ones
+    :param _clock: current time in seconds since the epoch, as time.time (the clock of modification times)
+    """
+
+    def __init__(self, _jobs, _settle_seconds=SETTLE_SECONDS, _manifest_folder=None, _clock=time.time):
+        self.jobs = list(_jobs)
+        self.settle_seconds = _settle_seconds
+        self.clock = _clock
+        self.manifest_folder = _manifest_folder
+        self.added = {}  # job --> {filename: [size, mtime]} added to the mosaic data set
+        self.scans = {}  # job --> last scan of its source folder
+        self.changed_at = {}  # job --> time the scan was last seen changing
+        self.missing = set()  # source folders that could not be read
+        for job in self.jobs:
+            self.added[job] = self.load_added(job)
+            self.changed_at[job] = 0
+
+    def load_added(self, _job):
+        """Files added to the mosaic data set of a job, as saved in its manifest by the update scripts"""
+        if self.manifest_folder is None:
+            return {}
+        return folderManifest.load_manifest(folderManifest.manifest_path(self.manifest_folder, _job[0], _job[1]))
+
+    def scan(self, _source_folder):
+        """Scan of a source folder, empty if it cannot be read (logged once)"""
+        try:
+            scan = folderManifest.scan_folder(_source_folder)
+        except OSError as error:
+            if _source_folder not in self.missing:
+                logging.warning("Source folder %s cannot be read: %s", _source_folder, error)
+                self.missing.add(_source_folder)
+            return {}
+        self.missing.discard(_source_folder)
+        return scan
+
+    def poll(self):
+        """Scan every source folder once
+
+        :return: list of (job, sorted list of new filenames) of the jobs ready to be updated
+        """
+        now = self.clock()
+        scans = {}  # jobs may share a source folder
+        ready = []
+        for job in self.jobs:
+            source_folder = job[2]
+            if source_folder not in scans:
+                scans[source_folder] = self.scan(source_folder)
+            scan = scans[source_folder]
+            if scan != self.scans.get(job):
+                if job in self.scans:
+                    self.changed_at[job] = now
+                self.scans[job] = scan
+            new_files = folderManifest.new_files(scan, self.added[job])
+            if not new_files:
+                continue
+            newest = max([self.changed_at[job]] + [scan[filename][1] for filename in new_files])
+            if now - newest >= self.settle_seconds:
+                ready.append((job, new_files))
+        return ready
+
+    def mark_added(self, _job):
+        """Record that a job has updated its mosaic data set. With manifests, the files added are read from the
+        manifest saved by the update, which leaves out files held back (see rasterIntegrity): they are ready again
+        once settled. Without manifests, every file of the last scan is taken as added
+        """
+        if self.manifest_folder is None:
+            self.added[_job] = dict(self.scans.get(_job, {}))
+        else:
+            self.added[_job] = self.load_added(_job)
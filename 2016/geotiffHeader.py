@@ -0,0 +1,185 @@
+# Author:   GEOTEC, UJI
+# Date:     March 2016
+#
+# Purpose:  Read the header of GeoTIFF files (ERMES rasters) without arcpy and without reading pixels: size, pixel
+#           type, NoData, cell size and extent of the first image, and where its strips or tiles are stored.
+#           Only the tags are read (a few KB per file), so thousands of headers are read in a second on Linux as on
+#           Windows. Classic TIFF and BigTIFF, little and big endian files are supported.
+#
+# Note:     Cell size and extent come from ModelPixelScale + ModelTiepoint, or from ModelTransformation (no
+#           rotation). Rasters georeferenced otherwise (world files, rotated grids) have no extent.
+#           Pixel types are named as arcpy names them. Ex: 16_BIT_SIGNED, 32_BIT_FLOAT.
+#
+# Usage:    header = geotiffHeader.read_header("IT_Monitoring_NDVI_2016_001.tif")
+#           header.cell_size, header.extent, header.pixel_type, header.nodata
+
+import collections
+import os
+import struct
+
+# TIFF tags
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+STRIP_OFFSETS = 273
+SAMPLES_PER_PIXEL = 277
+ROWS_PER_STRIP = 278
+STRIP_BYTE_COUNTS = 279
+TILE_WIDTH = 322
+TILE_LENGTH = 323
+TILE_OFFSETS = 324
+TILE_BYTE_COUNTS = 325
+SAMPLE_FORMAT = 339
+MODEL_PIXEL_SCALE = 33550
+MODEL_TIEPOINT = 33922
+MODEL_TRANSFORMATION = 34264
+GEO_KEY_DIRECTORY = 34735
+GDAL_NODATA = 42113
+
+# TIFF field type --> (struct format, size in bytes)
+FIELD_TYPES = {1: ("B", 1), 2: ("s", 1), 3: ("H", 2), 4: ("I", 4), 5: ("II", 8), 6: ("b", 1), 7: ("B", 1),
+               8: ("h", 2), 9: ("i", 4), 10: ("ii", 8), 11: ("f", 4), 12: ("d", 8), 16: ("Q", 8), 17: ("q", 8),
+               18: ("Q", 8)}
+
+# (SampleFormat, BitsPerSample) --> pixel type of arcpy. SampleFormat: 1 unsigned, 2 signed, 3 floating point
+PIXEL_TYPES = {(1, 1): "1_BIT", (1, 2): "2_BIT", (1, 4): "4_BIT", (1, 8): "8_BIT_UNSIGNED", (2, 8): "8_BIT_SIGNED",
+               (1, 16): "16_BIT_UNSIGNED", (2, 16): "16_BIT_SIGNED", (1, 32): "32_BIT_UNSIGNED",
+               (2, 32): "32_BIT_SIGNED", (3, 32): "32_BIT_FLOAT", (3, 64): "64_BIT"}
+
+PROJECTED_CS_KEY = 3072  # ProjectedCSTypeGeoKey
+GEOGRAPHIC_CS_KEY = 2048  # GeographicTypeGeoKey
+
+# Header of the first image of a GeoTIFF file
+#   cell_size: (x, y), extent: (xmin, ymin, xmax, ymax), both None without georeferencing
+#   nodata: text of the GDAL_NODATA tag or None, epsg: code of the coordinate system or None
+#   offsets, byte_counts: where strips (or tiles) are stored in the file, block_count: strips or tiles expected
+TiffHeader = collections.namedtuple("TiffHeader", ["width", "height", "bands", "pixel_type", "compression",
+                                                   "nodata", "cell_size", "extent", "epsg", "tiled", "offsets",
+                                                   "byte_counts", "block_count", "file_size"])
+
+
+class TiffError(ValueError):
+    """Not a TIFF file, or a TIFF file whose header is cut short or malformed"""
+
+
+def _read(_f, _offset, _size, _file_size):
+    if _offset < 0 or _offset + _size > _file_size:
+        raise TiffError("header points beyond the end of the file (%d bytes at %d of %d)" % (_size, _offset,
+                                                                                            _file_size))
+    _f.seek(_offset)
+    return _f.read(_size)
+
+
+def read_tags(_f, _file_size):
+    """Tags of the first image directory of an open TIFF file
+
+    :param _f: file open in binary mode
+    :param _file_size:
+    :return: dictionary {tag: tuple of values}, text for ASCII tags
+    """
+    start = _read(_f, 0, 8, _file_size)
+    if start[:2] == b"II":
+        order = "<"
+    elif start[:2] == b"MM":
+        order = ">"
+    else:
+        raise TiffError("not a TIFF file")
+    version = struct.unpack(order + "H", start[2:4])[0]
+    if version == 42:  # classic TIFF
+        directory = struct.unpack(order + "I", start[4:8])[0]
+        count_format, entry_format, entry_size, inline_size = "H", "HHI4s", 12, 4
+    elif version == 43:  # BigTIFF
+        directory = struct.unpack(order + "Q", _read(_f, 8, 8, _file_size))[0]
+        count_format, entry_format, entry_size, inline_size = "Q", "HHQ8s", 20, 8
+    else:
+        raise TiffError("not a TIFF file (version %d)" % version)
+
+    offset_format = "I" if inline_size == 4 else "Q"
+    count_size = struct.calcsize(count_format)
+    entries = struct.unpack(order + count_format, _read(_f, directory, count_size, _file_size))[0]
+    data = _read(_f, directory + count_size, entries * entry_size, _file_size)
+    tags = {}
+    for i in range(entries):
+        tag, field_type, count, value = struct.unpack(order + entry_format, data[i * entry_size:(i + 1) * entry_size])
+        if field_type not in FIELD_TYPES:
+            continue  # unknown types are skipped, as TIFF readers do
+        value_format, value_size = FIELD_TYPES[field_type]
+        size = value_size * count
+        if size > inline_size:
+            value = _read(_f, struct.unpack(order + offset_format, value)[0], size, _file_size)
+        else:
+            value = value[:size]
+        if field_type == 2:
+            tags[tag] = value.rstrip(b"\0").decode("ascii", "replace")
+        else:
+            tags[tag] = struct.unpack(order + value_format[0] * (count * len(value_format)), value)
+    return tags
+
+
+def _geo_keys(_tags):
+    """GeoKeys stored in the GeoKeyDirectory tag (SHORT values only): {key: value}"""
+    directory = _tags.get(GEO_KEY_DIRECTORY)
+    if not directory or len(directory) < 4:
+        return {}
+    keys = {}
+    for i in range(directory[3]):
+        key, location, count, value = directory[4 + 4 * i:8 + 4 * i]
+        if location == 0:
+            keys[key] = value
+    return keys
+
+
+def _georeferencing(_tags, _width, _height):
+    """(cell_size, extent) of the image, (None, None) when not georeferenced by scale + tie point or transform"""
+    scale = _tags.get(MODEL_PIXEL_SCALE)
+    tiepoint = _tags.get(MODEL_TIEPOINT)
+    if scale and tiepoint and len(scale) >= 2 and len(tiepoint) >= 6:
+        cell_x, cell_y = scale[0], scale[1]
+        origin_x = tiepoint[3] - tiepoint[0] * cell_x
+        origin_y = tiepoint[4] + tiepoint[1] * cell_y
+    else:
+        transformation = _tags.get(MODEL_TRANSFORMATION)
+        if not transformation or len(transformation) < 8 or transformation[1] or transformation[4]:
+            return None, None
+        cell_x, cell_y = transformation[0], -transformation[5]
+        origin_x, origin_y = transformation[3], transformation[7]
+    return (cell_x, cell_y), (origin_x, origin_y - _height * cell_y, origin_x + _width * cell_x, origin_y)
+
+
+def read_header(_path):
+    """Header of the first image of a GeoTIFF file
+
+    :param _path:
+    :return: TiffHeader
+    :raise TiffError: the file is not a TIFF file or its header is cut short
+    """
+    file_size = os.path.getsize(_path)
+    with open(_path, "rb") as f:
+        tags = read_tags(f, file_size)
+
+    for tag in [IMAGE_WIDTH, IMAGE_LENGTH]:
+        if tag not in tags:
+            raise TiffError("tag %d missing" % tag)
+    width, height = tags[IMAGE_WIDTH][0], tags[IMAGE_LENGTH][0]
+    bands = tags.get(SAMPLES_PER_PIXEL, (1,))[0]
+    bits = tags.get(BITS_PER_SAMPLE, (1,))[0]
+    sample_format = tags.get(SAMPLE_FORMAT, (1,))[0]
+    tiled = TILE_OFFSETS in tags
+    if tiled:
+        tile_width, tile_length = tags.get(TILE_WIDTH, (0,))[0], tags.get(TILE_LENGTH, (0,))[0]
+        if not tile_width or not tile_length:
+            raise TiffError("tile size missing")
+        block_count = -(-width // tile_width) * -(-height // tile_length)
+        offsets, byte_counts = tags[TILE_OFFSETS], tags.get(TILE_BYTE_COUNTS, ())
+    else:
+        rows_per_strip = min(tags.get(ROWS_PER_STRIP, (height,))[0], height) or height
+        block_count = -(-height // rows_per_strip)
+        offsets, byte_counts = tags.get(STRIP_OFFSETS, ()), tags.get(STRIP_BYTE_COUNTS, ())
+    cell_size, extent = _georeferencing(tags, width, height)
+    geo_keys = _geo_keys(tags)
+    nodata = tags.get(GDAL_NODATA)
+    return TiffHeader(width, height, bands, PIXEL_TYPES.get((sample_format, bits), "UNKNOWN"),
+                      tags.get(COMPRESSION, (1,))[0], nodata.strip() if nodata else None, cell_size, extent,
+                      geo_keys.get(PROJECTED_CS_KEY, geo_keys.get(GEOGRAPHIC_CS_KEY)), tiled, tuple(offsets),
+                      tuple(byte_counts), block_count, file_size)
@@ -0,0 +1,731 @@
+# Author:   GEOTEC, UJI
+# Date:     March 2016
+#
+# Purpose:  Geoprocessing backends used by the create and update scripts.
+#           1/ ArcpyBackend forwards every call to arcpy (production).
+#           2/ StubBackend keeps the catalog of each mosaic data set in SQLite (one database per geo database)
+#              and sleeps a configurable time per tool call, so that the update logic can be run and timed
+#              on machines without ArcGIS (e.g. to measure the speedup of parallel updates on Linux).
+#
+# Note:     Scripts hold the backend in a global variable named gp and use it as they used arcpy:
+#           gp.env.workspace, gp.ExecuteError, gp.get_messages(2), ...
+#           Scripts pick their backend with backend_settings: arcpy unless the ERMES_GP_BACKEND environment
+#           variable says otherwise, with constructor options as JSON in ERMES_GP_OPTIONS. The same settings are
+#           handed to worker processes. Ex (Linux, no ArcGIS):
+#           ERMES_GP_BACKEND=stub ERMES_GP_OPTIONS='{"_root": "/tmp/gdb", "_latency": {"add_rasters": 0.5}}'
+#           With the stub, _root is needed as soon as several processes share geo databases; without it every
+#           geo database lives in the memory of a single process.
+#
+# Usage:    gp = gpBackend.create_backend("arcpy")
+#           gp = gpBackend.create_backend("stub", _root="/tmp/gdb", _latency={"add_rasters": 0.5})
+#           gp = gpBackend.create_backend(*gpBackend.backend_settings())
+
+import collections
+import datetime
+import fnmatch
+import json
+import os
+import sqlite3
+import time
+
+import geotiffHeader
+
+try:
+    string_types = basestring  # Python 2 (ArcGIS Desktop)
+except NameError:
+    string_types = str
+
+# Parameters of AddRastersToMosaicDataset_management shared by all update scripts.
+# Any of them can be overridden per call, e.g. gp.add_rasters(path, folder, build_pyramids="NO_PYRAMIDS")
+ADD_RASTERS_DEFAULTS = {
+    "raster_type": "Raster Dataset",
+    "update_cellsize_ranges": "UPDATE_CELL_SIZES",
+    "update_boundary": "UPDATE_BOUNDARY",
+    "update_overviews": "NO_OVERVIEWS",
+    "maximum_pyramid_levels": "",
+    "maximum_cell_size": "0",
+    "minimum_dimension": "1500",
+    "spatial_reference": "",
+    "filter": "*.tif",
+    "sub_folder": "NO_SUBFOLDERS",
+    "duplicate_items_action": "EXCLUDE_DUPLICATES",  # it sets "Exclude Duplicates" to true
+    "build_pyramids": "BUILD_PYRAMIDS",
+    "calculate_statistics": "CALCULATE_STATISTICS",
+    "build_thumbnails": "NO_THUMBNAILS",
+    "operation_description": "#",
+    "force_spatial_reference": "NO_FORCE_SPATIAL_REFERENCE"}
+
+
+# Field.type of arcpy.ListFields --> field type of AddField_management
+ARCPY_FIELD_TYPES = {"String": "TEXT", "SmallInteger": "SHORT", "Integer": "LONG", "Single": "FLOAT",
+                     "Double": "DOUBLE", "Date": "DATE", "OID": "OID", "Geometry": "GEOMETRY", "Blob": "BLOB",
+                     "Raster": "RASTER", "GUID": "GUID"}
+
+# Pixel type (see geotiffHeader) --> numpy data type of the cells read by StubBackend.raster_to_array
+STUB_DTYPES = {"8_BIT_UNSIGNED": "u1", "8_BIT_SIGNED": "i1", "16_BIT_UNSIGNED": "u2", "16_BIT_SIGNED": "i2",
+               "32_BIT_UNSIGNED": "u4", "32_BIT_SIGNED": "i4", "32_BIT_FLOAT": "f4", "64_BIT": "f8"}
+
+BACKEND_VARIABLE = "ERMES_GP_BACKEND"
+OPTIONS_VARIABLE = "ERMES_GP_OPTIONS"
+
+
+class GeoprocessingError(Exception):
+    """Raised by StubBackend where arcpy raises arcpy.ExecuteError"""
+    pass
+
+
+def create_backend(_name, **_options):
+    """Create a geoprocessing backend by name ("arcpy" or "stub")
+
+    :param _name:
+    :param _options: keyword arguments of the backend constructor
+    :return:
+    """
+    if _name == "arcpy":
+        return ArcpyBackend(**_options)
+    if _name == "stub":
+        return StubBackend(**_options)
+    raise ValueError("Unknown geoprocessing backend: %s" % _name)
+
+
+def backend_settings(_environ=None):
+    """Backend name and options read from the environment (ERMES_GP_BACKEND, ERMES_GP_OPTIONS), arcpy by default
+
+    :param _environ: dictionary of environment variables. None reads os.environ
+    :return: (name, dictionary of options), as taken by create_backend and the init_worker functions
+    """
+    environ = os.environ if _environ is None else _environ
+    name = environ.get(BACKEND_VARIABLE, "arcpy")
+    options = json.loads(environ.get(OPTIONS_VARIABLE) or "{}")
+    if not isinstance(options, dict):
+        raise ValueError("%s must hold a JSON object: %s" % (OPTIONS_VARIABLE, environ[OPTIONS_VARIABLE]))
+    return name, options
+
+
+class ArcpyBackend(object):
+    """Thin wrapper around arcpy. Method names follow the update scripts, arguments follow arcpy"""
+
+    def __init__(self):
+        import arcpy
+        self.arcpy = arcpy
+        self.env = arcpy.env
+        self.ExecuteError = arcpy.ExecuteError
+
+    def get_messages(self, _severity=None):
+        if _severity is None:
+            return self.arcpy.GetMessages()
+        return self.arcpy.GetMessages(_severity)
+
+    def get_count(self, _mosaic_path):
+        return int(self.arcpy.GetCount_management(_mosaic_path).getOutput(0))
+
+    def exists(self, _path):
+        return self.arcpy.Exists(_path)
+
+    def create_file_gdb(self, _folder, _database_name):
+        self.arcpy.CreateFileGDB_management(out_folder_path=_folder, out_name=_database_name, out_version="CURRENT")
+
+    def spatial_reference(self, _definition):
+        """Parse a coordinate system. Prefer spatialReferences.get, which parses each one once per process
+
+        :param _definition: WKT string or factory code (int)
+        :return: arcpy.SpatialReference
+        """
+        if isinstance(_definition, int):
+            return self.arcpy.SpatialReference(_definition)
+        spatial_reference = self.arcpy.SpatialReference()
+        spatial_reference.loadFromString(_definition)
+        return spatial_reference
+
+    def create_mosaic_dataset(self, _database_path, _mosaic_name, _spatial_reference):
+        self.arcpy.CreateMosaicDataset_management(in_workspace=_database_path,
+                                                  in_mosaicdataset_name=_mosaic_name,
+                                                  coordinate_system=_spatial_reference,
+                                                  num_bands="",
+                                                  pixel_type="", product_definition="NONE", product_band_definitions="")
+
+    def delete_mosaic(self, _mosaic_path):
+        self.arcpy.DeleteMosaicDataset_management(in_mosaic_dataset=_mosaic_path,
+                                                  delete_overview_images="DELETE_OVERVIEW_IMAGES",
+                                                  delete_item_cache="DELETE_ITEM_CACHE")
+
+    def copy(self, _source_path, _target_path):
+        self.arcpy.Copy_management(_source_path, _target_path)
+
+    def define_nodata(self, _mosaic_path, _nodata_value):
+        self.arcpy.DefineMosaicDatasetNoData_management(
+            in_mosaic_dataset=_mosaic_path,
+            num_bands="1",
+            bands_for_nodata_value=" ".join(["ALL_BANDS", _nodata_value]),
+            bands_for_valid_data_range="",
+            where_clause="",
+            Composite_nodata_value="NO_COMPOSITE_NODATA")
+
+    def add_fields(self, _mosaic_path, _fields):
+        """Add fields in a single schema operation where arcpy has AddFields, one by one otherwise
+
+        :param _mosaic_path:
+        :param _fields: list of (name, type, length). Length is None but for TEXT fields
+        :return:
+        """
+        if hasattr(self.arcpy, "AddFields_management"):
+            self.arcpy.AddFields_management(_mosaic_path, [[name, field_type, name, length or ""]
+                                                           for name, field_type, length in _fields])
+            return
+        for name, field_type, length in _fields:
+            self.arcpy.AddField_management(_mosaic_path, name, field_type, "", "", length or "", name,
+                                           "NULLABLE", "NON_REQUIRED", "")
+
+    def assign_default(self, _mosaic_path, _field, _value):
+        self.arcpy.AssignDefaultToField_management(_mosaic_path, _field, _value)
+
+    def describe_mosaic(self, _mosaic_path):
+        """Schema of an existing mosaic data set, as set up by createMosaicDatasets.py
+
+        :param _mosaic_path:
+        :return: {"fields": {NAME: field type of AddField}, "defaults": {NAME: value as text},
+                  "nodata": value as text or None, "spatial_reference": WKT string}
+        """
+        fields = self.arcpy.ListFields(_mosaic_path)
+        nodata = None
+        try:
+            nodata = self.arcpy.Describe(os.path.join(_mosaic_path, "Band_1")).noDataValue
+        except (AttributeError, IOError, RuntimeError):
+            pass  # no NoData defined
+        return {"fields": dict((field.name.upper(), ARCPY_FIELD_TYPES.get(field.type, field.type.upper()))
+                               for field in fields),
+                "defaults": dict((field.name.upper(), str(field.defaultValue)) for field in fields
+                                 if field.defaultValue is not None),
+                "nodata": None if nodata is None else str(nodata),
+                "spatial_reference": self.arcpy.Describe(_mosaic_path).spatialReference.exportToString()}
+
+    def calculate_statistics(self, _mosaic_path, _area_of_interest):
+        self.arcpy.CalculateStatistics_management(in_raster_dataset=_mosaic_path,
+                                                  x_skip_factor="1", y_skip_factor="1",
+                                                  ignore_values="", skip_existing="OVERWRITE",
+                                                  area_of_interest=_area_of_interest)
+
+    def set_statistics(self, _mosaic_path, _minimum, _maximum, _mean, _std):
+        """Statistics of the first band, as merged by itemStatistics, without reading any cell"""
+        self.arcpy.SetRasterProperties_management(in_raster=_mosaic_path,
+                                                  statistics="1 %r %r %r %r" % (_minimum, _maximum, _mean, _std))
+
+    def raster_to_array(self, _raster_path):
+        """Cells of the first band of a raster file
+
+        :param _raster_path:
+        :return: (numpy array, NoData value or None)
+        """
+        raster = self.arcpy.Raster(_raster_path)
+        return self.arcpy.RasterToNumPyArray(raster), raster.noDataValue
+
+    def analyze_mosaic(self, _mosaic_path, _checker_keywords):
+        self.arcpy.AnalyzeMosaicDataset_management(in_mosaic_dataset=_mosaic_path,
+                                                   where_clause="",
+                                                   checker_keywords=_checker_keywords)
+
+    def export_paths(self, _mosaic_path):
+        """Path of the raster file of every catalog item, through a table in memory
+
+        :param _mosaic_path:
+        :return: list of (OBJECTID, path)
+        """
+        table = "in_memory/ermes_paths"
+        self.arcpy.ExportMosaicDatasetPaths_management(in_mosaic_dataset=_mosaic_path, out_table=table,
+                                                       where_clause="", export_mode="ALL",
+                                                       types_of_paths="RASTER")
+        try:
+            with self.arcpy.da.SearchCursor(table, ["SourceOID", "Path"]) as cursor:
+                return [(row[0], row[1]) for row in cursor]
+        finally:
+            self.arcpy.Delete_management(table)
+
+    def add_rasters(self, _mosaic_path, _input_path, **_parameters):
+        parameters = dict(ADD_RASTERS_DEFAULTS)
+        parameters.update(_parameters)
+        self.arcpy.AddRastersToMosaicDataset_management(in_mosaic_dataset=_mosaic_path,
+                                                       input_path=_input_path,
+                                                       **parameters)
+
+    def add_field_delimiters(self, _workspace, _field):
+        return self.arcpy.AddFieldDelimiters(_workspace, _field)
+
+    def build_pyramids_and_statistics(self, _raster_path):
+        """Build pyramids (.ovr) and calculate statistics (.aux.xml) of a single raster file"""
+        self.arcpy.BuildPyramids_management(in_raster_dataset=_raster_path,
+                                            pyramid_level="-1",
+                                            SKIP_FIRST="NONE",
+                                            resample_technique="NEAREST",
+                                            compression_type="DEFAULT",
+                                            compression_quality="75",
+                                            skip_existing="SKIP_EXISTING")
+        self.arcpy.CalculateStatistics_management(in_raster_dataset=_raster_path,
+                                                  x_skip_factor="1", y_skip_factor="1",
+                                                  ignore_values="", skip_existing="SKIP_EXISTING")
+
+    def sql_date(self, _value):
+        """Date literal for SQL expressions on file geo databases. Ex: date '2016-09-01 00:00:00'"""
+        return "date '%s'" % _value.strftime("%Y-%m-%d %H:%M:%S")
+
+    def remove_rasters(self, _mosaic_path, _where_clause):
+        self.arcpy.RemoveRastersFromMosaicDataset_management(in_mosaic_dataset=_mosaic_path,
+                                                             where_clause=_where_clause,
+                                                             update_boundary="UPDATE_BOUNDARY",
+                                                             mark_overviews_items="MARK_OVERVIEW_ITEMS",
+                                                             delete_overview_images="DELETE_OVERVIEW_IMAGES",
+                                                             delete_item_cache="DELETE_ITEM_CACHE",
+                                                             remove_items="REMOVE_MOSAICDATASET_ITEMS",
+                                                             update_cellsize_ranges="UPDATE_CELL_SIZES")
+
+    def update_cursor(self, _mosaic_path, _fields, _where_clause=None):
+        return self.arcpy.da.UpdateCursor(_mosaic_path, _fields, _where_clause)
+
+    def search_cursor(self, _mosaic_path, _fields, _where_clause=None, _sql_clause=(None, None)):
+        return self.arcpy.da.SearchCursor(_mosaic_path, _fields, _where_clause, sql_clause=_sql_clause)
+
+    def calculate_fields(self, _mosaic_path, _where_clause, _values):
+        """Set the same values to all catalog rows returned by the SQL expression, one field calculation per field
+
+        :param _mosaic_path:
+        :param _where_clause:
+        :param _values: dictionary {field: value}. Values are str, int or datetime.datetime
+        :return:
+        """
+        # A table view of the mosaic data set is a view of its catalog table: rows are selected by the SQL expression
+        view = os.path.basename(_mosaic_path) + "_calculate_fields"
+        self.arcpy.MakeTableView_management(_mosaic_path, view, _where_clause)
+        try:
+            for field, value in _values.items():
+                self.arcpy.CalculateField_management(in_table=view, field=field, expression=repr(value),
+                                                     expression_type="PYTHON_9.3", code_block="import datetime")
+        finally:
+            self.arcpy.Delete_management(view)
+
+
+class StubEnvironment(object):
+    """Stand-in for arcpy.env"""
+
+    def __init__(self):
+        self.workspace = None
+        self.overwriteOutput = False
+        self.parallelProcessingFactor = None
+        self.outputCoordinateSystem = None
+
+
+class StubSpatialReference(object):
+    """Stand-in for arcpy.SpatialReference"""
+
+    def __init__(self, _definition):
+        self.definition = _definition
+
+    def exportToString(self):
+        return str(self.definition)
+
+
+class StubBackend(object):
+    """Geoprocessing simulator. Each geo database is a SQLite database and each mosaic data set is a table
+    holding its catalog: OBJECTID, Name, Path and the custom fields created by createMosaicDatasets.py.
+
+    :param _root: folder where SQLite files are kept. None keeps everything in memory (single process only)
+    :param _latency: seconds slept per call, by tool name. Ex: {"add_rasters": 2.0, "get_count": 0.2}
+    :param _item_latency: seconds slept per raster/row processed, by tool name. Ex: {"add_rasters": 0.5}
+                          add_rasters counts every input raster, including duplicates that are excluded
+    A file <geo database>.lock in _root (Ex: IT_2016.gdb.lock) stands for a schema lock held by another application
+    (the image service...): while it exists, tools on mosaic data sets of that geo database raise ERROR 000464.
+    """
+
+    def __init__(self, _root=None, _latency=None, _item_latency=None):
+        self.root = _root
+        self.latency = dict(_latency or {})
+        self.item_latency = dict(_item_latency or {})
+        self.env = StubEnvironment()
+        self.ExecuteError = GeoprocessingError
+        self.calls = collections.Counter()  # number of calls per tool name
+        self.items = collections.Counter()  # rasters/rows processed per tool name (Ex: rows read by cursors)
+        self._connections = {}
+        self._messages = {0: "", 1: "", 2: ""}
+
+    def _connect(self, _database_path):
+        key = os.path.normpath(_database_path)
+        if key not in self._connections:
+            if self.root is None:
+                location = ":memory:"
+            else:
+                location = os.path.join(self.root, os.path.basename(key) + ".sqlite")
+            connection = sqlite3.connect(location, detect_types=sqlite3.PARSE_DECLTYPES,
+                                         check_same_thread=False)
+            self._connections[key] = connection
+        return self._connections[key]
+
+    def lock_path(self, _database_path):
+        """File that simulates a schema lock on a geo database, None without _root"""
+        if self.root is None:
+            return None
+        return os.path.join(self.root, os.path.basename(os.path.normpath(_database_path)) + ".lock")
+
+    def _table(self, _mosaic_path, _check_lock=True):
+        database_path, mosaic_name = os.path.split(os.path.normpath(_mosaic_path))
+        lock_path = self.lock_path(database_path)
+        if _check_lock and lock_path is not None and os.path.exists(lock_path):
+            self._messages = {0: "", 1: "", 2: "ERROR 000464: Cannot get exclusive schema lock. "
+                                                "Either being edited or in use by another application."}
+            raise GeoprocessingError("ERROR 000464: Cannot get exclusive schema lock on %s. "
+                                     "Either being edited or in use by another application." % _mosaic_path)
+        connection = self._connect(database_path)
+        exists = connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                    (mosaic_name,)).fetchone()
+        if not exists:
+            raise GeoprocessingError("ERROR 000732: Dataset %s does not exist or is not supported" % _mosaic_path)
+        return connection, mosaic_name
+
+    def _run(self, _tool, _items=0):
+        self.calls[_tool] += 1
+        self.items[_tool] += _items
+        delay = self.latency.get(_tool, 0.0) + self.item_latency.get(_tool, 0.0) * _items
+        if delay > 0:
+            time.sleep(delay)
+        now = datetime.datetime.now().strftime("%A, %B %d, %Y %H:%M:%S")
+        self._messages = {0: "Executing: %s\nSucceeded at %s" % (_tool, now), 1: "", 2: ""}
+
+    def _properties(self, _connection):
+        _connection.execute('CREATE TABLE IF NOT EXISTS "_properties" (mosaic TEXT, kind TEXT, name TEXT, value)')
+        return _connection
+
+    def create_mosaic(self, _database_path, _mosaic_name):
+        """Create an empty catalog with the schema left by createMosaicDatasets.py, as a single call"""
+        connection = self._connect(_database_path)
+        with connection:
+            connection.execute('DROP TABLE IF EXISTS "%s"' % _mosaic_name)
+            connection.execute('CREATE TABLE "%s" (OBJECTID INTEGER PRIMARY KEY AUTOINCREMENT, '
+                               'Name TEXT, Path TEXT, PARAMNAME TEXT DEFAULT \'NA\', YEAR TEXT, SDATE TEXT, '
+                               'DATE timestamp, FORE INTEGER DEFAULT 0)' % _mosaic_name)
+        self._run("create_mosaic")
+
+    def get_messages(self, _severity=None):
+        if _severity is None:
+            return "\n".join(message for message in self._messages.values() if message)
+        return self._messages[_severity]
+
+    def get_count(self, _mosaic_path):
+        connection, table = self._table(_mosaic_path)
+        counts = connection.execute('SELECT COUNT(*) FROM "%s"' % table).fetchone()[0]
+        self._run("get_count")
+        return counts
+
+    def exists(self, _path):
+        try:
+            self._table(_path, _check_lock=False)
+        except GeoprocessingError:
+            return False
+        return True
+
+    def create_file_gdb(self, _folder, _database_name):
+        """Create the SQLite database of a geo database (or keep it in memory without _root)"""
+        with self._properties(self._connect(os.path.join(_folder, _database_name))):
+            pass
+        self._run("create_file_gdb")
+
+    def spatial_reference(self, _definition):
+        """Stand-in for arcpy.SpatialReference + loadFromString, counted as "spatial_reference" calls"""
+        self._run("spatial_reference")
+        return StubSpatialReference(_definition)
+
+    def create_mosaic_dataset(self, _database_path, _mosaic_name, _spatial_reference):
+        """Create an empty catalog without custom fields, as CreateMosaicDataset does"""
+        connection = self._properties(self._connect(_database_path))
+        with connection:
+            connection.execute('CREATE TABLE "%s" (OBJECTID INTEGER PRIMARY KEY AUTOINCREMENT, Name TEXT, Path TEXT)'
+                               % _mosaic_name)
+            connection.execute('INSERT INTO "_properties" VALUES (?, ?, ?, ?)',
+                               (_mosaic_name, "property", "spatial_reference", _spatial_reference.exportToString()))
+        self._run("create_mosaic_dataset")
+
+    def delete_mosaic(self, _mosaic_path):
+        connection, table = self._table(_mosaic_path)
+        with self._properties(connection):
+            connection.execute('DROP TABLE "%s"' % table)
+            connection.execute('DELETE FROM "_properties" WHERE mosaic = ?', (table,))
+        self._run("delete_mosaic")
+
+    def copy(self, _source_path, _target_path):
+        connection, source = self._table(_source_path)
+        target = os.path.basename(os.path.normpath(_target_path))
+        if os.path.normpath(os.path.dirname(_target_path)) != os.path.normpath(os.path.dirname(_source_path)):
+            raise GeoprocessingError("StubBackend only copies mosaic data sets within a geo database")
+        sql = connection.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                 (source,)).fetchone()[0]
+        with self._properties(connection):
+            connection.execute(sql.replace('"%s"' % source, '"%s"' % target, 1))
+            connection.execute('INSERT INTO "%s" SELECT * FROM "%s"' % (target, source))
+            connection.execute('INSERT INTO "_properties" SELECT ?, kind, name, value FROM "_properties" '
+                               'WHERE mosaic = ?', (target, source))
+        self._run("copy")
+
+    def define_nodata(self, _mosaic_path, _nodata_value):
+        self._set_property(_mosaic_path, "property", "nodata", _nodata_value)
+        self._run("define_nodata")
+
+    def add_fields(self, _mosaic_path, _fields):
+        connection, table = self._table(_mosaic_path)
+        types = {"TEXT": "TEXT", "SHORT": "INTEGER", "LONG": "INTEGER", "DOUBLE": "REAL", "DATE": "timestamp"}
+        with connection:
+            for name, field_type, length in _fields:
+                connection.execute('ALTER TABLE "%s" ADD COLUMN "%s" %s' % (table, name, types[field_type]))
+        self._run("add_fields", len(_fields))
+
+    def assign_default(self, _mosaic_path, _field, _value):
+        self._set_property(_mosaic_path, "default", _field, _value)
+        self._run("assign_default")
+
+    def describe_mosaic(self, _mosaic_path):
+        """Schema of an existing mosaic data set, as ArcpyBackend.describe_mosaic. INTEGER columns are SHORT"""
+        connection, table = self._table(_mosaic_path)
+        types = {"TEXT": "TEXT", "INTEGER": "SHORT", "REAL": "DOUBLE", "TIMESTAMP": "DATE"}
+        columns = connection.execute('PRAGMA table_info("%s")' % table).fetchall()
+        fields = dict((name.upper(), "OID" if name == "OBJECTID" else types.get(column_type.upper(), column_type))
+                      for _, name, column_type, _, _, _ in columns)
+        defaults = dict((name.upper(), default.strip("'")) for _, name, _, _, default, _ in columns
+                        if default is not None)
+        defaults.update((name.upper(), str(value)) for name, value in self.get_properties(_mosaic_path,
+                                                                                          "default").items())
+        properties = self.get_properties(_mosaic_path, "property")
+        self._run("describe_mosaic")
+        return {"fields": fields, "defaults": defaults, "nodata": properties.get("nodata"),
+                "spatial_reference": properties.get("spatial_reference")}
+
+    def calculate_statistics(self, _mosaic_path, _area_of_interest):
+        connection, table = self._table(_mosaic_path)
+        self._run("calculate_statistics", connection.execute('SELECT COUNT(*) FROM "%s"' % table).fetchone()[0])
+
+    def set_statistics(self, _mosaic_path, _minimum, _maximum, _mean, _std):
+        self._set_property(_mosaic_path, "property", "statistics", "1 %r %r %r %r" % (_minimum, _maximum, _mean, _std))
+        self._run("set_statistics")
+
+    def raster_to_array(self, _raster_path):
+        """Cells of uncompressed GeoTIFF files stored in strips (the files of benchmarkUpdates)"""
+        cells = self._read_cells(_raster_path)
+        self._run("raster_to_array", 1)
+        return cells
+
+    def _read_cells(self, _raster_path):
+        import numpy
+        header = geotiffHeader.read_header(_raster_path)
+        if header.compression != 1 or header.tiled or header.bands != 1 or header.pixel_type not in STUB_DTYPES:
+            raise GeoprocessingError("ERROR 999999: %s is not a single band uncompressed GeoTIFF in strips" %
+                                     _raster_path)
+        with open(_raster_path, "rb") as f:
+            order = "<" if f.read(2) == b"II" else ">"
+            data = []
+            for offset, byte_count in zip(header.offsets, header.byte_counts):
+                f.seek(offset)
+                data.append(f.read(byte_count))
+        array = numpy.frombuffer(b"".join(data), dtype=order + STUB_DTYPES[header.pixel_type])
+        return array[:header.width * header.height].reshape(header.height, header.width), \
+            None if header.nodata is None else float(header.nodata)
+
+    def analyze_mosaic(self, _mosaic_path, _checker_keywords):
+        connection, table = self._table(_mosaic_path)
+        self._run("analyze_mosaic", connection.execute('SELECT COUNT(*) FROM "%s"' % table).fetchone()[0])
+
+    def export_paths(self, _mosaic_path):
+        connection, table = self._table(_mosaic_path)
+        rows = connection.execute('SELECT OBJECTID, Path FROM "%s" ORDER BY OBJECTID' % table).fetchall()
+        self._run("export_paths", len(rows))
+        return [(row[0], row[1]) for row in rows]
+
+    def _set_property(self, _mosaic_path, _kind, _name, _value):
+        connection, table = self._table(_mosaic_path)
+        with self._properties(connection):
+            connection.execute('DELETE FROM "_properties" WHERE mosaic = ? AND kind = ? AND name = ?',
+                               (table, _kind, _name))
+            connection.execute('INSERT INTO "_properties" VALUES (?, ?, ?, ?)', (table, _kind, _name, _value))
+
+    def get_properties(self, _mosaic_path, _kind):
+        """Properties (NoData, spatial reference) or default values of a mosaic data set, as a dictionary"""
+        connection, table = self._table(_mosaic_path)
+        return dict(self._properties(connection).execute(
+            'SELECT name, value FROM "_properties" WHERE mosaic = ? AND kind = ?', (table, _kind)).fetchall())
+
+    def add_rasters(self, _mosaic_path, _input_path, **_parameters):
+        parameters = dict(ADD_RASTERS_DEFAULTS)
+        parameters.update(_parameters)
+        connection, table = self._table(_mosaic_path)
+
+        # A folder, a list of files or a semicolon separated string of files, as accepted by arcpy
+        if isinstance(_input_path, string_types) and os.path.isdir(_input_path):
+            paths = [os.path.join(_input_path, name) for name in sorted(os.listdir(_input_path))
+                     if fnmatch.fnmatch(name, parameters["filter"])]
+        elif isinstance(_input_path, string_types):
+            paths = [path for path in _input_path.split(";") if path]
+        else:
+            paths = list(_input_path)
+
+        # Like arcpy, every input raster is crawled and compared, even those excluded as duplicates
+        paths = [os.path.normpath(path) for path in paths]
+        crawled = len(paths)
+        if parameters["duplicate_items_action"] == "EXCLUDE_DUPLICATES":
+            registered = set(row[0] for row in connection.execute('SELECT Path FROM "%s"' % table))
+            paths = [path for path in paths if path not in registered]
+
+        # Default values assigned with assign_default, as SQLite columns cannot change their default
+        defaults = self.get_properties(_mosaic_path, "default")
+        columns = ", ".join(['"Name"', '"Path"'] + ['"%s"' % field for field in defaults])
+        markers = ", ".join(["?"] * (2 + len(defaults)))
+        with connection:
+            connection.executemany('INSERT INTO "%s" (%s) VALUES (%s)' % (table, columns, markers),
+                                   [[os.path.splitext(os.path.basename(path))[0], path] + list(defaults.values())
+                                    for path in paths])
+        # Pyramids and statistics built inline cost as much as building them beforehand, one raster after another
+        if parameters["build_pyramids"] == "BUILD_PYRAMIDS" or \
+                parameters["calculate_statistics"] == "CALCULATE_STATISTICS":
+            for path in paths:
+                self.build_pyramids_and_statistics(path)
+        # The boundary and cell size ranges are computed again from every item of the catalog
+        if paths:
+            items = connection.execute('SELECT COUNT(*) FROM "%s"' % table).fetchone()[0]
+            if parameters["update_boundary"] == "UPDATE_BOUNDARY":
+                self._run("update_boundary", items)
+            if parameters["update_cellsize_ranges"] == "UPDATE_CELL_SIZES":
+                self._run("update_cell_sizes", items)
+        self._run("add_rasters", crawled)
+
+    def add_field_delimiters(self, _workspace, _field):
+        return '"%s"' % _field  # file geo databases delimit fields with double quotes
+
+    def build_pyramids_and_statistics(self, _raster_path):
+        """Leave the .ovr and .aux.xml files that arcpy writes next to the raster. The .aux.xml file holds the
+        statistics and histogram of the cells when they can be read (numpy), and is empty otherwise"""
+        if os.path.isfile(_raster_path):
+            open(_raster_path + ".ovr", "w").close()
+            with open(_raster_path + ".aux.xml", "w") as f:
+                f.write(self._aux_xml(_raster_path))
+        self._run("build_pyramids_and_statistics")
+
+    def _aux_xml(self, _raster_path):
+        """Statistics of the first band of a raster file in the PAM format of arcpy, empty if it cannot be read"""
+        try:
+            import numpy
+            array, nodata = self._read_cells(_raster_path)
+        except (ImportError, GeoprocessingError, IOError, OSError, ValueError):
+            return ""
+        values = array.astype(numpy.float64).ravel()
+        mask = ~numpy.isnan(values)
+        if nodata is not None:
+            mask &= values != nodata
+        values = values[mask]
+        if not len(values):
+            return ""
+        low, high = float(values.min()), float(values.max())
+        histogram = numpy.histogram(values, bins=256, range=(low, high if high > low else low + 1.0))[0]
+        metadata = [("STATISTICS_MAXIMUM", high), ("STATISTICS_MEAN", float(values.mean())),
+                    ("STATISTICS_MINIMUM", low), ("STATISTICS_SKIPFACTORX", 1), ("STATISTICS_SKIPFACTORY", 1),
+                    ("STATISTICS_STDDEV", float(values.std()))]
+        return ('<PAMDataset>\n  <PAMRasterBand band="1">\n    <Histograms>\n      <HistItem>\n'
+                '        <HistMin>%r</HistMin>\n        <HistMax>%r</HistMax>\n        <BucketCount>256</BucketCount>\n'
+                '        <IncludeOutOfRange>0</IncludeOutOfRange>\n        <Approximate>0</Approximate>\n'
+                '        <HistCounts>%s</HistCounts>\n      </HistItem>\n    </Histograms>\n    <Metadata>\n%s'
+                '    </Metadata>\n  </PAMRasterBand>\n</PAMDataset>\n'
+                % (low, high if high > low else low + 1.0, "|".join(str(count) for count in histogram),
+                   "".join('      <MDI key="%s">%r</MDI>\n' % item for item in metadata)))
+
+    def sql_date(self, _value):
+        return "'%s'" % _value.strftime("%Y-%m-%d %H:%M:%S")  # as stored by sqlite3 for timestamp columns
+
+    def remove_rasters(self, _mosaic_path, _where_clause):
+        connection, table = self._table(_mosaic_path)
+        sql = 'DELETE FROM "%s"' % table
+        if _where_clause:
+            sql += " WHERE " + _where_clause
+        with connection:
+            rows = connection.execute(sql).rowcount
+        self._run("remove_rasters", rows)
+
+    def update_cursor(self, _mosaic_path, _fields, _where_clause=None):
+        connection, table = self._table(_mosaic_path)
+        cursor = StubUpdateCursor(connection, table, _fields, _where_clause, lambda: self._run("update_row"))
+        self._run("update_cursor", len(cursor.rows))
+        return cursor
+
+    def search_cursor(self, _mosaic_path, _fields, _where_clause=None, _sql_clause=(None, None)):
+        connection, table = self._table(_mosaic_path)
+        cursor = StubSearchCursor(connection, table, _fields, _where_clause, _sql_clause)
+        self._run("search_cursor", len(cursor.rows))
+        return cursor
+
+    def calculate_fields(self, _mosaic_path, _where_clause, _values):
+        connection, table = self._table(_mosaic_path)
+        fields = list(_values)
+        sql = 'UPDATE "%s" SET %s' % (table, ", ".join("%s = ?" % field for field in stub_fields(fields)))
+        if _where_clause:
+            sql += " WHERE " + _where_clause
+        with connection:
+            rows = connection.execute(sql, [_values[field] for field in fields]).rowcount
+        self._run("calculate_fields", rows)
+
+
+def stub_fields(_fields):
+    """Column names of cursor fields. The OID@ token of arcpy is the OBJECTID column"""
+    if isinstance(_fields, string_types):
+        _fields = [_fields]
+    return ['"OBJECTID"' if field == "OID@" else '"%s"' % field.strip('"') for field in _fields]
+
+
+class StubSearchCursor(object):
+    """Stand-in for arcpy.da.SearchCursor. sql_clause accepts a prefix (ignored) and a postfix (ORDER BY...)"""
+
+    def __init__(self, _connection, _table, _fields, _where_clause=None, _sql_clause=(None, None)):
+        sql = 'SELECT %s FROM "%s"' % (", ".join(stub_fields(_fields)), _table)
+        if _where_clause:
+            sql += " WHERE " + _where_clause
+        if _sql_clause and _sql_clause[1]:
+            sql += " " + _sql_clause[1]
+        self.rows = _connection.execute(sql).fetchall()
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _type, _value, _traceback):
+        return False
+
+
+class StubUpdateCursor(object):
+    """Stand-in for arcpy.da.UpdateCursor. Rows are read up front and written back one by one on updateRow
+
+    :param _on_update: called on every updateRow (latency and number of rows written)
+    """
+
+    def __init__(self, _connection, _table, _fields, _where_clause=None, _on_update=None):
+        self.on_update = _on_update
+        self.connection = _connection
+        self.table = _table
+        self.fields = stub_fields(_fields)
+        sql = 'SELECT OBJECTID, %s FROM "%s"' % (", ".join(self.fields), _table)
+        if _where_clause:
+            sql += " WHERE " + _where_clause
+        self.rows = _connection.execute(sql).fetchall()
+        self._oid = None
+
+    def __iter__(self):
+        for row in self.rows:
+            self._oid = row[0]
+            yield list(row[1:])
+
+    def updateRow(self, _row):
+        if self.on_update is not None:
+            self.on_update()
+        assignments = ", ".join("%s = ?" % field for field in self.fields)
+        self.connection.execute('UPDATE "%s" SET %s WHERE OBJECTID = ?' % (self.table, assignments),
+                                list(_row) + [self._oid])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _type, _value, _traceback):
+        if _type is None:
+            self.connection.commit()
+        else:
+            self.connection.rollback()
+        return False
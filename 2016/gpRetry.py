@@ -0,0 +1,173 @@
+# Author:   GEOTEC, UJI
+# Date:     March 2016
+#
+# Purpose:  Wait for geo databases locked by another application instead of failing. retrying() wraps a backend of
+#           gpBackend so that a tool that fails because of a lock (the image service or another update holds a
+#           schema lock on IT_2016.gdb: ERROR 000464, ...) is run again after a pause. Pauses double after each
+#           attempt (1, 2, 4... seconds, at most MAX_DELAY), with a random part so that processes waiting for the
+#           same geo database do not all try again at the same time. Once DEADLINE seconds have passed since the
+#           first attempt, the error is raised as before.
+#           The time spent waiting is logged and, with a metrics file, recorded as a "<tool> (lock wait)" record
+#           (see toolMetrics), so that log_summary shows which mosaic data sets were held up by locks.
+#
+# Note:     Only errors whose message looks like a lock are tried again (see TRANSIENT_MESSAGES); any other error is
+#           raised at once. Tools are run again from the start, so tools that change the catalog are only tried
+#           again when it is safe: the add step (CHECKED_TOOLS) only while no catalog row holds the sentinel value of
+#           PARAMNAME (see catalogQuery), i.e. the failed attempts added nothing, field calculations (UNSAFE_TOOLS)
+#           never, their rows may be half written. Their error is then raised at once and the mosaic data set is
+#           updated again by the next run. Nothing is read before the first attempt: the catalog is only queried
+#           after a lock error. The remove step is tried again as any other tool, rows removed are not selected again.
+#           Wrap the instrumented backend, so that every attempt is timed: retrying(toolMetrics.instrument(gp, ...))
+#
+# Usage:    gp = gpRetry.retrying(toolMetrics.instrument(gp, metrics_filename), metrics_filename)
+
+import logging
+import os
+import random
+import time
+
+import catalogQuery
+import toolMetrics
+
+DEADLINE = 600  # seconds a tool keeps being tried again after its first attempt
+BASE_DELAY = 1.0  # seconds before the second attempt
+MAX_DELAY = 60.0  # longest pause between two attempts
+UNRETRIED = frozenset(["get_messages", "add_field_delimiters", "sql_date", "exists"])
+CHECKED_TOOLS = frozenset(["add_rasters"])  # tried again only while the catalog holds no new row
+UNSAFE_TOOLS = frozenset(["calculate_fields"])  # never tried again
+
+# Lower case fragments of the messages of lock and other transient errors
+TRANSIENT_MESSAGES = ("000464",  # Cannot get exclusive schema lock
+                      "schema lock",
+                      "cannot acquire a lock",
+                      "lock request conflicts",
+                      "being used by another process",
+                      "database is locked",  # SQLite (StubBackend)
+                      "database is busy")
+
+
+def is_transient(_error):
+    """True if an error looks like a lock or another error that may go away by itself
+
+    :param _error: exception raised by a backend
+    :return:
+    """
+    message = str(_error).lower()
+    return any(fragment in message for fragment in TRANSIENT_MESSAGES)
+
+
+def backoff_delay(_attempt, _base_delay=BASE_DELAY, _max_delay=MAX_DELAY, _random=random.random):
+    """Pause before trying a tool again: half of the exponential delay plus a random part of the other half
+
+    :param _attempt: attempts that failed so far (1 after the first failure)
+    :param _base_delay:
+    :param _max_delay:
+    :param _random: function returning a number in [0, 1), as random.random
+    :return: seconds
+    """
+    delay = min(_max_delay, _base_delay * 2 ** (_attempt - 1))
+    return delay / 2 + _random() * delay / 2
+
+
+class RetryingBackend(object):
+    """Geoprocessing backend that tries tools failing with lock errors again, with exponential backoff
+
+    :param _gp: backend created by gpBackend.create_backend, usually wrapped by toolMetrics.instrument
+    :param _metrics_filename: where lock waits are recorded. None only logs them
+    :param _deadline: seconds after the first attempt past which errors are raised
+    :param _base_delay:
+    :param _max_delay:
+    :param _sleep: as time.sleep
+    :param _clock: as time.time
+    """
+
+    def __init__(self, _gp, _metrics_filename=None, _deadline=DEADLINE, _base_delay=BASE_DELAY,
+                 _max_delay=MAX_DELAY, _sleep=time.sleep, _clock=time.time):
+        self.gp = _gp
+        self.writer = None if _metrics_filename is None else toolMetrics.MetricsWriter(_metrics_filename)
+        self.deadline = _deadline
+        self.base_delay = _base_delay
+        self.max_delay = _max_delay
+        self.sleep = _sleep
+        self.clock = _clock
+
+    def __getattr__(self, _name):
+        attribute = getattr(self.gp, _name)  # env, ExecuteError, calls, ... are not wrapped
+        if _name.startswith("_") or _name in UNRETRIED or _name in UNSAFE_TOOLS or not callable(attribute) or \
+                isinstance(attribute, type):
+            return attribute
+
+        def retried(*_args, **_kwargs):
+            if _name in CHECKED_TOOLS:
+                return self.call_checked(_name, attribute, _args, _kwargs)
+            return self.call(_name, attribute, _args, _kwargs)
+        return retried
+
+    def call_checked(self, _tool, _function, _args, _kwargs):
+        """Run the add step on the mosaic data set given first, trying it again only while no catalog row holds the
+        sentinel value of PARAMNAME: an attempt that added items is not repeated. The catalog is queried after a lock
+        error only. Sentinel rows left behind by an earlier update also stop it, the next update fills them in"""
+        mosaic_path = _args[0] if _args else _kwargs["_mosaic_path"]
+
+        def no_sentinel_rows():
+            where_clause = catalogQuery.sentinel_clause(self.gp, os.path.dirname(mosaic_path))
+            with self.gp.search_cursor(mosaic_path, ["OID@"], where_clause) as cursor:
+                return next(iter(cursor), None) is None
+
+        def unchanged():
+            try:
+                return self.call("search_cursor", no_sentinel_rows, (), {})  # waits for the lock as well
+            except Exception:
+                return False
+        return self.call(_tool, _function, _args, _kwargs, unchanged)
+
+    def call(self, _tool, _function, _args, _kwargs, _unchanged=None):
+        """Run a tool, trying it again while it fails with a lock error and the deadline has not passed
+
+        :param _unchanged: function telling whether a failed attempt left things as they were. None means always
+        """
+        start = self.clock()
+        waited = 0.0
+        attempt = 0
+        while True:
+            try:
+                result = _function(*_args, **_kwargs)
+            except Exception as error:
+                attempt += 1
+                delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+                if not is_transient(error) or self.clock() + delay - start > self.deadline:
+                    if waited:
+                        self.record(_tool, _args, waited, attempt, True)
+                    raise
+                if _unchanged is not None and not _unchanged():
+                    logging.warning("%s failed (%s) after changing the catalog, not tried again.", _tool,
+                                    str(error).strip().splitlines()[0])
+                    if waited:
+                        self.record(_tool, _args, waited, attempt, True)
+                    raise error  # not a bare raise: _unchanged may have handled errors of its own (Python 2)
+                logging.warning("%s failed (%s), attempt %s. Trying again in %.1f s.", _tool,
+                                str(error).strip().splitlines()[0], attempt, delay)
+                self.sleep(delay)
+                waited += delay
+                continue
+            if waited:
+                self.record(_tool, _args, waited, attempt + 1, False)
+            return result
+
+    def record(self, _tool, _args, _waited, _attempts, _failed):
+        logging.info("%s waited %.1f s for locks over %s attempts%s.", _tool, _waited, _attempts,
+                     ", then gave up" if _failed else "")
+        if self.writer is not None:
+            self.writer.write(toolMetrics.lock_wait_tool(_tool), _waited, toolMetrics.target_of(_tool, _args),
+                              None, _failed)
+
+
+def retrying(_gp, _metrics_filename=None, **_policy):
+    """Wrap a backend so that tools failing with lock errors are tried again
+
+    :param _gp: backend, usually wrapped by toolMetrics.instrument
+    :param _metrics_filename: Ex: toolMetrics.metrics_filename_of(log_filename)
+    :param _policy: _deadline, _base_delay, _max_delay (see RetryingBackend)
+    :return:
+    """
+    return RetryingBackend(_gp, _metrics_filename, **_policy)
@@ -0,0 +1,291 @@
+# Author:   GEOTEC, UJI
+# Date:     March 2016
+#
+# Purpose:  Statistics of a mosaic data set (min, max, mean, standard deviation, histogram) merged from statistics of
+#           its raster files instead of CalculateStatistics_management over the whole footprint, which reads every
+#           cell of every item again each time the mosaic data set grows.
+#           The statistics of each raster file (count of cells with data, sum, sum of squares, exact min and max and
+#           a histogram of its own range) are kept next to its manifest
+#           (manifests/IT_2016.gdb_REGIONAL_MONITORING_NDVI.statistics.json). When rasters are added, only the new
+#           ones are looked at, once: their statistics are taken from the .aux.xml file written next to them by the
+#           add step (CALCULATE_STATISTICS) or by rasterPreprocessing, and their cells are only read
+#           (gp.raster_to_array) when it is missing, stale or approximate. The statistics of the mosaic data set are
+#           merged from those of every raster file (sums are added, histograms are rebinned over the range of the
+#           mosaic data set and added, see merge) and set on it (gp.set_statistics).
+#           Only the items of the catalog count: the files handed to the add step and those of the store, less the
+#           items removed by the update (superseded forecasts). Duplicates, held back files and expired forecasts
+#           left in the source folder are not. Without a store, the items are read from the catalog once.
+#
+# Note:     Cells equal to the NoData value of each raster file (and NaN) are left out: in ERMES the NoData value of a
+#           mosaic data set (folders files) is the one of its rasters. Each bin of a raster histogram is counted in
+#           the bin of the mosaic histogram holding its centre: the merged histogram is exact up to one bin. Delete
+#           the statistics file to have every item looked at again. Mosaic data sets updated without manifests are
+#           left as they are. Requires numpy (shipped with ArcGIS): without it statistics are not updated.
+#
+# Usage:    itemStatistics.refresh(gp, mosaic_path, source_folder, manifest_path, scan, new_files, removed)
+#           (after the add step), or step by step:
+#           store_path = itemStatistics.statistics_path(manifest_path)
+#           store = itemStatistics.update(gp, source_folder, itemStatistics.load_store(store_path), scan, new_files,
+#                                         removed)
+#           itemStatistics.set_statistics(gp, mosaic_path, store)
+#           itemStatistics.save_store(store_path, store)
+
+import logging
+import os
+import xml.etree.ElementTree
+
+import folderManifest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+STATISTICS_EXTENSION = ".statistics.json"
+AUX_EXTENSION = ".aux.xml"  # statistics written next to a raster by arcpy (PAM)
+BINS = 256  # histogram bins, as CalculateStatistics for 8 bit rasters
+
+
+def statistics_path(_manifest_path):
+    """Statistics of the raster files of a mosaic data set, next to its manifest.
+    Ex: ..._NDVI.json --> ..._NDVI.statistics.json
+
+    :param _manifest_path: as returned by folderManifest.manifest_path
+    :return:
+    """
+    return os.path.splitext(_manifest_path)[0] + STATISTICS_EXTENSION
+
+
+def load_store(_store_path):
+    """Read the statistics of the raster files of a mosaic data set. A missing or unreadable file is an empty store
+
+    :param _store_path:
+    :return: dictionary {"items": {filename: statistics}, "mosaic": statistics}
+    """
+    return folderManifest.load_manifest(_store_path)
+
+
+def save_store(_store_path, _store):
+    folderManifest.save_manifest(_store_path, _store)
+
+
+def valid_cells(_array, _nodata=None):
+    """Cells of an array holding data, as a flat float64 array
+
+    :param _array: numpy array of a raster band
+    :param _nodata: NoData value of the raster, None if it has none
+    :return:
+    """
+    values = numpy.asarray(_array, dtype=numpy.float64).ravel()
+    mask = ~numpy.isnan(values)
+    if _nodata is not None:
+        mask &= values != float(_nodata)
+    return values[mask]
+
+
+def value_range(_low, _high):
+    """Histogram range from the min and max of the cells: an empty range is widened by one
+
+    :return: [low, high]
+    """
+    return [float(_low), float(_high) if _high > _low else float(_low) + 1.0]
+
+
+def item_statistics(_values):
+    """Statistics of the cells of a raster file, with a histogram of BINS bins over their own range
+
+    :param _values: flat array of cells holding data, see valid_cells
+    :return: dictionary {"count", "sum", "sumsq", "min", "max", "range", "histogram"}, min and max None without cells
+    """
+    if not len(_values):
+        return {"count": 0, "sum": 0.0, "sumsq": 0.0, "min": None, "max": None, "range": None, "histogram": []}
+    low, high = float(_values.min()), float(_values.max())
+    histogram_range = value_range(low, high)
+    histogram = numpy.histogram(_values, bins=BINS, range=histogram_range)[0]
+    return {"count": int(len(_values)), "sum": float(_values.sum()), "sumsq": float(numpy.dot(_values, _values)),
+            "min": low, "max": high, "range": histogram_range, "histogram": histogram.tolist()}
+
+
+def aux_statistics(_raster_path):
+    """Statistics of a raster file from its .aux.xml file, as written by CalculateStatistics (see item_statistics).
+    Files older than the raster, approximate histograms and statistics of a sample of cells are not used
+
+    :param _raster_path:
+    :return: dictionary as returned by item_statistics, None if the file cannot be used
+    """
+    aux_path = _raster_path + AUX_EXTENSION
+    try:
+        if os.path.getmtime(aux_path) < os.path.getmtime(_raster_path):
+            return None
+        band = xml.etree.ElementTree.parse(aux_path).getroot().find("PAMRasterBand")
+    except (OSError, IOError, xml.etree.ElementTree.ParseError):
+        return None
+    if band is None:
+        return None
+    metadata = dict((item.get("key"), item.text) for item in band.findall("Metadata/MDI"))
+    sampled = [metadata.get("STATISTICS_SKIPFACTORX", "1"), metadata.get("STATISTICS_SKIPFACTORY", "1")] != ["1", "1"]
+    item = band.find("Histograms/HistItem")
+    try:
+        if item is None or sampled or item.findtext("Approximate", "0").strip() != "0" or \
+                item.findtext("IncludeOutOfRange", "0").strip() != "0":
+            return None
+        histogram = [int(count) for count in item.findtext("HistCounts").split("|")]
+        low, high = float(metadata["STATISTICS_MINIMUM"]), float(metadata["STATISTICS_MAXIMUM"])
+        mean, std = float(metadata["STATISTICS_MEAN"]), float(metadata["STATISTICS_STDDEV"])
+        histogram_range = [float(item.findtext("HistMin")), float(item.findtext("HistMax"))]
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+    count = sum(histogram)
+    if not count:
+        return None
+    return {"count": count, "sum": mean * count, "sumsq": (std * std + mean * mean) * count, "min": low, "max": high,
+            "range": histogram_range, "histogram": histogram}
+
+
+def rebin(_histogram, _from_range, _to_range, _bins=BINS):
+    """Bins of another range holding the bins of a histogram: each bin goes to the bin holding its centre
+
+    :param _histogram: list of counts over _from_range
+    :param _from_range: [low, high]
+    :param _to_range: [low, high], holding _from_range
+    :param _bins: bins of the new histogram
+    :return: numpy array of bin numbers, one per bin of _histogram
+    """
+    width = (_from_range[1] - _from_range[0]) / float(len(_histogram))
+    centres = _from_range[0] + (numpy.arange(len(_histogram)) + 0.5) * width
+    bins = numpy.floor((centres - _to_range[0]) / (_to_range[1] - _to_range[0]) * _bins).astype(numpy.int64)
+    return numpy.clip(bins, 0, _bins - 1)
+
+
+def merge(_items):
+    """Statistics of a mosaic data set from the statistics of its raster files. Count and sums are added, histograms
+    are rebinned over the range of the mosaic data set and added: no cell is read again
+
+    :param _items: list of dictionaries as returned by item_statistics
+    :return: dictionary {"count", "min", "max", "mean", "std", "range", "histogram"}, None if no raster file has data
+    """
+    items = [item for item in _items if item["count"]]
+    if not items:
+        return None
+    sums = numpy.array([[item["count"], item["sum"], item["sumsq"]] for item in items], dtype=numpy.float64)
+    count, total, squares = sums.sum(axis=0)
+    mean = total / count
+    variance = max(squares / count - mean * mean, 0.0)  # rounding may leave a tiny negative value
+    low, high = min(item["min"] for item in items), max(item["max"] for item in items)
+    histogram_range = value_range(low, high)
+    bins = numpy.concatenate([rebin(item["histogram"], item["range"], histogram_range) for item in items])
+    counts = numpy.concatenate([numpy.asarray(item["histogram"], dtype=numpy.float64) for item in items])
+    histogram = numpy.rint(numpy.bincount(bins, weights=counts, minlength=BINS)).astype(numpy.int64)
+    return {"count": int(count), "min": low, "max": high, "mean": float(mean), "std": float(numpy.sqrt(variance)),
+            "range": histogram_range, "histogram": histogram.tolist()}
+
+
+def _read(_gp, _source_folder, _filenames):
+    """Statistics of raster files, from their .aux.xml files or else from their cells, one file at a time. Rasters
+    that cannot be read are logged and skipped
+
+    :return: generator of (filename, statistics, True if read from the .aux.xml file)
+    """
+    for filename in _filenames:
+        raster_path = os.path.join(_source_folder, filename)
+        statistics = aux_statistics(raster_path)
+        if statistics is not None:
+            yield filename, statistics, True
+            continue
+        try:
+            array, nodata = _gp.raster_to_array(raster_path)
+        except (_gp.ExecuteError, IOError, OSError, ValueError) as error:
+            logging.warning("Statistics of raster %s not calculated: %s", filename, error)
+            continue
+        yield filename, item_statistics(valid_cells(array, nodata)), False
+
+
+def catalog_files(_gp, _mosaic_path, _scan):
+    """Raster files of the source folder that are items of the mosaic data set, read in a single query. Only used when
+    the store is missing: later updates follow the files added and removed
+
+    :param _gp: geoprocessing backend
+    :param _mosaic_path:
+    :param _scan: as returned by folderManifest.scan_folder
+    :return: sorted list of filenames
+    """
+    with _gp.search_cursor(_mosaic_path, ["Name"]) as cursor:
+        names = set(row[0] for row in cursor)
+    return sorted(filename for filename in _scan if os.path.splitext(filename)[0] in names)
+
+
+def update(_gp, _source_folder, _store, _scan, _new_files, _removed=()):
+    """Statistics of the raster files of a mosaic data set after an update: the files of the store and the files
+    handed to the add step, less the items removed. Files handed to the add step are looked at once, files no longer
+    in the source folder are forgotten. Other files of the source folder (duplicates, held back, ...) are left out
+
+    :param _gp: geoprocessing backend
+    :param _source_folder:
+    :param _store: as returned by load_store
+    :param _scan: as returned by folderManifest.scan_folder
+    :param _new_files: filenames handed to the add step (new, or with new content)
+    :param _removed: names of the items removed by the update (catalog field Name). Ex: superseded forecasts
+    :return: new store, with the merged statistics of the mosaic data set under "mosaic"
+    """
+    new_files = set(_new_files)
+    removed = set(_removed)
+    kept = dict((filename, statistics) for filename, statistics in _store.get("items", {}).items()
+                if filename in _scan and filename not in new_files and os.path.splitext(filename)[0] not in removed)
+    # Statistics without a range of their own were binned over a range shared by the store: looked at again
+    items = dict((filename, statistics) for filename, statistics in kept.items() if "range" in statistics)
+    pending = sorted(new_files | (set(kept) - set(items)))
+    from_aux = calculated = 0
+    for filename, statistics, aux in _read(_gp, _source_folder, pending):
+        items[filename] = statistics
+        if aux:
+            from_aux += 1
+        else:
+            calculated += 1
+    if pending:
+        logging.info("Statistics of %s raster files taken from their .aux.xml files, %s calculated, %s kept.",
+                     from_aux, calculated, len(items) - from_aux - calculated)
+    return {"items": items, "mosaic": merge(list(items.values()))}
+
+
+def set_statistics(_gp, _mosaic_path, _store):
+    """Set the merged statistics of a store on its mosaic data set
+
+    :param _gp: geoprocessing backend
+    :param _mosaic_path:
+    :param _store: as returned by update
+    :return: True if statistics were set
+    """
+    statistics = _store.get("mosaic")
+    if statistics is None:
+        return False
+    _gp.set_statistics(_mosaic_path, statistics["min"], statistics["max"], statistics["mean"], statistics["std"])
+    logging.info("Statistics of %s cells set: min %s, max %s, mean %.6g, std %.6g", statistics["count"],
+                 statistics["min"], statistics["max"], statistics["mean"], statistics["std"])
+    return True
+
+
+def refresh(_gp, _mosaic_path, _source_folder, _manifest_path, _scan, _new_files, _removed=()):
+    """Update the statistics of the raster files of a mosaic data set after its add step, and set the merged ones on
+    it. Without a store, every item of the catalog is looked at once. Nothing is done without numpy
+
+    :param _gp: geoprocessing backend
+    :param _mosaic_path:
+    :param _source_folder:
+    :param _manifest_path: as returned by folderManifest.manifest_path
+    :param _scan: as returned by folderManifest.scan_folder
+    :param _new_files: filenames handed to the add step
+    :param _removed: names of the items removed by the update, see update
+    :return: True if statistics were set
+    """
+    if numpy is None:
+        logging.info("Statistics of mosaic data set %s not updated: numpy is not available.",
+                     os.path.basename(_mosaic_path))
+        return False
+    store_path = statistics_path(_manifest_path)
+    store = load_store(store_path)
+    if not store.get("items"):
+        store = {"items": dict((filename, {}) for filename in catalog_files(_gp, _mosaic_path, _scan))}
+    store = update(_gp, _source_folder, store, _scan, _new_files, _removed)
+    done = set_statistics(_gp, _mosaic_path, store)
+    save_store(store_path, store)
+    return done
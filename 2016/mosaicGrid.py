@@ -0,0 +1,162 @@
+# Author:   GEOTEC, UJI
+# Date:     March 2016
+#
+# Purpose:  Skip the boundary and cell size ranges update of the add step when the new rasters lie on the grid of
+#           the mosaic data set. With UPDATE_BOUNDARY and UPDATE_CELL_SIZES (see gpBackend.ADD_RASTERS_DEFAULTS),
+#           adding a single raster makes arcpy go through every item of the mosaic data set again, although the
+#           rasters of a product (Ex: REGIONAL_METEO_TMAX) all share the same grid.
+#           The grid signature of a mosaic data set (cell sizes, extent covered by its boundary, pixel type, NoData
+#           and coordinate system of its rasters) is kept next to its manifest
+#           (manifests/IT_2016.gdb_REGIONAL_MONITORING_NDVI.grid.json). The headers of the new raster files are read
+#           with geotiffHeader (tags only, no arcpy) and compared with it:
+#           1/ all of them fit (same cell size, pixel type, NoData and coordinate system, extent inside): the add
+#              step is run with NO_BOUNDARY and NO_CELL_SIZES
+#           2/ otherwise the add step updates both as before, and the signature is extended with the new rasters
+#
+# Note:     The extent of a signature only holds rasters added with the boundary updated, so it never goes beyond
+#           the boundary of the mosaic data set. A missing signature, a raster whose header cannot be read, a
+#           mosaic data set without manifest (Ex: recreated) or rasters with new content (their items are removed
+#           first, see rasterFingerprints) always update the boundary and the cell size ranges.
+#           Parameters given explicitly to the add step take precedence.
+#
+# Usage:    grid = mosaicGrid.load_grid(mosaicGrid.grid_path(manifest_path))
+#           check = mosaicGrid.check(source_folder, new_files, grid)
+#           gp.add_rasters(mosaic_path, input_path, **mosaicGrid.add_parameters(check))
+#           mosaicGrid.save_grid(grid_path, check.grid)
+
+import collections
+import logging
+import os
+
+import folderManifest
+import geotiffHeader
+
+GRID_EXTENSION = ".grid.json"
+TOLERANCE = 0.01  # fraction of a cell size below which coordinates and cell sizes are taken as equal
+KEEP_BOUNDARY = {"update_cellsize_ranges": "NO_CELL_SIZES", "update_boundary": "NO_BOUNDARY"}
+
+# Outcome of the comparison of new rasters with the grid signature of a mosaic data set
+#   fits: True if the boundary and cell size ranges can be kept, grid: signature to save once the update is done
+#   reasons: why the boundary and cell size ranges are updated
+GridCheck = collections.namedtuple("GridCheck", ["fits", "grid", "reasons"])
+
+
+def grid_path(_manifest_path):
+    """Grid signature of a mosaic data set, next to its manifest. Ex: ..._NDVI.json --> ..._NDVI.grid.json
+
+    :param _manifest_path: as returned by folderManifest.manifest_path
+    :return:
+    """
+    return os.path.splitext(_manifest_path)[0] + GRID_EXTENSION
+
+
+def load_grid(_grid_path):
+    """Read a grid signature. A missing or unreadable signature is an empty one
+
+    :param _grid_path:
+    :return: dictionary, see signature
+    """
+    return folderManifest.load_manifest(_grid_path)
+
+
+def save_grid(_grid_path, _grid):
+    folderManifest.save_manifest(_grid_path, _grid)
+
+
+def signature(_header):
+    """Grid signature of a single raster
+
+    :param _header: geotiffHeader.TiffHeader
+    :return: dictionary {"cell_sizes": [[x, y]], "extent": [xmin, ymin, xmax, ymax], "pixel_type", "nodata", "epsg"}
+    """
+    return {"cell_sizes": [list(_header.cell_size)], "extent": list(_header.extent),
+            "pixel_type": _header.pixel_type, "nodata": _header.nodata, "epsg": _header.epsg}
+
+
+def _same_cell_size(_a, _b):
+    return all(abs(a - b) <= TOLERANCE * abs(b) for a, b in zip(_a, _b))
+
+
+def mismatch(_grid, _header):
+    """Why a raster does not fit a grid signature
+
+    :param _grid: as returned by load_grid, not empty
+    :param _header: geotiffHeader.TiffHeader
+    :return: reason, None if the raster fits
+    """
+    for key in ["pixel_type", "nodata", "epsg"]:
+        if _grid.get(key) != getattr(_header, key):
+            return "%s %s instead of %s" % (key, getattr(_header, key), _grid.get(key))
+    if not any(_same_cell_size(_header.cell_size, cell_size) for cell_size in _grid["cell_sizes"]):
+        return "cell size %s x %s" % tuple(_header.cell_size)
+    margin_x, margin_y = [TOLERANCE * cell_size for cell_size in _header.cell_size]
+    xmin, ymin, xmax, ymax = _grid["extent"]
+    if _header.extent[0] < xmin - margin_x or _header.extent[1] < ymin - margin_y or \
+            _header.extent[2] > xmax + margin_x or _header.extent[3] > ymax + margin_y:
+        return "outside the extent of the mosaic data set"
+    return None
+
+
+def merge(_grid, _header):
+    """Grid signature extended with a raster: cell size added, extents joined
+
+    :param _grid: dictionary, empty for a new signature
+    :param _header: geotiffHeader.TiffHeader
+    :return: new dictionary
+    """
+    raster = signature(_header)
+    if not _grid:
+        return raster
+    grid = dict(_grid, pixel_type=raster["pixel_type"], nodata=raster["nodata"], epsg=raster["epsg"])
+    if not any(_same_cell_size(_header.cell_size, cell_size) for cell_size in _grid["cell_sizes"]):
+        grid["cell_sizes"] = _grid["cell_sizes"] + raster["cell_sizes"]
+    grid["extent"] = [min(_grid["extent"][0], raster["extent"][0]), min(_grid["extent"][1], raster["extent"][1]),
+                      max(_grid["extent"][2], raster["extent"][2]), max(_grid["extent"][3], raster["extent"][3])]
+    return grid
+
+
+def check(_source_folder, _filenames, _grid):
+    """Compare the headers of new raster files with the grid signature of a mosaic data set
+
+    :param _source_folder:
+    :param _filenames: raster filenames handed to the add step
+    :param _grid: as returned by load_grid. Empty when it cannot be trusted (no signature, no manifest...)
+    :return: GridCheck
+    """
+    grid, reasons = dict(_grid), []
+    if not grid:
+        reasons.append("no grid signature yet")
+    for filename in sorted(_filenames):
+        try:
+            header = geotiffHeader.read_header(os.path.join(_source_folder, filename))
+        except (geotiffHeader.TiffError, IOError, OSError) as error:
+            reasons.append("%s: header not read (%s)" % (filename, error))
+            continue
+        if header.cell_size is None:
+            reasons.append("%s: not georeferenced by its tags" % filename)
+            continue
+        reason = mismatch(grid, header) if grid else None
+        if reason is not None:
+            if reason.split()[0] in ["pixel_type", "nodata", "epsg"]:
+                logging.warning("Raster %s does not match the other rasters of its mosaic data set: %s.", filename,
+                                reason)
+            reasons.append("%s: %s" % (filename, reason))
+        grid = merge(grid, header)
+    return GridCheck(not reasons, grid, reasons)
+
+
+def add_parameters(_check, _parameters=None):
+    """Parameters of the add step, keeping the boundary and cell size ranges if the new rasters fit
+
+    :param _check: GridCheck
+    :param _parameters: parameters overriding gpBackend.ADD_RASTERS_DEFAULTS, which take precedence
+    :return: dictionary
+    """
+    parameters = dict(KEEP_BOUNDARY) if _check.fits else {}
+    if _check.fits:
+        logging.info("Boundary and cell size ranges kept: new rasters on the grid of the mosaic data set.")
+    else:
+        logging.info("Boundary and cell size ranges updated: %s", "; ".join(_check.reasons[:3]) +
+                     (" (and %s more)" % (len(_check.reasons) - 3) if len(_check.reasons) > 3 else ""))
+    parameters.update(_parameters or {})
+    return parameters
@@ -0,0 +1,64 @@
+# Author:   GEOTEC, UJI
+# Date:     March 2016
+#
+# Purpose:  Run the jobs of one or several folders files (one job per line/mosaic data set) concurrently
+#           in a pool of worker processes.
+#           Mosaic data sets that share a geo database are always run one after another by the same worker,
+#           so that two processes never compete for a schema lock on the same file geo database.
+#           Independent geo databases (IT_2016.gdb, ES_2016.gdb, ...) are updated at the same time.
+#
+# Note:     Workers are processes, not threads: arcpy.env (workspace, etc.) is global to a process.
+#           The worker function must be defined at module level so that it can be pickled.
+
+
+import multiprocessing
+from collections import OrderedDict
+
+
+def database_of(_job):
+    """Default grouping key: jobs are (database_path, mosaic_name, source_folder) tuples"""
+    return _job[0]
+
+
+def group_by_database(_jobs, _key=database_of):
+    """Group jobs by geo database keeping the order in which geo databases and jobs appear
+
+    :param _jobs:
+    :param _key: function returning the geo database of a job
+    :return: list of lists of jobs
+    """
+    groups = OrderedDict()
+    for job in _jobs:
+        groups.setdefault(_key(job), []).append(job)
+    return list(groups.values())
+
+
+def _run_group(_arguments):
+    worker, group = _arguments
+    return [worker(job) for job in group]
+
+
+def run_jobs(_jobs, _worker, _workers=1, _key=database_of, _initializer=None, _initargs=()):
+    """Run _worker(job) for every job, up to _workers geo databases at a time
+
+    :param _jobs:
+    :param _worker: module level function taking a single job
+    :param _workers: number of worker processes. 1 runs every job in the current process
+    :param _key: function returning the geo database of a job
+    :param _initializer: called once in each worker process (set up logging, geoprocessing backend...)
+    :param _initargs: arguments of _initializer
+    :return: results of _worker, in job order within each geo database
+    """
+    groups = group_by_database(_jobs, _key)
+    if _workers <= 1 or len(groups) <= 1:
+        results = [_run_group((_worker, group)) for group in groups]
+    else:
+        pool = multiprocessing.Pool(processes=min(_workers, len(groups)),
+                                    initializer=_initializer, initargs=_initargs)
+        try:
+            # chunksize=1: geo databases are handed out one at a time to the first idle worker
+            results = pool.map(_run_group, [(_worker, group) for group in groups], chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    return [result for group_results in results for result in group_results]
@@ -0,0 +1,25 @@
+# Author:   GEOTEC, UJI
+# Date:     March 2016
+#
+# Purpose:  Schema shared by all ERMES mosaic data sets: coordinate system, custom fields used by the web
+#           application and their default values. createMosaicDatasets.py creates mosaic data sets with it and
+#           the update scripts rely on it (PARAMNAME = 'NA' marks new entries, FORE flags the latest forecasts).
+
+# ETRS89 / LAEA Europe, with the XY/Z/M domains and resolutions of ERMES geo databases
+SPATIAL_REFERENCE = "PROJCS['ETRS_1989_LAEA',GEOGCS['GCS_ETRS_1989',DATUM['D_ETRS_1989',SPHEROID['GRS_1980',6378137.0,298.257222101]],PRIMEM['Greenwich',0.0],UNIT['Degree',0.0174532925199433]],PROJECTION['Lambert_Azimuthal_Equal_Area'],PARAMETER['False_Easting',4321000.0],PARAMETER['False_Northing',3210000.0],PARAMETER['Central_Meridian',10.0],PARAMETER['Latitude_Of_Origin',52.0],UNIT['Meter',1.0]];-8426600 -9526700 10000;-100000 10000;-100000 10000;0.001;0.001;0.001;IsHighPrecision"
+
+# Custom fields for the web application: (name, type, length). Custom fields are uppercase
+CUSTOM_FIELDS = [
+    ("PARAMNAME", "TEXT", 50),
+    ("YEAR", "TEXT", 4),
+    ("SDATE", "TEXT", 10),
+    ("DATE", "DATE", None),
+    ("FORE", "SHORT", None)]  # Only for forecast data
+
+# Default values of custom fields
+FIELD_DEFAULTS = [
+    ("PARAMNAME", "NA"),  # NA means no paramname
+    ("FORE", 0)]  # 0 = FALSE; 1 = TRUE
+
+# Checks of AnalyzeMosaicDataset_management
+ANALYZE_KEYWORDS = "FOOTPRINT;FUNCTION;RASTER;PATHS;SOURCE_VALIDITY;STALE;PYRAMIDS;STATISTICS;PERFORMANCE;INFORMATION"
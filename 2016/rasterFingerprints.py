@@ -0,0 +1,161 @@
+# Author:   GEOTEC, UJI
+# Date:     March 2016
+#
+# Purpose:  Tell raster files delivered again from raster files with new content. "Exclude Duplicates" of the add
+#           step only compares paths: a raster delivered again under another name is added twice, and a raster
+#           overwritten with new content under the same name keeps its stale catalog item.
+#           A fingerprint (size and MD5 of three 64 KB samples: start, middle and end of the file) is kept per raster
+#           file handed to the add step, in an index next to the manifest of the mosaic data set
+#           (manifests/IT_2016.gdb_REGIONAL_MONITORING_NDVI.fingerprints.json). For the files of a source folder
+#           that are new or changed since the last update (see folderManifest), plan() tells:
+#           1/ add: new content, handed to the add step
+#           2/ refresh: same name, other content; their catalog items are removed (remove_items) and added again
+#           3/ duplicates: same content and same product as a file already added (Ex: a product delivered again
+#              under a re-processed name), skipped
+#           Files overwritten with the same content (only their modification time changed) are left alone.
+#           Files missing in the manifest are added as before (Ex: after deleting the manifest of a recreated mosaic).
+#
+# Note:     Files are only read once, when they are new or changed; files already in the manifest are fingerprinted
+#           once when the index is first built. Empty files are never taken as duplicates.
+#           Two files are only duplicates if their names stand for the same product (same PARAMNAME and DATE, see
+#           product_key): rasters of two dates can hold the same values (Ex: fully clouded composites). A file whose
+#           name cannot be parsed is logged and compared by content only.
+#
+# Usage:    index = rasterFingerprints.load_index(rasterFingerprints.index_path(manifest_path))
+#           plan = rasterFingerprints.plan(source_folder, scan, manifest, index, product_key)
+#           rasterFingerprints.remove_items(gp, mosaic_path, plan.refresh)
+#           (add plan.add and plan.refresh)
+#           rasterFingerprints.save_index(index_path, plan.index)
+
+import collections
+import hashlib
+import logging
+import os
+
+import folderManifest
+
+SAMPLE_SIZE = 64 * 1024  # bytes read at the start, middle and end of a file
+INDEX_EXTENSION = ".fingerprints.json"
+
+# Files of a source folder sorted out for the add step, and the index to save once the update is done
+# add and refresh are lists of filenames, duplicates a dictionary {filename: filename of the same content}
+Plan = collections.namedtuple("Plan", ["add", "refresh", "duplicates", "index"])
+
+
+def index_path(_manifest_path):
+    """Fingerprint index of a mosaic data set, next to its manifest. Ex: ..._NDVI.json --> ..._NDVI.fingerprints.json
+
+    :param _manifest_path: as returned by folderManifest.manifest_path
+    :return:
+    """
+    return os.path.splitext(_manifest_path)[0] + INDEX_EXTENSION
+
+
+def load_index(_index_path):
+    """Read a fingerprint index. A missing or unreadable index is an empty one
+
+    :param _index_path:
+    :return: dictionary {filename: fingerprint}
+    """
+    return folderManifest.load_manifest(_index_path)
+
+
+def save_index(_index_path, _index):
+    folderManifest.save_manifest(_index_path, _index)
+
+
+def fingerprint(_path, _size=None):
+    """Size and MD5 of three samples of a file: "<size>-<md5>". Files up to 3 samples long are hashed whole
+
+    :param _path:
+    :param _size: size of the file, if known
+    :return:
+    """
+    size = os.path.getsize(_path) if _size is None else _size
+    digest = hashlib.md5()
+    with open(_path, "rb") as f:
+        if size <= 3 * SAMPLE_SIZE:
+            digest.update(f.read())
+        else:
+            for offset in [0, (size - SAMPLE_SIZE) // 2, size - SAMPLE_SIZE]:
+                f.seek(offset)
+                digest.update(f.read(SAMPLE_SIZE))
+    return "%d-%s" % (size, digest.hexdigest())
+
+
+def product_key(_parse):
+    """Product of a raster filename, to compare files with the same content
+
+    :param _parse: parser of rasterNames. Ex: rasterNames.parser_of(rasterNames.MONITORING)
+    :return: function filename --> (PARAMNAME, DATE), or None when it cannot be parsed
+    """
+    def key(_filename):
+        raster_name = _parse(os.path.splitext(_filename)[0])
+        return None if raster_name is None else (raster_name.paramname, raster_name.date)
+    return key
+
+
+def plan(_source_folder, _scan, _manifest, _index, _product_key=None):
+    """Sort out the new and changed files of a source folder
+
+    :param _source_folder:
+    :param _scan: as returned by folderManifest.scan_folder
+    :param _manifest: as returned by folderManifest.load_manifest
+    :param _index: as returned by load_index
+    :param _product_key: function filename --> product, None if unknown (see product_key). None compares content
+        only, as for files of unknown product
+    :return: Plan
+    """
+    index = dict((filename, value) for filename, value in _index.items() if filename in _scan)
+    owners = {}  # fingerprint --> filenames with that content
+    for filename, value in sorted(index.items()):
+        owners.setdefault(value, []).append(filename)
+
+    add, refresh, duplicates = [], [], {}
+    for filename in sorted(_scan):
+        unchanged = _manifest.get(filename) == _scan[filename]
+        if unchanged and filename in index:
+            continue
+        value = fingerprint(os.path.join(_source_folder, filename), _scan[filename][0])
+        if unchanged:
+            index[filename] = value  # added before the index existed
+        elif filename in index and filename in _manifest:
+            if index[filename] != value:
+                refresh.append(filename)
+                index[filename] = value
+        else:
+            product = None if _product_key is None else _product_key(filename)
+            if _product_key is not None and product is None:
+                logging.warning("Raster %s does not follow the naming convention, compared by content only.",
+                                filename)
+            same = [other for other in owners.get(value, []) if other != filename and
+                    (product is None or _product_key(other) in (None, product))]
+            if same and _scan[filename][0] > 0:
+                duplicates[filename] = same[0]
+                continue
+            add.append(filename)
+            index[filename] = value
+        owners.setdefault(value, []).append(filename)
+    return Plan(add, refresh, duplicates, index)
+
+
+def log_plan(_plan):
+    for filename in _plan.refresh:
+        logging.info("Raster %s has new content, its catalog item is replaced.", filename)
+    for filename, original in sorted(_plan.duplicates.items()):
+        logging.info("Raster %s holds the same content as %s, not added.", filename, original)
+
+
+def remove_items(_gp, _mosaic_path, _filenames):
+    """Remove the catalog items of raster files, so that the add step adds them again
+
+    :param _gp: geoprocessing backend
+    :param _mosaic_path:
+    :param _filenames: raster filenames. Ex: IT_Monitoring_NDVI_2016_001.tif
+    :return:
+    """
+    if not _filenames:
+        return
+    names = ", ".join("'%s'" % os.path.splitext(filename)[0].replace("'", "''") for filename in _filenames)
+    _gp.remove_rasters(_mosaic_path, "%s IN (%s)" % (_gp.add_field_delimiters(os.path.dirname(_mosaic_path),
+                                                                              "Name"), names))
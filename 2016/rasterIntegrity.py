@@ -0,0 +1,212 @@
+# Author:   GEOTEC, UJI
+# Date:     March 2016
+#
+# Purpose:  Keep truncated and half copied raster files away from AddRastersToMosaicDataset_management, which either
+#           fails the whole update on them or registers broken items that later call for a full
+#           AnalyzeMosaicDataset. New raster files are checked before the add step, by a pool of threads (files are
+#           read from network drives: threads wait for the network in parallel):
+#           1/ stable: same size and modification time in two polls <poll_seconds> apart, and as in the scan of the
+#              source folder (the second poll is only waited for when a file was modified in the last
+#              <poll_seconds>)
+#           2/ header: a TIFF header that geotiffHeader can read, with a size
+#           3/ complete: every strip (or tile) stored within the file
+#           Files still changing are held back and checked again in the next update. Broken files are moved to a
+#           quarantine folder next to the log file, with a text file telling why
+#           (quarantine/IT_Monitoring_NDVI_2016_001.tif and quarantine/IT_Monitoring_NDVI_2016_001.tif.txt).
+#
+# Note:     Move a repaired file back into its source folder: it is new again for the next update.
+#           Only the tags and the file size are read, not the pixels: a file cut short is caught, a file with
+#           corrupted pixels is not.
+#
+# Usage:    validation = rasterIntegrity.validate(source_folder, new_files, scan)
+#           quarantine_folder = rasterIntegrity.quarantine_folder_of(log_filename)
+#           rasterIntegrity.quarantine(source_folder, validation.bad, quarantine_folder)
+#           (add validation.clean only)
+#           or, with a fingerprint plan (see rasterFingerprints):
+#           plan, scan = rasterIntegrity.screen(source_folder, plan, scan, manifest, fingerprints, quarantine_folder)
+
+import collections
+import logging
+import multiprocessing.pool
+import os
+import shutil
+import time
+
+import geotiffHeader
+
+WORKERS = 8  # threads checking files at the same time
+POLL_SECONDS = 2.0  # time between the two polls of files modified recently
+QUARANTINE_FOLDER = "quarantine"
+
+# Outcome of the check of new raster files. clean: filenames to add, held_back: filenames still changing,
+# bad: dictionary {filename: reason} of broken files
+Validation = collections.namedtuple("Validation", ["clean", "held_back", "bad"])
+
+
+def quarantine_folder_of(_log_filename):
+    """Folder where broken raster files are moved: "quarantine" next to the log file
+
+    :param _log_filename: log file, or the manifests folder next to it (see folderManifest.manifest_folder_of)
+    :return:
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(_log_filename)), QUARANTINE_FOLDER)
+
+
+def structure_problem(_header):
+    """What is wrong with the structure of a raster file
+
+    :param _header: geotiffHeader.TiffHeader
+    :return: reason, None if strips (or tiles) are all stored within the file
+    """
+    blocks = "tiles" if _header.tiled else "strips"
+    if _header.width <= 0 or _header.height <= 0:
+        return "empty image of %s x %s cells" % (_header.width, _header.height)
+    if len(_header.offsets) < _header.block_count or len(_header.byte_counts) != len(_header.offsets):
+        return "%s offsets and %s sizes for %s %s" % (len(_header.offsets), len(_header.byte_counts),
+                                                      _header.block_count, blocks)
+    for i, (offset, byte_count) in enumerate(zip(_header.offsets, _header.byte_counts)):
+        if offset + byte_count > _header.file_size:
+            return "truncated: %s %s of %s end at byte %s, the file has %s bytes" % (
+                blocks[:-1], i + 1, len(_header.offsets), offset + byte_count, _header.file_size)
+    return None
+
+
+def _stat(_path):
+    try:
+        stats = os.stat(_path)
+    except OSError:
+        return None  # moved or deleted since the scan
+    return stats.st_size, stats.st_mtime
+
+
+def _check(_arguments):
+    """Second poll and structure of a raster file, in a thread
+
+    :param _arguments: (path, [size, mtime] of the scan, (size, mtime) of the first poll)
+    :return: (False, None) if held back, (True, reason) with reason None for a clean file
+    """
+    path, scanned, first = _arguments
+    second = _stat(path)
+    if second is None or second != first or [second[0], int(second[1])] != list(scanned):
+        return False, None
+    try:
+        return True, structure_problem(geotiffHeader.read_header(path))
+    except geotiffHeader.TiffError as error:
+        return True, "header: %s" % error
+    except (IOError, OSError):
+        return False, None  # removed or locked since the first poll
+
+
+def validate(_source_folder, _filenames, _scan, _workers=WORKERS, _poll_seconds=None, _sleep=time.sleep,
+             _clock=time.time):
+    """Check new raster files of a source folder before the add step
+
+    :param _source_folder:
+    :param _filenames: new raster filenames
+    :param _scan: as returned by folderManifest.scan_folder, the first look at the files
+    :param _workers: number of threads
+    :param _poll_seconds: time between the two polls. None is POLL_SECONDS
+    :param _sleep: as time.sleep
+    :param _clock: as time.time
+    :return: Validation
+    """
+    filenames = sorted(_filenames)
+    if not filenames:
+        return Validation([], [], {})
+    poll_seconds = POLL_SECONDS if _poll_seconds is None else _poll_seconds
+    paths = [os.path.join(_source_folder, filename) for filename in filenames]
+    pool = multiprocessing.pool.ThreadPool(processes=max(1, min(_workers, len(paths))))
+    try:
+        first = pool.map(_stat, paths)
+        newest = max(stats[1] for stats in first if stats is not None) if any(first) else None
+        if newest is not None and _clock() - newest < poll_seconds:
+            _sleep(poll_seconds)  # a file may still be being copied
+        results = pool.map(_check, [(path, _scan[filename], stats)
+                                    for path, filename, stats in zip(paths, filenames, first)])
+    finally:
+        pool.close()
+        pool.join()
+
+    clean, held_back, bad = [], [], {}
+    for filename, (settled, reason) in zip(filenames, results):
+        if not settled:
+            held_back.append(filename)
+        elif reason is not None:
+            bad[filename] = reason
+        else:
+            clean.append(filename)
+    if held_back:
+        logging.info("%s raster files still being written, held back until the next update: %s", len(held_back),
+                     ", ".join(held_back))
+    return Validation(clean, held_back, bad)
+
+
+def quarantine(_source_folder, _bad, _quarantine_folder):
+    """Move broken raster files to the quarantine folder, each one with a text file telling why
+
+    :param _source_folder:
+    :param _bad: dictionary {filename: reason}
+    :param _quarantine_folder: Ex: quarantine_folder_of(log_filename)
+    :return: list of filenames moved
+    """
+    moved = []
+    for filename, reason in sorted(_bad.items()):
+        if not os.path.isdir(_quarantine_folder):
+            os.makedirs(_quarantine_folder)
+        target = os.path.join(_quarantine_folder, filename)
+        try:
+            if os.path.exists(target):
+                os.remove(target)  # an older broken copy
+            shutil.move(os.path.join(_source_folder, filename), target)
+            with open(target + ".txt", "w") as f:
+                f.write("%s\n%s\n%s\n" % (os.path.join(_source_folder, filename),
+                                          time.strftime("%Y-%m-%d %H:%M:%S"), reason))
+        except (IOError, OSError) as error:
+            logging.error("Raster %s is broken (%s) and could not be moved to %s: %s", filename, reason,
+                          _quarantine_folder, error)
+            continue
+        logging.warning("Raster %s is broken (%s), moved to %s", filename, reason, _quarantine_folder)
+        moved.append(filename)
+    return moved
+
+
+def hold_back(_current, _previous, _filenames):
+    """Entries of a manifest (or fingerprint index) to save when some files were not added: their previous entries,
+    so that the next update takes them as new again
+
+    :param _current: dictionary {filename: value} to save
+    :param _previous: dictionary {filename: value} saved by the previous update
+    :param _filenames: filenames held back or moved to quarantine
+    :return: new dictionary
+    """
+    entries = dict(_current)
+    for filename in _filenames:
+        if filename in _previous:
+            entries[filename] = _previous[filename]
+        else:
+            entries.pop(filename, None)
+    return entries
+
+
+def screen(_source_folder, _plan, _scan, _manifest, _fingerprints, _quarantine_folder):
+    """Check the files of a fingerprint plan before the add step. Files held back or moved to quarantine keep their
+    previous manifest and fingerprint entries
+
+    :param _source_folder:
+    :param _plan: as returned by rasterFingerprints.plan
+    :param _scan: as returned by folderManifest.scan_folder
+    :param _manifest: as returned by folderManifest.load_manifest
+    :param _fingerprints: as returned by rasterFingerprints.load_index
+    :param _quarantine_folder: Ex: quarantine_folder_of(log_filename)
+    :return: (plan with clean files only, scan to save as manifest)
+    """
+    validation = validate(_source_folder, _plan.add + _plan.refresh, _scan)
+    quarantine(_source_folder, validation.bad, _quarantine_folder)
+    skipped = validation.held_back + sorted(validation.bad)
+    if not skipped:
+        return _plan, _scan
+    clean = set(validation.clean)
+    return (_plan._replace(add=[filename for filename in _plan.add if filename in clean],
+                           refresh=[filename for filename in _plan.refresh if filename in clean],
+                           index=hold_back(_plan.index, _fingerprints, skipped)),
+            hold_back(_scan, _manifest, skipped))
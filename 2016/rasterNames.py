@@ -0,0 +1,135 @@
+# Author:   GEOTEC, UJI
+# Date:     March 2016
+#
+# Purpose:  Parse the names of ERMES raster files into the values of the custom fields of mosaic data sets
+#           (PARAMNAME, YEAR, SDATE and DATE). Every product family follows its own naming convention:
+#           1/ MONITORING: IT_Monitoring_NDVI_2016_001 (updateMosaicDatasets.py)
+#           2/ LOCAL: IT_LAI_ETM_2016_099 (updateMosaicDatasetsLOCAL.py)
+#           3/ LTA: IT_avg_Monitoring_NDVI_2003_2015_001 (updateMosaicDatasetsLTA.py)
+#           4/ FORECAST: IT_Meteo_Forecast_TMax_2016_246 or IT_Meteo_Forecast_TMax_2016_246_plus1
+#              (updateMosaicDatasetsFORE.py)
+#           Conventions are declared once in NAMING_CONVENTIONS and compiled into a parser per family.
+#
+# Note:     Names that do not follow the convention are returned apart instead of raising an exception,
+#           so that one odd file does not stop the update of a whole mosaic data set.
+#           Year/day of year to date conversions are cached: a season only has a few hundred different dates.
+#
+# Usage:    parser = rasterNames.parser_of(rasterNames.MONITORING)
+#           raster_name = parser("IT_Monitoring_NDVI_2016_001")  # None if it cannot be parsed
+#           raster_names, unparsed = rasterNames.parse_names(names, rasterNames.MONITORING)
+
+import collections
+import datetime
+import re
+
+MONITORING = "MONITORING"
+LOCAL = "LOCAL"
+LTA = "LTA"
+FORECAST = "FORECAST"
+
+# Position of each value in the name split by "_"
+#   parts: number of parts (a list for optional trailing parts)
+#   paramname, year, day: position of PARAMNAME, YEAR and day of year
+#   upper: PARAMNAME in uppercase
+#   plus: position of the optional forecast offset ("plus1" --> one day after day of year)
+NAMING_CONVENTIONS = {
+    MONITORING: {"parts": [5], "paramname": 2, "year": 3, "day": 4, "upper": False, "plus": None},
+    LOCAL: {"parts": [5], "paramname": 2, "year": 3, "day": 4, "upper": True, "plus": None},
+    LTA: {"parts": [7], "paramname": 1, "year": 5, "day": 6, "upper": True, "plus": None},
+    FORECAST: {"parts": [6, 7], "paramname": 3, "year": 4, "day": 5, "upper": True, "plus": 6}}
+
+SDATE_FORMAT = '%Y/%m/%d'
+
+# Values of custom fields parsed from a raster name. SDATE is DATE as a string (Ex: 2016/01/01)
+RasterName = collections.namedtuple("RasterName", ["name", "paramname", "year", "sdate", "date"])
+
+_YEAR_PATTERN = re.compile(r"^\d{4}$")
+_DAY_PATTERN = re.compile(r"^\d{1,3}$")
+_PLUS_PATTERN = re.compile(r"^plus(\d+)$")
+_dates = {}  # (year, day of year, days after) --> (SDATE, DATE)
+_parsers = {}  # family --> parser
+
+
+def date_of(_year, _day, _plus=0):
+    """SDATE and DATE of a day of year, plus a number of days. Conversions are cached
+
+    :param _year: string. Ex: "2016"
+    :param _day: string. Ex: "001"
+    :param _plus: days after day of year (forecasts)
+    :return: (SDATE, DATE)
+    """
+    key = (_year, _day, _plus)
+    try:
+        return _dates[key]
+    except KeyError:
+        pass
+    if not _YEAR_PATTERN.match(_year) or not _DAY_PATTERN.match(_day) or not 1 <= int(_day) <= 366:
+        raise ValueError("Not a year and day of year: %s %s" % (_year, _day))
+    date_value = datetime.datetime(int(_year), 1, 1) + datetime.timedelta(int(_day) + _plus - 1)
+    _dates[key] = (date_value.strftime(SDATE_FORMAT), date_value)
+    return _dates[key]
+
+
+def compile_convention(_convention):
+    """Build the parser of a naming convention
+
+    :param _convention: dictionary as in NAMING_CONVENTIONS
+    :return: function taking a raster name (with or without extension) and returning a RasterName or None
+    """
+    parts_count = frozenset(_convention["parts"])
+    paramname_index = _convention["paramname"]
+    year_index = _convention["year"]
+    day_index = _convention["day"]
+    upper = _convention["upper"]
+    plus_index = _convention["plus"]
+
+    def parse(_name):
+        stem = _name[:-4] if _name[-4:].lower() == ".tif" else _name
+        parts = stem.split("_")
+        if len(parts) not in parts_count:
+            return None
+        plus = 0
+        if plus_index is not None and len(parts) > plus_index:
+            match = _PLUS_PATTERN.match(parts[plus_index])
+            if match is None:
+                return None
+            plus = int(match.group(1))
+        year = parts[year_index]
+        try:
+            sdate, date_value = date_of(year, parts[day_index], plus)
+        except ValueError:
+            return None
+        paramname = parts[paramname_index]
+        return RasterName(_name, paramname.upper() if upper else paramname, year, sdate, date_value)
+
+    return parse
+
+
+def parser_of(_family):
+    """Parser of a product family, compiled once
+
+    :param _family: MONITORING, LOCAL, LTA or FORECAST
+    :return:
+    """
+    if _family not in _parsers:
+        _parsers[_family] = compile_convention(NAMING_CONVENTIONS[_family])
+    return _parsers[_family]
+
+
+def parse_names(_names, _family):
+    """Parse a batch of raster names
+
+    :param _names:
+    :param _family: MONITORING, LOCAL, LTA or FORECAST
+    :return: (list of RasterName, list of names that cannot be parsed)
+    """
+    parse = parser_of(_family)
+    raster_names = []
+    unparsed = []
+    for name in _names:
+        raster_name = parse(name)
+        if raster_name is None:
+            unparsed.append(name)
+        else:
+            raster_names.append(raster_name)
+    return raster_names, unparsed
@@ -0,0 +1,107 @@
+# Author:   GEOTEC, UJI
+# Date:     March 2016
+#
+# Purpose:  Build pyramids and calculate statistics of new raster files before they are added to mosaic data sets.
+#           AddRastersToMosaicDataset_management builds them inline, one raster after another, while the mosaic
+#           data set is locked. Done beforehand, rasters are processed in parallel (one process per raster) and
+#           the add step only registers them (see REGISTER_ONLY), which is a short metadata operation.
+#           Rasters that already have pyramids (.ovr) and statistics (.aux.xml) are skipped.
+#
+# Note:     Workers are processes, not threads, as arcpy tools are not thread safe. Run this stage from the main
+#           process, before mosaicScheduler.run_jobs: pool workers cannot start pools of their own.
+#
+# Usage:    rasters = rasterPreprocessing.pending_rasters(source_folders)
+#           rasterPreprocessing.preprocess(rasters, 4, "arcpy", {})
+#           gp.add_rasters(mosaic_path, source_folder, **rasterPreprocessing.REGISTER_ONLY)
+
+import fnmatch
+import logging
+import multiprocessing
+import os
+
+import gpBackend
+
+# Parameters of AddRastersToMosaicDataset_management once pyramids and statistics have been built beforehand
+REGISTER_ONLY = {"build_pyramids": "NO_PYRAMIDS", "calculate_statistics": "NO_STATISTICS"}
+
+_gp = None  # geoprocessing backend of a worker process
+
+
+def is_preprocessed(_raster_path):
+    """True if pyramids and statistics files exist next to the raster
+
+    :param _raster_path:
+    :return:
+    """
+    return os.path.isfile(_raster_path + ".ovr") and os.path.isfile(_raster_path + ".aux.xml")
+
+
+def pending_rasters(_source_folders, _filter="*.tif"):
+    """Raster files of the source folders without pyramids or statistics
+
+    :param _source_folders: list of folders, or of (folder, list of filenames) to only consider some files
+    :param _filter: same wildcard as the "filter" parameter of AddRastersToMosaicDataset_management
+    :return: list of paths
+    """
+    rasters = []
+    for source_folder in _source_folders:
+        if isinstance(source_folder, tuple):
+            source_folder, filenames = source_folder
+        else:
+            filenames = sorted(os.listdir(source_folder))
+        for filename in filenames:
+            raster_path = os.path.join(source_folder, filename)
+            if fnmatch.fnmatch(filename, _filter) and not is_preprocessed(raster_path):
+                rasters.append(raster_path)
+    return rasters
+
+
+def _init_worker(_backend_name, _backend_options):
+    global _gp
+    _gp = gpBackend.create_backend(_backend_name, **_backend_options)
+
+
+def _preprocess_raster(_raster_path):
+    """Build pyramids and statistics of a raster in a worker process
+
+    :param _raster_path:
+    :return: (raster path, error messages or None)
+    """
+    try:
+        _gp.build_pyramids_and_statistics(_raster_path)
+    except _gp.ExecuteError:
+        return _raster_path, _gp.get_messages(2)
+    return _raster_path, None
+
+
+def preprocess(_rasters, _workers, _backend_name, _backend_options):
+    """Build pyramids and statistics of rasters in parallel. Failures are logged, not raised: the add step
+    registers those rasters anyway and they will be tried again in the next update
+
+    :param _rasters: list of paths
+    :param _workers: number of worker processes. 1 processes rasters in the current process
+    :param _backend_name: geoprocessing backend of worker processes, see gpBackend.create_backend
+    :param _backend_options:
+    :return: list of rasters that failed
+    """
+    if not _rasters:
+        return []
+    logging.info("Building pyramids and statistics of %s raster files...", len(_rasters))
+    if _workers <= 1 or len(_rasters) <= 1:
+        _init_worker(_backend_name, _backend_options)
+        results = [_preprocess_raster(raster_path) for raster_path in _rasters]
+    else:
+        pool = multiprocessing.Pool(processes=min(_workers, len(_rasters)),
+                                    initializer=_init_worker, initargs=(_backend_name, _backend_options))
+        try:
+            results = pool.map(_preprocess_raster, _rasters, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    failed = []
+    for raster_path, messages in results:
+        if messages is not None:
+            logging.warning("Pyramids and statistics of %s failed: %s", raster_path, messages)
+            failed.append(raster_path)
+    return failed
@@ -0,0 +1,156 @@
+# Author:   GEOTEC, UJI
+# Date:     March 2016
+#
+# Purpose:  Keep a failing mosaic data set from stopping the update of the others, and record which mosaic data sets
+#           of a run are done, so that a run can be resumed instead of repeated.
+#           Each job (one line of a folders file) is run on its own: an error is logged and recorded as "failed",
+#           and the run goes on with the next mosaic data set. Outcomes are appended as JSON lines to a checkpoint
+#           file next to the log file (IT_2016.log --> IT_2016.checkpoint.jsonl):
+#           {"time": "2016-03-21 01:02:03", "database": "IT_2016.gdb", "mosaic": "REGIONAL_MONITORING_NDVI",
+#            "status": "done", "error": null}
+#           A new run starts a new checkpoint file. A run started with --resume only runs the mosaic data sets of
+#           the folders files that are not "done" in the checkpoint file (failed ones and those never reached).
+#
+# Note:     Worker processes append to the same checkpoint file, one short line per job; the last line of a mosaic
+#           data set wins.
+#
+# Usage:    resume = runCheckpoint.pop_resume_option(sys.argv)
+#           checkpoint = runCheckpoint.Checkpoint(runCheckpoint.checkpoint_filename_of(log_filename))
+#           jobs = checkpoint.select(jobs, resume)
+#           mosaicScheduler.run_jobs(jobs, runCheckpoint.CheckpointedJob(update_job, checkpoint.filename), ...)
+#           checkpoint.log_outcome(jobs)
+
+import datetime
+import json
+import logging
+import os
+
+CHECKPOINT_EXTENSION = ".checkpoint.jsonl"
+RESUME_OPTION = "--resume"
+DONE = "done"
+FAILED = "failed"
+
+
+def checkpoint_filename_of(_log_filename):
+    """Checkpoint file of a log file. Ex: IT_2016.log --> IT_2016.checkpoint.jsonl
+
+    :param _log_filename:
+    :return:
+    """
+    return os.path.splitext(os.path.abspath(_log_filename))[0] + CHECKPOINT_EXTENSION
+
+
+def pop_resume_option(_argv):
+    """Remove --resume from the command line arguments, so that positional arguments keep their place
+
+    :param _argv: sys.argv, modified in place
+    :return: True if --resume was given
+    """
+    resume = RESUME_OPTION in _argv
+    while RESUME_OPTION in _argv:
+        _argv.remove(RESUME_OPTION)
+    return resume
+
+
+def job_key(_job):
+    """Geo database and mosaic data set of a job (database_path, mosaic_name, ...). Ex: (IT_2016.gdb, REGIONAL_...)"""
+    return os.path.basename(os.path.normpath(_job[0])), _job[1]
+
+
+class Checkpoint(object):
+    """Outcome of every mosaic data set of a run, in a JSON lines file
+
+    :param _checkpoint_filename: Ex: checkpoint_filename_of(log_filename)
+    """
+
+    def __init__(self, _checkpoint_filename):
+        self.filename = _checkpoint_filename
+
+    def write(self, _job, _status, _error=None):
+        database, mosaic = job_key(_job)
+        record = {"time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "database": database,
+                  "mosaic": mosaic, "status": _status, "error": _error}
+        with open(self.filename, "a") as f:
+            f.write(json.dumps(record, sort_keys=True) + "\n")
+
+    def statuses(self):
+        """Last status of every mosaic data set in the checkpoint file
+
+        :return: dictionary {(database, mosaic): status}
+        """
+        statuses = {}
+        if not os.path.isfile(self.filename):
+            return statuses
+        with open(self.filename, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # line cut short when the run was killed
+                statuses[(record["database"], record["mosaic"])] = record["status"]
+        return statuses
+
+    def select(self, _jobs, _resume=False):
+        """Jobs to run. A new run (not resumed) starts a new checkpoint file
+
+        :param _jobs: list of (database_path, mosaic_name, ...)
+        :param _resume: if True, only jobs not done in the checkpoint file
+        :return: list of jobs, in the given order
+        """
+        if not _resume:
+            if os.path.exists(self.filename):
+                os.remove(self.filename)
+            return list(_jobs)
+        statuses = self.statuses()
+        jobs = [job for job in _jobs if statuses.get(job_key(job)) != DONE]
+        logging.info("Resuming: %s of %s mosaic data sets left (%s failed)", len(jobs), len(_jobs),
+                     len([job for job in jobs if statuses.get(job_key(job)) == FAILED]))
+        return jobs
+
+    def run(self, _function, _job):
+        """Run _function(_job) and record its outcome. Errors are logged, not raised
+
+        :param _function:
+        :param _job:
+        :return: DONE or FAILED
+        """
+        try:
+            _function(_job)
+        except Exception as error:
+            database, mosaic = job_key(_job)
+            logging.error("Mosaic data set %s of %s not updated: %s", mosaic, database, error)
+            self.write(_job, FAILED, str(error))
+            return FAILED
+        self.write(_job, DONE)
+        return DONE
+
+    def log_outcome(self, _jobs):
+        """Log how many jobs of the run are done and which ones failed
+
+        :param _jobs: jobs of the run
+        :return: list of (database, mosaic) failed
+        """
+        statuses = self.statuses()
+        keys = [job_key(job) for job in _jobs]
+        failed = [key for key in keys if statuses.get(key) == FAILED]
+        logging.info("%s of %s mosaic data sets done.", len([key for key in keys if statuses.get(key) == DONE]),
+                     len(keys))
+        if failed:
+            logging.error("%s mosaic data sets failed: %s. Run again with %s to retry only them.", len(failed),
+                          ", ".join("%s/%s" % key for key in failed), RESUME_OPTION)
+        return failed
+
+
+class CheckpointedJob(object):
+    """Worker for mosaicScheduler.run_jobs that isolates and records every job. It can be pickled if _function can
+
+    :param _function: module level function taking a single job
+    :param _checkpoint_filename:
+    """
+
+    def __init__(self, _function, _checkpoint_filename):
+        self.function = _function
+        self.checkpoint = Checkpoint(_checkpoint_filename)
+
+    def __call__(self, _job):
+        return self.checkpoint.run(self.function, _job)
@@ -0,0 +1,65 @@
+# Author:   GEOTEC, UJI
+# Date:     March 2016
+#
+# Purpose:  Registry of the coordinate systems used by the create and update scripts. Each coordinate system is
+#           parsed once per process and geoprocessing backend (arcpy.SpatialReference + loadFromString for a WKT
+#           string, arcpy.SpatialReference(code) for a factory code) and then reused by every mosaic data set.
+#           The create script hands it to the new mosaic data sets and to the output coordinate system of the
+#           environment (see mosaicSchema.SPATIAL_REFERENCE). The add step keeps an empty input spatial reference:
+#           each raster is read in its own coordinate system (Ex: UTM 32N) and projected by the mosaic data set.
+#
+# Note:     SpatialReference objects are not pickled: pool workers build their own registry on first use.
+#
+# Usage:    sr = spatialReferences.get(gp, mosaicSchema.SPATIAL_REFERENCE)  # or a factory code. Ex: 3035
+#           spatialReferences.set_output_coordinate_system(gp, sr)
+#           gp.add_rasters(mosaic_path, source_folder, **spatialReferences.add_parameters(gp, parameters))
+
+import weakref
+
+import mosaicSchema
+
+_registry = weakref.WeakKeyDictionary()  # backend --> {WKT string or factory code: spatial reference}
+
+
+def get(_gp, _definition=mosaicSchema.SPATIAL_REFERENCE):
+    """Spatial reference of a WKT string or factory code, parsed on first use
+
+    :param _gp: geoprocessing backend
+    :param _definition: WKT string or factory code (EPSG/ESRI WKID)
+    :return:
+    """
+    spatial_references = _registry.setdefault(_gp, {})
+    if _definition not in spatial_references:
+        spatial_references[_definition] = _gp.spatial_reference(_definition)
+    return spatial_references[_definition]
+
+
+def set_output_coordinate_system(_gp, _spatial_reference):
+    """Set the output coordinate system of the environment, unless it already holds the same coordinate system.
+    arcpy.env returns a copy of the spatial reference it holds: both are compared by their strings
+
+    :param _gp: geoprocessing backend
+    :param _spatial_reference: as returned by get
+    :return:
+    """
+    current = _gp.env.outputCoordinateSystem
+    if current is None or current.exportToString() != _spatial_reference.exportToString():
+        _gp.env.outputCoordinateSystem = _spatial_reference
+
+
+def add_parameters(_gp, _parameters=None):
+    """Parameters of the add step. The input spatial reference is left empty: each raster is read in its own
+    coordinate system, which is not the one of the mosaic data sets
+
+    :param _gp: geoprocessing backend
+    :param _parameters: parameters overriding gpBackend.ADD_RASTERS_DEFAULTS, which take precedence
+    :return: dictionary
+    """
+    parameters = {"spatial_reference": ""}
+    parameters.update(_parameters or {})
+    return parameters
+
+
+def clear():
+    """Forget parsed spatial references. Ex: between benchmark runs"""
+    _registry.clear()
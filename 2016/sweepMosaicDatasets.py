@@ -0,0 +1,150 @@
+# Author:   GEOTEC, UJI
+# Date:     March 2016
+#
+# Purpose:  This script checks the catalog items of mosaic data sets against their raster files (see catalogHealth):
+#           items whose raster file is missing, was modified since it was added, or has stale pyramids or
+#           statistics. It reads the same folders files as updateAllMosaicDatasets.py (all variants) and looks
+#           at every raster file of every catalog in seconds, so it can run daily after the update.
+#           With REMOVE, items of missing raster files are removed from the catalog, unless their source folder is
+#           missing or most items are missing (see catalogHealth.remove_missing): once a week, or by hand.
+#           With REPAIR, items of modified raster files are removed and added again by the next update, and stale
+#           pyramids and statistics are built again.
+#           With DEEP, AnalyzeMosaicDataset_management also runs with every checker keyword (slow): once a week.
+#
+# Note:     Modified raster files are told by the manifests of the update scripts: keep <log_file> in the folder
+#           of the log file of the daily update (see folderManifest). A mosaic data set that cannot be checked
+#           does not stop the others (see runCheckpoint). Removed items are also removed from the temporal indexes of
+#           the update scripts (see temporalIndex).
+#
+# Usage:    python sweepMosaicDatasets.py <target_folder> <folders_files> <log_file> [--resume] [<threads>] [REMOVE]
+#           [REPAIR] [DEEP]
+#           <folders_files>: comma separated list of folders files, which may hold wildcards
+#           <threads>: raster files looked at the same time (default 16)
+# Example:  python sweepMosaicDatasets.py c:/ERMES/PRODUCTS/SCRIPTS *_2016_folders*.txt ALL_2016_sweep.log 16
+# Example:  python sweepMosaicDatasets.py c:/ERMES/PRODUCTS/SCRIPTS *_2016_folders*.txt ALL_2016_sweep.log 16 REMOVE DEEP
+
+# Import the modules
+import logging, sys, os
+import catalogHealth
+import folderConfig
+import folderManifest
+import gpBackend
+import gpRetry
+import mosaicSchema
+import rasterFingerprints
+import runCheckpoint
+import temporalIndex
+import toolMetrics
+import updateAllMosaicDatasets
+
+gp = None  # geoprocessing backend (arcpy), set up by the main programme
+LOG_FORMAT = '%(asctime)s %(filename)s %(levelname)-8s %(message)s'
+
+
+def sweep_mosaic(_database_path, _mosaic_name, _manifest_folder=None, _workers=catalogHealth.WORKERS,
+                 _remove=False, _repair=False, _deep=False):
+    """Check the catalog items of a mosaic data set against their raster files
+
+    :param _database_path:
+    :param _mosaic_name:
+    :param _manifest_folder: manifests of the update scripts, to tell modified raster files. None does not tell them
+    :param _workers: number of threads
+    :param _remove: remove the items of missing raster files
+    :param _repair: remove the items of modified raster files so that the next update adds them again, and build
+                    stale pyramids and statistics again
+    :param _deep: also run AnalyzeMosaicDataset with every checker keyword
+    :return: catalogHealth.Health
+    """
+    mosaic_path = os.path.join(_database_path, _mosaic_name)
+    manifest = None
+    if _manifest_folder is not None:
+        manifest_path = folderManifest.manifest_path(_manifest_folder, _database_path, _mosaic_name)
+        manifest = folderManifest.load_manifest(manifest_path)
+
+    health = catalogHealth.sweep(gp, mosaic_path, manifest, _workers)
+    catalogHealth.log_health(mosaic_path, health)
+    removed = []
+    if _remove and catalogHealth.remove_missing(gp, mosaic_path, health):
+        removed.extend(health.missing)
+    if _repair:
+        if health.modified and manifest is not None:
+            index_path = rasterFingerprints.index_path(manifest_path)
+            index = rasterFingerprints.load_index(index_path)
+            catalogHealth.forget_modified(gp, mosaic_path, health, manifest, index)
+            folderManifest.save_manifest(manifest_path, manifest)
+            rasterFingerprints.save_index(index_path, index)
+            removed.extend(health.modified)
+        catalogHealth.rebuild_stale(gp, health)
+    if removed and _manifest_folder is not None:
+        # Removed items no longer answer date queries of the web application (temporalIndex)
+        temporalIndex.forget(temporalIndex.index_path(manifest_path), [object_id for object_id, _ in removed])
+
+    if _deep:
+        logging.info("Performing final checks...")
+        # Performs checks on a mosaic data set for errors and possible improvements.
+        gp.analyze_mosaic(mosaic_path, mosaicSchema.ANALYZE_KEYWORDS)
+        if len(gp.get_messages(1)) > 0:
+            logging.warning(gp.get_messages(1))
+    return health
+
+
+# main programme
+if __name__ == "__main__":
+    try:
+        RESUME = runCheckpoint.pop_resume_option(sys.argv)  # before positional arguments are read
+        BACKEND_NAME, BACKEND_OPTIONS = gpBackend.backend_settings()  # arcpy, see gpBackend
+        gp = gpBackend.create_backend(BACKEND_NAME, **BACKEND_OPTIONS)
+
+        # Set the workspace
+        ENV_PATH = os.path.normpath(os.path.join(sys.argv[1], ".."))
+        MOSAICS_FILENAMES = updateAllMosaicDatasets.folders_files(sys.argv[2])
+        LOG_FILENAME = sys.argv[3]
+        ARGUMENTS = sys.argv[4:]
+        WORKERS = int(ARGUMENTS.pop(0)) if ARGUMENTS and ARGUMENTS[0].isdigit() else catalogHealth.WORKERS
+        OPTIONS = [argument.upper() for argument in ARGUMENTS]
+        gp.env.workspace = ENV_PATH
+        gp.env.overwriteOutput = True
+
+        # Do not spread operations across multiple processes.
+        gp.env.parallelProcessingFactor = "0"
+        MANIFEST_FOLDER = folderManifest.manifest_folder_of(LOG_FILENAME)
+
+        # Create logger object
+        logging.basicConfig(level=logging.DEBUG,
+                            format=LOG_FORMAT,
+                            datefmt='%d %b %Y %H:%M:%S',
+                            filename=LOG_FILENAME)
+
+        logging.info("Script initiating...")
+        METRICS_FILENAME = toolMetrics.metrics_filename_of(LOG_FILENAME)  # time every tool, see toolMetrics
+        metrics_offset = toolMetrics.file_offset(METRICS_FILENAME)
+        gp = toolMetrics.instrument(gp, METRICS_FILENAME)
+        gp = gpRetry.retrying(gp, METRICS_FILENAME)  # wait for geo databases locked by others, see gpRetry
+        # Every line is checked before the first mosaic data set is swept
+        jobs = []
+        for mosaics_filename in MOSAICS_FILENAMES:
+            jobs.extend((folderConfig.database_path(ENV_PATH, config), config.mosaic_name)
+                        for config in folderConfig.read_config(mosaics_filename))
+        checkpoint = runCheckpoint.Checkpoint(runCheckpoint.checkpoint_filename_of(LOG_FILENAME))
+        jobs = checkpoint.select(jobs, RESUME)
+        logging.info("Sweeping %s mosaic data sets with %s threads%s...", len(jobs), WORKERS,
+                     "".join(" " + option for option in OPTIONS))
+        for job in jobs:
+            # A failing mosaic data set is logged and recorded, and the next one is swept, see runCheckpoint
+            checkpoint.run(lambda _job: sweep_mosaic(*_job, _manifest_folder=MANIFEST_FOLDER, _workers=WORKERS,
+                                                     _remove="REMOVE" in OPTIONS, _repair="REPAIR" in OPTIONS,
+                                                     _deep="DEEP" in OPTIONS), job)
+        checkpoint.log_outcome(jobs)
+        toolMetrics.log_summary(METRICS_FILENAME, metrics_offset)
+        logging.info("Script finished.")
+
+    except folderConfig.ConfigError as error:
+        logging.error("Folders file not valid, no mosaic data set touched:\n%s", error)
+
+    except gp.ExecuteError:
+        logging.info("Script did not complete.")
+        # log errors
+        logging.error(gp.get_messages(2))
+
+    except:
+        logging.info(gp.get_messages())
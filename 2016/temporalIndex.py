@@ -0,0 +1,334 @@
+# Author:   GEOTEC, UJI
+# Date:     March 2016
+#
+# Purpose:  Answer the date questions of the web application ("which dates are available for NDVI", "latest forecast
+#           for TMAX") from a small file next to the manifest of each mosaic data set
+#           (manifests/IT_2016.gdb_REGIONAL_MONITORING_NDVI.dates.idx) instead of querying the geo database.
+#           For every PARAMNAME of the mosaic data set, the file holds the DATE of its catalog items sorted in time,
+#           their OBJECTIDs in the same order and a bitmap of their FORE flags. Dates are days (proleptic ordinals)
+#           stored as 4 byte integers, so the file can be memory mapped and searched with bisect without reading
+#           it: a query costs a few microseconds, whatever the size of the catalog.
+#           The update scripts keep the index up to date with the custom field values they write (update): new
+#           entries are merged in, forecast flags rotated and superseded forecasts dropped as in the catalog. When
+#           items are removed by name (rasters with new content, see rasterFingerprints), or when there is no index
+#           yet, the next update that adds rasters builds it again from the catalog with a single search cursor.
+#           sweepMosaicDatasets.py forgets the items it removes.
+#
+# Note:     File layout (little endian): "ERMT", version (H), number of PARAMNAMEs (H), then per PARAMNAME its name
+#           (32 bytes, UTF-8, zero padded), number of items (I) and offset (I) of its dates (i each), followed by
+#           its OBJECTIDs (i each) and its FORE bitmap (1 bit per item, first item in the lowest bit).
+#           The index is written anew and replaced on each update: open it for a query and close it afterwards
+#           (Windows does not replace a file that is mapped). Delete it to have it built again from the catalog
+#           (Ex: after a mosaic data set is created again).
+#
+# Usage:    with temporalIndex.TemporalIndex(temporalIndex.index_path(manifest_path)) as index:
+#               index.dates("NDVI", datetime.date(2016, 5, 1), datetime.date(2016, 5, 31))  # [(date, OBJECTID)]
+#               index.latest("TMAX", 1, _forecast=True)  # newest first
+#           In the update scripts, once custom fields are written:
+#           temporalIndex.update(gp, mosaic_path, temporalIndex.index_path(manifest_path), values)
+
+import bisect
+import datetime
+import logging
+import mmap
+import os
+import struct
+
+import catalogQuery
+
+INDEX_EXTENSION = ".dates.idx"
+MAGIC = b"ERMT"
+VERSION = 1
+HEADER = struct.Struct("<4sHH")  # magic, version, number of PARAMNAMEs
+DIRECTORY_ENTRY = struct.Struct("<32sII")  # PARAMNAME, number of items, offset of dates
+VALUE = struct.Struct("<i")  # date (ordinal) or OBJECTID
+
+
+class TemporalIndexError(ValueError):
+    """Not a temporal index, or an index cut short"""
+
+
+def index_path(_manifest_path):
+    """Temporal index of a mosaic data set, next to its manifest. Ex: ..._NDVI.json --> ..._NDVI.dates.idx
+
+    :param _manifest_path: as returned by folderManifest.manifest_path
+    :return:
+    """
+    return os.path.splitext(_manifest_path)[0] + INDEX_EXTENSION
+
+
+def _day(_value):
+    """Ordinal of a DATE value (datetime, date), None if it has no date"""
+    return None if _value is None else _value.toordinal()
+
+
+def add_entries(_groups, _values, _forecast=False):
+    """Merge new catalog items into the entries of an index
+
+    :param _groups: dictionary {PARAMNAME: list of [day, OBJECTID, FORE]}, modified in place
+    :param _values: dictionary {OBJECTID: (PARAMNAME, YEAR, SDATE, DATE, ...)}, see fieldWriter.compute_values
+    :param _forecast: the new items are the latest forecasts: FORE is cleared for every other item, as
+                      updateMosaicDatasetsFORE.rotate_forecasts does in the catalog
+    :return: number of entries added
+    """
+    if _forecast and _values:
+        for entries in _groups.values():
+            for entry in entries:
+                entry[2] = 0
+    added = 0
+    for object_id, values in _values.items():
+        day = _day(values[3])  # DATE is 3
+        if day is None:
+            continue
+        _groups.setdefault(values[0], []).append([day, object_id, 1 if _forecast else 0])  # PARAMNAME is 0
+        added += 1
+    return added
+
+
+def remove_items(_groups, _object_ids):
+    """Forget catalog items removed from the mosaic data set
+
+    :param _groups: dictionary {PARAMNAME: list of [day, OBJECTID, FORE]}, modified in place
+    :param _object_ids:
+    :return: number of entries removed
+    """
+    object_ids = set(_object_ids)
+    removed = 0
+    for paramname in list(_groups):
+        entries = [entry for entry in _groups[paramname] if entry[1] not in object_ids]
+        removed += len(_groups[paramname]) - len(entries)
+        if entries:
+            _groups[paramname] = entries
+        else:
+            del _groups[paramname]
+    return removed
+
+
+def remove_superseded(_groups, _limit):
+    """Forget superseded forecasts dated before _limit, as updateMosaicDatasetsFORE.remove_superseded does in the
+    catalog
+
+    :param _groups: dictionary {PARAMNAME: list of [day, OBJECTID, FORE]}, modified in place
+    :param _limit: date or datetime
+    :return: number of entries removed
+    """
+    limit = _day(_limit)
+    return remove_items(_groups, [entry[1] for entries in _groups.values() for entry in entries
+                                  if entry[2] == 0 and entry[0] < limit])
+
+
+def read_catalog(_gp, _mosaic_path):
+    """Entries of an index from the catalog of a mosaic data set, in a single search cursor. Items whose custom
+    fields are not written yet (PARAMNAME 'NA'), could not be written (PARAMNAME '?') or without DATE are left out
+
+    :param _gp: geoprocessing backend
+    :param _mosaic_path:
+    :return: dictionary {PARAMNAME: list of [day, OBJECTID, FORE]}
+    """
+    groups = {}
+    with _gp.search_cursor(_mosaic_path, ["OID@", "PARAMNAME", "DATE", "FORE"]) as cursor:
+        for object_id, paramname, date, fore in cursor:
+            if paramname in (None, catalogQuery.SENTINEL_VALUE, catalogQuery.UNPARSED_VALUE) or date is None:
+                continue
+            groups.setdefault(paramname, []).append([_day(date), object_id, 1 if fore == 1 else 0])
+    return groups
+
+
+def write_index(_index_path, _groups):
+    """Write an index, replacing the previous one only once the new one is completely written
+
+    :param _index_path:
+    :param _groups: dictionary {PARAMNAME: list of [day, OBJECTID, FORE]}
+    :return:
+    """
+    paramnames = sorted(_groups)
+    offset = HEADER.size + DIRECTORY_ENTRY.size * len(paramnames)
+    directory, blocks = [], []
+    for paramname in paramnames:
+        entries = sorted(_groups[paramname])
+        count = len(entries)
+        bitmap = bytearray((count + 7) // 8)
+        for i, entry in enumerate(entries):
+            if entry[2]:
+                bitmap[i // 8] |= 1 << (i % 8)
+        directory.append(DIRECTORY_ENTRY.pack(paramname.encode("utf-8")[:32], count, offset))
+        blocks.append(struct.pack("<%di" % count, *[entry[0] for entry in entries]) +
+                      struct.pack("<%di" % count, *[entry[1] for entry in entries]) + bytes(bitmap))
+        offset += 8 * count + len(bitmap)
+
+    folder = os.path.dirname(_index_path)
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder)
+    temporary_path = _index_path + ".tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(paramnames)) + b"".join(directory) + b"".join(blocks))
+    if os.path.exists(_index_path):
+        os.remove(_index_path)  # os.rename does not overwrite on Windows
+    os.rename(temporary_path, _index_path)
+
+
+def load_entries(_index_path):
+    """Entries of an index, to be updated and written again
+
+    :param _index_path:
+    :return: dictionary {PARAMNAME: list of [day, OBJECTID, FORE]}, None if the index is missing or unreadable
+    """
+    if not os.path.isfile(_index_path):
+        return None
+    try:
+        with TemporalIndex(_index_path) as index:
+            return dict((paramname, index.entries(paramname)) for paramname in index.paramnames())
+    except (TemporalIndexError, struct.error, ValueError):
+        return None
+
+
+def update(_gp, _mosaic_path, _index_path, _values, _rebuild=False, _forecast=False, _superseded_before=None):
+    """Bring the index of a mosaic data set up to date after an update, once custom fields are written
+
+    :param _gp: geoprocessing backend
+    :param _mosaic_path:
+    :param _index_path: Ex: index_path(manifest_path)
+    :param _values: custom field values of the new entries, see fieldWriter.compute_values
+    :param _rebuild: items were removed by name (Ex: rasters with new content): build the index from the catalog
+    :param _forecast: the new entries are the latest forecasts, see add_entries
+    :param _superseded_before: superseded forecasts before that date were removed, see remove_superseded
+    :return:
+    """
+    groups = None if _rebuild else load_entries(_index_path)
+    if groups is None:
+        groups = read_catalog(_gp, _mosaic_path)
+        logging.info("Temporal index built from the catalog: %s items.",
+                     sum(len(entries) for entries in groups.values()))
+    else:
+        add_entries(groups, _values, _forecast)
+        if _superseded_before is not None:
+            remove_superseded(groups, _superseded_before)  # after the rotation, as in the catalog
+    write_index(_index_path, groups)
+
+
+def forget(_index_path, _object_ids):
+    """Forget catalog items removed from a mosaic data set (Ex: by sweepMosaicDatasets.py). A missing index is left
+    missing: the next update builds it from the catalog
+
+    :param _index_path:
+    :param _object_ids:
+    :return: number of entries removed
+    """
+    groups = load_entries(_index_path)
+    if groups is None or not _object_ids:
+        return 0
+    removed = remove_items(groups, _object_ids)
+    if removed:
+        write_index(_index_path, groups)
+    return removed
+
+
+class _Column(object):
+    """Read only sequence of 4 byte integers stored in a buffer, for bisect"""
+
+    def __init__(self, _buffer, _offset, _count):
+        self.buffer = _buffer
+        self.offset = _offset
+        self.count = _count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, _i):
+        if _i < 0 or _i >= self.count:
+            raise IndexError(_i)
+        return VALUE.unpack_from(self.buffer, self.offset + 4 * _i)[0]
+
+
+class TemporalIndex(object):
+    """Memory mapped temporal index of a mosaic data set, see write_index. Dates are returned as datetime.date
+
+    :param _index_path:
+    :raise TemporalIndexError: the file is not a temporal index
+    """
+
+    def __init__(self, _index_path):
+        self.file = open(_index_path, "rb")
+        try:
+            size = os.fstat(self.file.fileno()).st_size
+            if size < HEADER.size:
+                raise TemporalIndexError("%s is not a temporal index" % _index_path)
+            self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, count = HEADER.unpack_from(self.buffer, 0)
+            if magic != MAGIC or version != VERSION:
+                raise TemporalIndexError("%s is not a temporal index of version %s" % (_index_path, VERSION))
+            if HEADER.size + DIRECTORY_ENTRY.size * count > size:
+                raise TemporalIndexError("%s is cut short" % _index_path)
+            self.groups = {}
+            for i in range(count):
+                name, items, offset = DIRECTORY_ENTRY.unpack_from(self.buffer, HEADER.size + DIRECTORY_ENTRY.size * i)
+                if offset + 8 * items + (items + 7) // 8 > size:
+                    raise TemporalIndexError("%s is cut short" % _index_path)
+                self.groups[name.rstrip(b"\0").decode("utf-8")] = (_Column(self.buffer, offset, items),
+                                                                   _Column(self.buffer, offset + 4 * items, items),
+                                                                   offset + 8 * items)
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        if getattr(self, "buffer", None) is not None:
+            self.buffer.close()
+            self.buffer = None
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _type, _value, _traceback):
+        self.close()
+
+    def paramnames(self):
+        return sorted(self.groups)
+
+    def _fore(self, _paramname, _i):
+        byte = struct.unpack_from("<B", self.buffer, self.groups[_paramname][2] + _i // 8)[0]
+        return (byte >> (_i % 8)) & 1
+
+    def entries(self, _paramname):
+        """Every item of a PARAMNAME, as stored
+
+        :return: list of [day, OBJECTID, FORE]
+        """
+        days, object_ids, _ = self.groups[_paramname]
+        return [[days[i], object_ids[i], self._fore(_paramname, i)] for i in range(len(days))]
+
+    def dates(self, _paramname, _start=None, _end=None):
+        """Items of a PARAMNAME dated from _start to _end, both included, oldest first
+
+        :param _paramname: Ex: NDVI
+        :param _start: date or datetime, None from the first one
+        :param _end: date or datetime, None up to the last one
+        :return: list of (date, OBJECTID), empty for an unknown PARAMNAME
+        """
+        if _paramname not in self.groups:
+            return []
+        days, object_ids, _ = self.groups[_paramname]
+        first = 0 if _start is None else bisect.bisect_left(days, _day(_start))
+        last = len(days) if _end is None else bisect.bisect_right(days, _day(_end))
+        return [(datetime.date.fromordinal(days[i]), object_ids[i]) for i in range(first, last)]
+
+    def latest(self, _paramname, _count=1, _forecast=False, _before=None):
+        """The newest items of a PARAMNAME, newest first
+
+        :param _paramname: Ex: TMAX
+        :param _count: number of items
+        :param _forecast: only items flagged as latest forecasts (FORE = 1)
+        :param _before: date or datetime, only items dated up to that day. None for every item
+        :return: list of (date, OBJECTID), empty for an unknown PARAMNAME
+        """
+        if _paramname not in self.groups:
+            return []
+        days, object_ids, _ = self.groups[_paramname]
+        i = len(days) if _before is None else bisect.bisect_right(days, _day(_before))
+        found = []
+        while i > 0 and len(found) < _count:
+            i -= 1
+            if not _forecast or self._fore(_paramname, i):
+                found.append((datetime.date.fromordinal(days[i]), object_ids[i]))
+        return found
@@ -0,0 +1,241 @@
+# Author:   GEOTEC, UJI
+# Date:     March 2016
+#
+# Purpose:  Time every geoprocessing call of a script. instrument() wraps a backend of gpBackend so that each tool
+#           (add_rasters, get_count, calculate_statistics, analyze_mosaic, cursors, ...) appends one JSON line to a
+#           metrics file next to the log file (IT_2016.log --> IT_2016.metrics.jsonl):
+#           {"time": "2016-03-21 01:02:03", "process": 1234, "tool": "add_rasters", "seconds": 12.3,
+#            "database": "IT_2016.gdb", "mosaic": "REGIONAL_MONITORING_NDVI", "rows": null, "error": false}
+#           rows holds the count returned by get_count and the rows read by cursors. Cursors are timed from their
+#           creation until the end of the with block, so updateRow calls are included.
+#           At the end of a run, log_summary logs the slowest mosaic data sets of the run.
+#           Time spent waiting for locked geo databases is recorded by gpRetry as "<tool> (lock wait)" records.
+#
+# Note:     Worker processes append to the same metrics file, one short line per write.
+#           The file grows with every run; summaries only read what a run appended (see file_offset).
+#
+# Usage:    gp = toolMetrics.instrument(gpBackend.create_backend("arcpy"), toolMetrics.metrics_filename_of(log))
+#           offset = toolMetrics.file_offset(metrics_filename)
+#           (run)
+#           toolMetrics.log_summary(metrics_filename, offset)
+
+import collections
+import datetime
+import json
+import logging
+import os
+import time
+
+import gpBackend
+
+METRICS_EXTENSION = ".metrics.jsonl"
+UNTIMED = frozenset(["get_messages", "add_field_delimiters", "sql_date"])  # no geoprocessing tool behind them
+CURSORS = frozenset(["update_cursor", "search_cursor"])
+UNTARGETED = frozenset(["spatial_reference", "build_pyramids_and_statistics"])  # not about a mosaic data set
+TARGET_LAST = frozenset(["copy"])  # (source, target): time is charged to the target
+SUMMARY_SIZE = 10  # mosaic data sets listed by log_summary
+LOCK_WAIT_SUFFIX = " (lock wait)"
+
+
+def metrics_filename_of(_log_filename):
+    """Metrics file of a log file. Ex: IT_2016.log --> IT_2016.metrics.jsonl
+
+    :param _log_filename:
+    :return:
+    """
+    return os.path.splitext(os.path.abspath(_log_filename))[0] + METRICS_EXTENSION
+
+
+def file_offset(_metrics_filename):
+    """Current size of the metrics file, to summarise only the records appended afterwards
+
+    :param _metrics_filename:
+    :return:
+    """
+    return os.path.getsize(_metrics_filename) if os.path.isfile(_metrics_filename) else 0
+
+
+def target_of(_tool, _args):
+    """Geo database and mosaic data set a tool works on, from its first arguments
+
+    :param _tool: name of the backend method
+    :param _args: positional arguments of the backend method. Ex: (mosaic_path, ...), (database_path, mosaic_name)
+                  or (folder, database_name)
+    :return: (database name, mosaic name), None when unknown
+    """
+    names = [arg for arg in _args[:2] if isinstance(arg, gpBackend.string_types)]
+    if _tool in TARGET_LAST:
+        names = names[1:]
+    if _tool in UNTARGETED or not names:
+        return None, None
+    if len(names) > 1 and names[1].lower().endswith(".gdb"):
+        return names[1], None
+    path = os.path.normpath(names[0])
+    if path.lower().endswith(".gdb"):
+        return os.path.basename(path), names[1] if len(names) > 1 else None
+    return os.path.basename(os.path.dirname(path)), os.path.basename(path)
+
+
+def lock_wait_tool(_tool):
+    """Tool name of the records of time spent waiting for locks. Ex: add_rasters --> add_rasters (lock wait)
+
+    :param _tool:
+    :return:
+    """
+    return _tool + LOCK_WAIT_SUFFIX
+
+
+class MetricsWriter(object):
+    """Append metric records to a JSON lines file"""
+
+    def __init__(self, _metrics_filename):
+        self.filename = _metrics_filename
+
+    def write(self, _tool, _seconds, _target, _rows=None, _error=False):
+        record = {"time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "process": os.getpid(),
+                  "tool": _tool, "seconds": round(_seconds, 6), "database": _target[0], "mosaic": _target[1],
+                  "rows": _rows, "error": _error}
+        with open(self.filename, "a") as f:
+            f.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+class TimedCursor(object):
+    """Cursor that records its tool, time and rows read once its with block (or iteration) ends"""
+
+    def __init__(self, _cursor, _writer, _tool, _target, _start):
+        self.cursor = _cursor
+        self.writer = _writer
+        self.tool = _tool
+        self.target = _target
+        self.start = _start
+        self.rows = 0
+        self.entered = False
+        self.done = False
+
+    def __iter__(self):
+        for row in self.cursor:
+            self.rows += 1
+            yield row
+        if not self.entered:
+            self.record()
+
+    def __getattr__(self, _name):
+        return getattr(self.cursor, _name)  # updateRow, fields, reset, ...
+
+    def __enter__(self):
+        self.cursor.__enter__()
+        self.entered = True
+        return self
+
+    def __exit__(self, _type, _value, _traceback):
+        try:
+            return self.cursor.__exit__(_type, _value, _traceback)
+        finally:
+            self.record(_type is not None)
+
+    def record(self, _error=False):
+        if not self.done:
+            self.done = True
+            self.writer.write(self.tool, time.time() - self.start, self.target, self.rows, _error)
+
+
+class InstrumentedBackend(object):
+    """Geoprocessing backend that records a metric for every tool call and forwards it to the wrapped backend
+
+    :param _gp: backend created by gpBackend.create_backend
+    :param _metrics_filename:
+    """
+
+    def __init__(self, _gp, _metrics_filename):
+        self.gp = _gp
+        self.writer = MetricsWriter(_metrics_filename)
+
+    def __getattr__(self, _name):
+        attribute = getattr(self.gp, _name)  # env, ExecuteError, calls, ... are not wrapped
+        if _name.startswith("_") or _name in UNTIMED or not callable(attribute) or isinstance(attribute, type):
+            return attribute
+
+        def timed(*_args, **_kwargs):
+            target = target_of(_name, _args)
+            start = time.time()
+            try:
+                result = attribute(*_args, **_kwargs)
+            except Exception:
+                self.writer.write(_name, time.time() - start, target, None, True)
+                raise
+            if _name in CURSORS:
+                return TimedCursor(result, self.writer, _name, target, start)
+            self.writer.write(_name, time.time() - start, target, result if _name == "get_count" else None)
+            return result
+        return timed
+
+
+def instrument(_gp, _metrics_filename):
+    """Wrap a backend so that every tool call is timed into a metrics file
+
+    :param _gp: backend created by gpBackend.create_backend
+    :param _metrics_filename: Ex: metrics_filename_of(log_filename)
+    :return:
+    """
+    return InstrumentedBackend(_gp, _metrics_filename)
+
+
+def read_metrics(_metrics_filename, _offset=0):
+    """Metric records of a metrics file, from a byte offset
+
+    :param _metrics_filename:
+    :param _offset: as returned by file_offset before the run
+    :return: list of dictionaries
+    """
+    if not os.path.isfile(_metrics_filename):
+        return []
+    records = []
+    with open(_metrics_filename, "r") as f:
+        f.seek(_offset)
+        for line in f:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    return records
+
+
+def slowest_mosaics(_records, _size=SUMMARY_SIZE):
+    """Mosaic data sets that took longest, adding up all their tools
+
+    :param _records: as returned by read_metrics
+    :param _size:
+    :return: list of (seconds, database, mosaic, calls, {tool: seconds}), slowest first
+    """
+    totals = collections.defaultdict(lambda: [0.0, 0, collections.Counter()])
+    for record in _records:
+        if record["mosaic"] is None:
+            continue
+        total = totals[(record["database"], record["mosaic"])]
+        total[0] += record["seconds"]
+        total[1] += 1
+        total[2][record["tool"]] += record["seconds"]
+    summary = [(seconds, database, mosaic, calls, dict(tools))
+               for (database, mosaic), (seconds, calls, tools) in totals.items()]
+    summary.sort(key=lambda item: item[0], reverse=True)
+    return summary[:_size]
+
+
+def log_summary(_metrics_filename, _offset=0, _size=SUMMARY_SIZE):
+    """Log a table of the slowest mosaic data sets of a run, with the tool that took longest in each of them
+
+    :param _metrics_filename:
+    :param _offset: as returned by file_offset before the run
+    :param _size:
+    :return: summary, as returned by slowest_mosaics
+    """
+    records = read_metrics(_metrics_filename, _offset)
+    summary = slowest_mosaics(records, _size)
+    waits = [record for record in records if record["tool"].endswith(LOCK_WAIT_SUFFIX)]
+    calls = [record for record in records if not record["tool"].endswith(LOCK_WAIT_SUFFIX)]
+    logging.info("Tool calls: %s, %.2f s. Lock waits: %s, %.2f s. Slowest mosaic data sets:", len(calls),
+                 sum(record["seconds"] for record in calls), len(waits), sum(record["seconds"] for record in waits))
+    logging.info("%10s %6s  %-16s %-40s %s", "seconds", "calls", "geo database", "mosaic data set", "slowest tool")
+    for seconds, database, mosaic, calls, tools in summary:
+        tool = max(tools, key=tools.get)
+        logging.info("%10.2f %6d  %-16s %-40s %s (%.2f s)", seconds, calls, database, mosaic, tool, tools[tool])
+    return summary
@@ -0,0 +1,233 @@
+# Author:   GEOTEC, UJI
+# Date:     March 2016
+#
+# Purpose:  This script runs the daily update of every mosaic data set of the season from a single process,
+#           instead of one XX_2016_update*.bat (and one python process) per country and variant.
+#           With one worker, arcpy is imported, and its license checked out, once; the geoprocessing environment
+#           is set up once. With more workers, each worker process does so once (see init_worker).
+#           It reads all folders files given (2nd input parameter). The variant of each folders file follows
+#           from its name and decides which update script handles its lines:
+#           1/ XX_2016_folders.txt: updateMosaicDatasets.py (REGIONAL)
+#           2/ XX_2016_folders_LOCAL.txt: updateMosaicDatasetsLOCAL.py
+#           3/ XX_2016_folders_LTA.txt: updateMosaicDatasetsLTA.py
+#           4/ XX_2016_folders_FORE.txt: updateMosaicDatasetsFORE.py
+#           Every line is updated as the main programme of its update script does, with manifests next to the
+#           log file (see folderManifest) and tool timings in a metrics file (see toolMetrics).
+#
+# Note:     Mosaic data sets of the same geo database are updated one after another, in the order of the folders
+#           files; up to <workers> geo databases (default 1) are updated at the same time (see mosaicScheduler).
+#
+# Usage:    python updateAllMosaicDatasets.py <target_folder> <folders_files> <log_file> [--resume] [<workers>
+#           [<retention_days>]]
+#           <folders_files>: comma separated list of folders files, which may hold wildcards
+#           <retention_days>: days superseded forecasts are kept (see updateMosaicDatasetsFORE.py). Default: all
+#           With --resume, only mosaic data sets not updated by the previous run are updated (see runCheckpoint).
+# Example:  python updateAllMosaicDatasets.py c:/ERMES/PRODUCTS/SCRIPTS *_2016_folders*.txt ALL_2016.log 4
+
+# Import the modules
+import logging, sys, os
+import glob
+import re
+import folderConfig
+import folderManifest
+import gpBackend
+import gpRetry
+import mosaicScheduler
+import runCheckpoint
+import toolMetrics
+import updateMosaicDatasets
+import updateMosaicDatasetsFORE
+import updateMosaicDatasetsLOCAL
+import updateMosaicDatasetsLTA
+
+REGIONAL = "REGIONAL"
+LOCAL = "LOCAL"
+LTA = "LTA"
+FORE = "FORE"
+
+# Suffix of folders files --> variant
+VARIANTS = {"": REGIONAL, "_LOCAL": LOCAL, "_LTA": LTA, "_FORE": FORE}
+UPDATE_MODULES = [updateMosaicDatasets, updateMosaicDatasetsLOCAL, updateMosaicDatasetsLTA, updateMosaicDatasetsFORE]
+LOG_FORMAT = updateMosaicDatasets.LOG_FORMAT
+
+gp = None  # geoprocessing backend (arcpy), shared by every update script of the process
+manifest_folder = None  # folder of the source folder manifests, next to the log file
+retention_days = None  # days superseded forecasts are kept. None keeps all of them
+
+_FOLDERS_FILE_PATTERN = re.compile(r"^.*_folders(_[A-Z]+)?\.txt$")
+
+
+def variant_of(_mosaics_filename):
+    """Variant of a folders file, from its name. Ex: IT_2016_folders_LTA.txt --> LTA
+
+    :param _mosaics_filename:
+    :return: REGIONAL, LOCAL, LTA or FORE
+    """
+    match = _FOLDERS_FILE_PATTERN.match(os.path.basename(_mosaics_filename))
+    if match is None or (match.group(1) or "") not in VARIANTS:
+        raise ValueError("Not a folders file: %s" % _mosaics_filename)
+    return VARIANTS[match.group(1) or ""]
+
+
+def set_backend(_gp):
+    """Hand the geoprocessing backend to every update script
+
+    :param _gp:
+    :return:
+    """
+    global gp
+    gp = _gp
+    for module in UPDATE_MODULES:
+        module.gp = _gp
+
+
+def set_up_environment(_workspace):
+    gp.env.workspace = _workspace
+    gp.env.overwriteOutput = True
+
+    # Do not spread operations across multiple processes.
+    gp.env.parallelProcessingFactor = "0"
+
+
+def init_worker(_backend_name, _backend_options, _workspace, _log_filename, _retention_days=None):
+    """Set up geoprocessing backend, environment and logger of a worker process. Every worker process imports arcpy
+    and checks out its license once, for all the geo databases it updates
+
+    :param _backend_name:
+    :param _backend_options:
+    :param _workspace:
+    :param _log_filename:
+    :param _retention_days:
+    :return:
+    """
+    global manifest_folder, retention_days
+    metrics_filename = toolMetrics.metrics_filename_of(_log_filename)
+    set_backend(gpRetry.retrying(toolMetrics.instrument(gpBackend.create_backend(_backend_name, **_backend_options),
+                                                        metrics_filename), metrics_filename))
+    manifest_folder = folderManifest.manifest_folder_of(_log_filename)
+    retention_days = _retention_days
+    set_up_environment(_workspace)
+    logging.basicConfig(level=logging.DEBUG,
+                        format=LOG_FORMAT.replace('%(levelname)', '%(processName)s %(levelname)'),
+                        datefmt='%d %b %Y %H:%M:%S',
+                        filename=_log_filename)
+
+
+def update_mosaic(_variant, _database_path, _mosaic_name, _source_folder, _manifest_folder=None,
+                  _retention_days=None):
+    """Update a mosaic data set with the update script of its variant
+
+    :param _variant: REGIONAL, LOCAL, LTA or FORE
+    :param _database_path:
+    :param _mosaic_name:
+    :param _source_folder:
+    :param _manifest_folder: if given, only raster files missing in the manifest of the mosaic are added
+    :param _retention_days: FORE only, see updateMosaicDatasetsFORE.update_mosaic
+    :return:
+    """
+    if _variant == REGIONAL:
+        updateMosaicDatasets.update_mosaic(_database_path, _mosaic_name, _source_folder, _manifest_folder)
+    elif _variant == LOCAL:
+        updateMosaicDatasetsLOCAL.update_mosaic(_database_path, _mosaic_name, _source_folder, _manifest_folder)
+    elif _variant == LTA:
+        updateMosaicDatasetsLTA.update_mosaic(_database_path, _mosaic_name, _source_folder, _manifest_folder)
+    elif _variant == FORE:
+        updateMosaicDatasetsFORE.update_mosaic(_database_path, _mosaic_name, _source_folder, _manifest_folder,
+                                               _retention_days)
+    else:
+        raise ValueError("Unknown variant: %s" % _variant)
+
+
+def update_job(_job):
+    """Update the mosaic data set of a job. Errors are logged here, where messages of the tool are available
+
+    :param _job: (database_path, mosaic_name, source_folder, variant)
+    :return:
+    """
+    database_path, mosaic_name, source_folder, variant = _job
+    try:
+        update_mosaic(variant, database_path, mosaic_name, source_folder, manifest_folder, retention_days)
+    except gp.ExecuteError:
+        logging.error(gp.get_messages(2))
+        raise
+
+
+def folders_files(_patterns):
+    """Folders files of a comma separated list of names and wildcards, in the given order, without repetitions
+
+    :param _patterns: Ex: "IT_2016_folders.txt,*_2016_folders_LTA.txt"
+    :return: list of filenames
+    """
+    filenames = []
+    for pattern in _patterns.split(","):
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        for filename in matches:
+            if filename not in filenames:
+                filenames.append(filename)
+    return filenames
+
+
+def read_jobs(_env_path, _mosaics_filename):
+    """Read update jobs from a folders file of any variant
+
+    :param _env_path: folder holding one sub folder per country with its geo databases
+    :param _mosaics_filename:
+    :return: list of (database_path, mosaic_name, source_folder, variant)
+    """
+    variant = variant_of(_mosaics_filename)
+    return [job + (variant,) for job in updateMosaicDatasets.read_jobs(_env_path, _mosaics_filename)]
+
+
+# main programme
+if __name__ == "__main__":
+    try:
+        RESUME = runCheckpoint.pop_resume_option(sys.argv)  # before positional arguments are read
+        BACKEND_NAME, BACKEND_OPTIONS = gpBackend.backend_settings()  # arcpy, see gpBackend
+        set_backend(gpBackend.create_backend(BACKEND_NAME, **BACKEND_OPTIONS))
+
+        # Set the workspace and global variables
+        ENV_PATH = os.path.normpath(os.path.join(sys.argv[1], ".."))
+        MOSAICS_FILENAMES = folders_files(sys.argv[2])
+        LOG_FILENAME = sys.argv[3]
+        WORKERS = int(sys.argv[4]) if len(sys.argv) > 4 else 1
+        retention_days = int(sys.argv[5]) if len(sys.argv) > 5 else None
+        manifest_folder = folderManifest.manifest_folder_of(LOG_FILENAME)
+        set_up_environment(ENV_PATH)
+
+        # Create logger object
+        logging.basicConfig(level=logging.DEBUG,
+                            format=LOG_FORMAT,
+                            datefmt='%d %b %Y %H:%M:%S',
+                            filename=LOG_FILENAME)
+
+        logging.info("Script initiating...")
+        METRICS_FILENAME = toolMetrics.metrics_filename_of(LOG_FILENAME)  # time every tool, see toolMetrics
+        metrics_offset = toolMetrics.file_offset(METRICS_FILENAME)
+        set_backend(gpRetry.retrying(toolMetrics.instrument(gp, METRICS_FILENAME), METRICS_FILENAME))  # see gpRetry
+        jobs = []
+        for mosaics_filename in MOSAICS_FILENAMES:
+            jobs.extend(read_jobs(ENV_PATH, mosaics_filename))
+        logging.info("%s mosaic data sets in %s folders files", len(jobs), len(MOSAICS_FILENAMES))
+        # Failed mosaic data sets are recorded and skipped, see runCheckpoint
+        checkpoint = runCheckpoint.Checkpoint(runCheckpoint.checkpoint_filename_of(LOG_FILENAME))
+        jobs = checkpoint.select(jobs, RESUME)
+
+        # For each data source (folder) update corresponding mosaic dataset
+        mosaicScheduler.run_jobs(jobs, runCheckpoint.CheckpointedJob(update_job, checkpoint.filename), WORKERS,
+                                 _initializer=init_worker,
+                                 _initargs=(BACKEND_NAME, BACKEND_OPTIONS, ENV_PATH, LOG_FILENAME, retention_days))
+
+        checkpoint.log_outcome(jobs)
+        toolMetrics.log_summary(METRICS_FILENAME, metrics_offset)
+        logging.info("Script finished.")
+
+    except folderConfig.ConfigError as error:
+        logging.error("Folders file not valid, no mosaic data set touched:\n%s", error)
+
+    except gp.ExecuteError:
+        logging.info("Script did not complete.")
+        # log errors
+        logging.error(gp.get_messages(2))
+
+    except:
+        logging.info(gp.get_messages())
@@ -15,148 +15,288 @@
 # Update:   Define no data value; use os.path; naming convention (Feb 2016)
 # Update:   Enhancement of update cursor by previously selecting rows to be updated (Feb 2016)
 # Update:   Conditional to create or not an update cursor for custom fields (Feb 2016)
+# Update:   Geoprocessing through gpBackend; new entries found with a single query, see catalogQuery (Mar 2016)
+# Update:   Custom field values parsed from raster names by rasterNames (Mar 2016)
+# Update:   Custom fields computed up front and written in bulk where possible, see fieldWriter (Mar 2016)
+# Update:   Forecast flags rotated in a single cursor pass; optional retention of superseded forecasts (Mar 2016)
+# Update:   Add step parameters from spatialReferences, each raster read in its own coordinate system (Mar 2016)
+# Update:   Every tool call timed into a metrics file next to the log file, see toolMetrics (Mar 2016)
+# Update:   Folders files checked before any mosaic data set is touched, see folderConfig (Mar 2016)
+# Update:   A failing mosaic data set no longer stops the others; --resume, see runCheckpoint (Mar 2016)
+# Update:   Tools failing on locked geo databases tried again with backoff, see gpRetry (Mar 2016)
+# Update:   Rasters delivered again skipped, rasters with new content replaced (rasterFingerprints, Mar 2016)
+# Update:   Boundary and cell size ranges kept when new rasters lie on the grid of the mosaic, see mosaicGrid (Mar 2016)
+# Update:   Half copied rasters held back, broken rasters quarantined, see rasterIntegrity (Mar 2016)
+# Update:   Statistics merged from those of each raster instead of read again, see itemStatistics (Mar 2016)
+# Update:   Dates of the catalog kept in a memory mapped index for the web application, see temporalIndex (Mar 2016)
+# Update:   Forecasts beyond the retention not added again when a manifest is missing (Mar 2016)
 #
-# Usage:    python UpdateMosaicDatasetsFORE.py <target_folder> <source_folders> <log_file>
+# Usage:    python UpdateMosaicDatasetsFORE.py <target_folder> <source_folders> <log_file> [--resume] [<retention_days>]
+#           With <retention_days>, superseded forecasts (FORE = 0) dated more than <retention_days> days before
+#           the newest forecasts are removed from the catalog. Source folders are compared with manifests
+#           (see folderManifest) so that removed forecasts are not added again; without a manifest, forecasts
+#           beyond the retention are skipped when adding (see expired_files).
+#           With --resume, only mosaic data sets not updated by the previous run are updated (see runCheckpoint).
 # Example:  python UpdateMosaicDatasetsFORE.py c:/ERMES/PRODUCTS/SCRIPTS IT_2016_folders_FORE.txt IT_2016_FORE.log
+# Example:  python UpdateMosaicDatasetsFORE.py c:/ERMES/PRODUCTS/SCRIPTS IT_2016_folders_FORE.txt IT_2016_FORE.log 7
+
+# Import the modules
+import logging, sys, os
+import datetime
+import re
+import catalogQuery
+import fieldWriter
+import folderConfig
+import folderManifest
+import gpBackend
+import gpRetry
+import itemStatistics
+import mosaicGrid
+import rasterFingerprints
+import rasterIntegrity
+import rasterNames
+import runCheckpoint
+import spatialReferences
+import temporalIndex
+import toolMetrics
+
+gp = None  # geoprocessing backend (arcpy), set up by the main programme
+
+_PLUS_SUFFIX = re.compile(r"_plus\d+$")  # forecast offset, see rasterNames
 
 
 def log_tool():
     # log all informative messages returned by the last tool executed
-    if len(arcpy.GetMessages(0)) > 0:
-        logging.info(arcpy.GetMessages(0))
+    if len(gp.get_messages(0)) > 0:
+        logging.info(gp.get_messages(0))
     # Log all warnings messages returned by the last tool executed
-    if len(arcpy.GetMessages(1)) > 0:
-        logging.warning(arcpy.GetMessages(1))
+    if len(gp.get_messages(1)) > 0:
+        logging.warning(gp.get_messages(1))
+
+
+def rotate_forecasts(_mosaic_path, _new_entries_expr, _values):
+    """Flag new entries as the latest forecasts and clear the flag of previous ones, in a single cursor pass
+
+    :param _mosaic_path:
+    :param _new_entries_expr: SQL expression returning new entries
+    :param _values: custom field values of new entries, see fieldWriter.compute_values
+    :return: (new entries flagged, previous forecasts cleared)
+    """
+    fore_expr = gp.add_field_delimiters(gp.env.workspace, "FORE") + " = 1"  # 1 means True
+    flagged = cleared = 0
+    fields = ["OID@", "FORE"] + fieldWriter.CUSTOM_FIELDS
+    with gp.update_cursor(_mosaic_path, fields, "(%s) OR (%s)" % (_new_entries_expr, fore_expr)) as cursor:
+        for row in cursor:
+            # OBJECTID is 0, FORE is 1, PARAMNAME is 2, YEAR is 3, SDATE is 4, DATE is 5
+            values = _values.get(row[0])
+            if values is not None:
+                cursor.updateRow([row[0], 1] + list(values))  # flag new entries
+                flagged += 1
+            elif row[1] == 1:
+                row[1] = 0  # Set latest observations to False
+                cursor.updateRow(row)
+                cleared += 1
+    del cursor
+    return flagged, cleared
 
 
-def get_number_records(_mosaic):
-    counts = int(arcpy.GetCount_management(_mosaic).getOutput(0))
+def remove_superseded(_mosaic_path, _values, _retention_days):
+    """Remove superseded forecasts dated more than _retention_days days before the newest forecasts
+
+    :param _mosaic_path:
+    :param _values: custom field values of new entries, see fieldWriter.compute_values
+    :param _retention_days:
+    :return: (date before which superseded forecasts were removed, names of the items removed)
+    """
+    oldest_new = min(values[3] for values in _values.values())  # DATE is 3
+    limit = oldest_new - datetime.timedelta(_retention_days)
+    sql_expr = "%s = 0 AND %s < %s" % (gp.add_field_delimiters(gp.env.workspace, "FORE"),
+                                       gp.add_field_delimiters(gp.env.workspace, "DATE"), gp.sql_date(limit))
+    logging.info("Removing superseded forecasts before %s...", limit.strftime('%Y/%m/%d'))
+    with gp.search_cursor(_mosaic_path, ["Name"], sql_expr) as cursor:
+        removed = [row[0] for row in cursor]  # their statistics are forgotten (itemStatistics)
+    gp.remove_rasters(_mosaic_path, sql_expr)
     log_tool()
-    return counts
+    return limit, removed
+
+
+def expired_files(_filenames, _retention_days):
+    """Raster files that remove_superseded would remove again right after adding them: forecasts dated more than
+    _retention_days days before the oldest forecast of the newest run. Ex: the whole source folder once its manifest
+    is deleted. Names that cannot be parsed are never expired
+
+    :param _filenames: raster files about to be handed to the add step
+    :param _retention_days:
+    :return: sorted list of filenames
+    """
+    parse = rasterNames.parser_of(rasterNames.FORECAST)
+    runs = {}  # {date of the run: [(filename, DATE)]}
+    for filename in _filenames:
+        raster_name = parse(filename)
+        run = parse(_PLUS_SUFFIX.sub("", os.path.splitext(filename)[0]))
+        if raster_name is not None and run is not None:
+            runs.setdefault(run.date, []).append((filename, raster_name.date))
+    if not runs:
+        return []
+    limit = min(date_value for _, date_value in runs[max(runs)]) - datetime.timedelta(_retention_days)
+    return sorted(filename for forecasts in runs.values() for filename, date_value in forecasts if date_value < limit)
 
 
-def update_mosaic(_database_path, _mosaic_name, _source_folder):
+def update_mosaic(_database_path, _mosaic_name, _source_folder, _manifest_folder=None, _retention_days=None):
+    """Update mosaic data set with incoming forecasts. The latest forecasts are flagged with FORE = 1
+
+    :param _database_path:
+    :param _mosaic_name:
+    :param _source_folder:
+    :param _manifest_folder: if given, only raster files missing in the manifest of the mosaic are added
+    :param _retention_days: if given, superseded forecasts older than that are removed (see remove_superseded)
+    :return:
+    """
     mosaic_path = os.path.join(_database_path, _mosaic_name)
 
-    # Set up geoprocessing environment defaults
-    arcpy.env.workspace = _database_path  # that's more useful
+    # Compare the source folder with the files handed to the add step in previous updates
+    input_path = _source_folder
+    refresh = []
+    parameters = None
+    if _manifest_folder is not None:
+        manifest_path = folderManifest.manifest_path(_manifest_folder, _database_path, _mosaic_name)
+        scan = folderManifest.scan_folder(_source_folder)
+        manifest = folderManifest.load_manifest(manifest_path)
+        # Content delivered again is skipped, new content under the same name replaces its item (rasterFingerprints)
+        fingerprints_path = rasterFingerprints.index_path(manifest_path)
+        fingerprints = rasterFingerprints.load_index(fingerprints_path)
+        plan = rasterFingerprints.plan(_source_folder, scan, manifest, fingerprints,
+                                       rasterFingerprints.product_key(rasterNames.parser_of(rasterNames.FORECAST)))
+        rasterFingerprints.log_plan(plan)
+        # Half copied files are held back, broken files moved to quarantine (rasterIntegrity)
+        plan, scan = rasterIntegrity.screen(_source_folder, plan, scan, manifest, fingerprints,
+                                            rasterIntegrity.quarantine_folder_of(_manifest_folder))
+        expired = []
+        if _retention_days is not None:
+            if not manifest:
+                logging.warning("No manifest for mosaic data set %s: forecasts older than %s days are not added again.",
+                                _mosaic_name, _retention_days)
+            # Forecasts already removed (or about to be) by the retention are left in the source folder
+            expired = expired_files(plan.add + plan.refresh, _retention_days)
+            if expired:
+                logging.info("%s superseded forecasts beyond the retention not added.", len(expired))
+        refresh = [filename for filename in plan.refresh if filename not in expired]
+        new_files = sorted(set(plan.add + plan.refresh) - set(expired))
+        if not new_files:
+            logging.info("No new raster files for mosaic data set %s in geo database %s.",
+                         _mosaic_name, os.path.basename(_database_path))
+            if scan != manifest or plan.index != fingerprints:
+                folderManifest.save_manifest(manifest_path, scan)
+                rasterFingerprints.save_index(fingerprints_path, plan.index)
+            return
+        logging.info("%s new raster files in %s", len(new_files), _source_folder)
+        input_path = ";".join(os.path.join(_source_folder, filename) for filename in new_files)
+        # New rasters on the grid of the mosaic data set keep its boundary and cell size ranges (mosaicGrid)
+        grid_path = mosaicGrid.grid_path(manifest_path)
+        grid_check = mosaicGrid.check(_source_folder, new_files,
+                                      mosaicGrid.load_grid(grid_path) if manifest and not refresh else {})
+        parameters = mosaicGrid.add_parameters(grid_check)
 
-    # Number of raster files in mosaic before calling AddRastersToMosaicDataset_management
-    counts_before = get_number_records(mosaic_path)
+    # Set up geoprocessing environment defaults
+    gp.env.workspace = _database_path  # that's more useful
 
     logging.info("Updating mosaic data set %s in geo database %s.", _mosaic_name, os.path.basename(_database_path))
-    # it sets "Exclude Duplicates" to true.
-    arcpy.AddRastersToMosaicDataset_management(in_mosaic_dataset=mosaic_path,
-                                               raster_type="Raster Dataset",
-                                               input_path=_source_folder,
-                                               update_cellsize_ranges="UPDATE_CELL_SIZES",
-                                               update_boundary="UPDATE_BOUNDARY",
-                                               update_overviews="NO_OVERVIEWS",
-                                               maximum_pyramid_levels="",
-                                               maximum_cell_size="0",
-                                               minimum_dimension="1500",
-                                               spatial_reference="",
-                                               filter="*.tif",
-                                               sub_folder="NO_SUBFOLDERS",
-                                               duplicate_items_action="EXCLUDE_DUPLICATES",
-                                               build_pyramids="BUILD_PYRAMIDS",
-                                               calculate_statistics="CALCULATE_STATISTICS",
-                                               build_thumbnails="NO_THUMBNAILS",
-                                               operation_description="#",
-                                               force_spatial_reference="NO_FORCE_SPATIAL_REFERENCE")
+    rasterFingerprints.remove_items(gp, mosaic_path, refresh)  # rasters with new content are added again
+    # it sets "Exclude Duplicates" to true (see gpBackend.ADD_RASTERS_DEFAULTS)
+    gp.add_rasters(mosaic_path, input_path, **spatialReferences.add_parameters(gp, parameters))
     log_tool()
 
-    counts_after = get_number_records(mosaic_path)
-    added_rasters = counts_after - counts_before
+    # If PARAMNAME is NA, that row is a new entry
+    new_entries_expr = catalogQuery.sentinel_clause(gp, gp.env.workspace)
+    new_entries = catalogQuery.new_rows(gp, mosaic_path, ["Name"], new_entries_expr)
+    added_rasters = len(new_entries)
     logging.info("Number of new entries after AddRasterToMosaicDataset: %s", added_rasters)
 
+    values = {}  # custom field values of the new entries, for the temporal index
+    superseded_before = None
+    superseded = []
     if added_rasters > 0:
+        logging.info("Updating custom fields...")
+        # Values of custom fields of the new entries, parsed from names. Ex: IT_Meteo_Forecast_TMax_2015_246_plus1.tif
+        values, unparsed = fieldWriter.compute_values(new_entries, rasterNames.parser_of(rasterNames.FORECAST))
+        for raster_filename in unparsed:
+            logging.warning("Raster %s does not follow the naming convention. Custom fields not updated.",
+                            raster_filename)
+        catalogQuery.mark_unparsed(gp, mosaic_path, new_entries, values)  # not taken as new entries again
+
         # Substitute the latest simulated observations by newer ones
-        sql_field = arcpy.AddFieldDelimiters(arcpy.env.workspace, "FORE")
-        sql_expr = sql_field + " = " + "1"  # 1 means True
-        with arcpy.da.UpdateCursor(mosaic_path, sql_field, sql_expr) as cursor:
-            for row in cursor:
-                row[0] = 0  # Set latest observations to False. New entries will be set to True
-                cursor.updateRow(row)
-            del cursor, row
+        flagged, cleared = rotate_forecasts(mosaic_path, new_entries_expr, values)
+        logging.info("%s new forecasts flagged, %s previous forecasts cleared.", flagged, cleared)
 
-        logging.info("Updating custom fields...")
-        # Create the SQL expression for the update cursor. Custom fields in uppercase
-        fields = ["Name", "PARAMNAME", "YEAR", "SDATE", "DATE", "FORE"]
-        sql_field = arcpy.AddFieldDelimiters(arcpy.env.workspace, "PARAMNAME")
-        sql_expr = sql_field + " = " + "'NA'"  # If PARAMNAME is NA, that row is a new entry
-
-        # Create the update cursor that updates custom fields of row returned by the SQL expression
-        with arcpy.da.UpdateCursor(mosaic_path, fields, sql_expr) as cursor:
-            for row in cursor:
-                # Name is 0, PARAMNAME is 1, YEAR is 2, SDATE is 3, DATE is 4, FORE is 5
-                raster_filename = row[0]
-                parts = raster_filename.split("_")  # Ex: IT_Meteo_Forecast_TMax_2015_246_plus1.tif
-                row[1] = parts[3].upper()  # TMax
-                row[2] = parts[4]  # 2015
-                day = int(parts[5])  # 246
-                if len(parts) == 6:
-                    date_value = datetime.datetime(int(parts[4]), 1, 1) + datetime.timedelta(day - 1)
-                else:
-                    plus = parts[6]
-                    day_plus = int(plus[-1:])  # extract 1 from 'plus1'
-                    date_value = datetime.datetime(int(parts[4]), 1, 1) + datetime.timedelta(day + day_plus - 1)
-                date_formatted = date_value.strftime('%Y/%m/%d')
-                row[3] = date_formatted  # String/text type
-                row[4] = date_value  # Date type
-                row[5] = 1  # flag new entries
-                cursor.updateRow(row)
-            del cursor, row
+        if _retention_days is not None and values:
+            superseded_before, superseded = remove_superseded(mosaic_path, values, _retention_days)
     else:
         logging.info("No updates for mosaic data set %s in geo database %s.",
                      _mosaic_name, os.path.basename(_database_path))
 
+    # Only once the mosaic data set is up to date, otherwise the same files are tried again in the next update
+    if _manifest_folder is not None:
+        # Statistics of the new rasters only, merged with those kept for the others (itemStatistics)
+        itemStatistics.refresh(gp, mosaic_path, _source_folder, manifest_path, scan, new_files, superseded)
+        # Dates of the new entries for the web application, forecast flags rotated as in the catalog (temporalIndex)
+        temporalIndex.update(gp, mosaic_path, temporalIndex.index_path(manifest_path), values, _rebuild=bool(refresh),
+                             _forecast=True, _superseded_before=superseded_before)
+        folderManifest.save_manifest(manifest_path, scan)
+        rasterFingerprints.save_index(fingerprints_path, plan.index)
+        mosaicGrid.save_grid(grid_path, grid_check.grid)
+
 
 # main programme
-try:
-    # Import the modules
-    import arcpy, logging, sys, os
-    import datetime
-
-    # Set the workspace
-    ENV_PATH = os.path.normpath(os.path.join(sys.argv[1], ".."))
-    MOSAICS_FILENAME = sys.argv[2]
-    LOG_FILENAME = sys.argv[3]
-    arcpy.env.workspace = ENV_PATH
-    arcpy.env.overwriteOutput = True
-
-    # Do not spread operations across multiple processes.
-    arcpy.env.parallelProcessingFactor = "0"
-
-    # Create logger stuff 
-    logging.basicConfig(level=logging.DEBUG,
-                        format='%(asctime)s %(filename)s %(levelname)-8s %(message)s',
-                        datefmt='%d %b %Y %H:%M:%S',
-                        filename=LOG_FILENAME)
-
-    logging.info("Script initiating...")
-    f = open(MOSAICS_FILENAME, "r")
-    mosaics = []
-    for x in f.readlines():
-        line = x.strip().split(";")
-        mosaics.append(line)
-
-    for mosaic in mosaics:
-        source_folder = mosaic[0]
-        database_name = mosaic[1]
-        country_code = database_name[:2]  # IT_2016.gdb --> IT
-        database_path = os.path.join(ENV_PATH, country_code, database_name)
-        mosaic_name = mosaic[2]
-        update_mosaic(database_path, mosaic_name, source_folder)
-
-    f.close()
-    logging.info("Script finished.")
-
-
-except arcpy.ExecuteError:
-    logging.debug("Script did not complete.")
-    # log errors
-    logging.error(arcpy.GetMessages(2))
-
-except:
-    logging.info(arcpy.GetMessages())
+if __name__ == "__main__":
+    try:
+        RESUME = runCheckpoint.pop_resume_option(sys.argv)  # before positional arguments are read
+        BACKEND_NAME, BACKEND_OPTIONS = gpBackend.backend_settings()  # arcpy, see gpBackend
+        gp = gpBackend.create_backend(BACKEND_NAME, **BACKEND_OPTIONS)
+
+        # Set the workspace
+        ENV_PATH = os.path.normpath(os.path.join(sys.argv[1], ".."))
+        MOSAICS_FILENAME = sys.argv[2]
+        LOG_FILENAME = sys.argv[3]
+        RETENTION_DAYS = int(sys.argv[4]) if len(sys.argv) > 4 else None
+        MANIFEST_FOLDER = folderManifest.manifest_folder_of(LOG_FILENAME)
+        gp.env.workspace = ENV_PATH
+        gp.env.overwriteOutput = True
+
+        # Do not spread operations across multiple processes.
+        gp.env.parallelProcessingFactor = "0"
+
+        # Create logger stuff 
+        logging.basicConfig(level=logging.DEBUG,
+                            format='%(asctime)s %(filename)s %(levelname)-8s %(message)s',
+                            datefmt='%d %b %Y %H:%M:%S',
+                            filename=LOG_FILENAME)
+
+        logging.info("Script initiating...")
+        METRICS_FILENAME = toolMetrics.metrics_filename_of(LOG_FILENAME)  # time every tool, see toolMetrics
+        metrics_offset = toolMetrics.file_offset(METRICS_FILENAME)
+        gp = toolMetrics.instrument(gp, METRICS_FILENAME)
+        gp = gpRetry.retrying(gp, METRICS_FILENAME)  # wait for geo databases locked by others, see gpRetry
+        # Every line is checked before the first mosaic data set is updated
+        checkpoint = runCheckpoint.Checkpoint(runCheckpoint.checkpoint_filename_of(LOG_FILENAME))
+        jobs = checkpoint.select([(folderConfig.database_path(ENV_PATH, config), config.mosaic_name,
+                                   config.source_folder) for config in folderConfig.read_config(MOSAICS_FILENAME)],
+                                 RESUME)
+        for job in jobs:
+            # A failing mosaic data set is logged and recorded, and the next one is updated, see runCheckpoint
+            checkpoint.run(lambda _job: update_mosaic(*_job, _manifest_folder=MANIFEST_FOLDER,
+                                                          _retention_days=RETENTION_DAYS), job)
+        checkpoint.log_outcome(jobs)
+        toolMetrics.log_summary(METRICS_FILENAME, metrics_offset)
+        logging.info("Script finished.")
+
+
+    except folderConfig.ConfigError as error:
+        logging.error("Folders file not valid, no mosaic data set touched:\n%s", error)
+
+    except gp.ExecuteError:
+        logging.debug("Script did not complete.")
+        # log errors
+        logging.error(gp.get_messages(2))
+
+    except:
+        logging.info(gp.get_messages())
@@ -14,120 +14,191 @@
 #
 # Update:   Define no data value; use os.path; naming convention (Feb 2016)
 # Update:   Enhancement of update cursor (Feb 2016)
+# Update:   Custom field values parsed from raster names by rasterNames (Mar 2016)
+# Update:   Geoprocessing through gpBackend; custom fields written in bulk where possible, see fieldWriter (Mar 2016)
+# Update:   Incremental: skip unchanged source folders, only update custom fields of new entries (Mar 2016)
+# Update:   Add step parameters from spatialReferences, each raster read in its own coordinate system (Mar 2016)
+# Update:   Every tool call timed into a metrics file next to the log file, see toolMetrics (Mar 2016)
+# Update:   Folders files checked before any mosaic data set is touched, see folderConfig (Mar 2016)
+# Update:   A failing mosaic data set no longer stops the others; --resume, see runCheckpoint (Mar 2016)
+# Update:   Tools failing on locked geo databases tried again with backoff, see gpRetry (Mar 2016)
+# Update:   Rasters delivered again skipped, rasters with new content replaced (rasterFingerprints, Mar 2016)
+# Update:   Boundary and cell size ranges kept when new rasters lie on the grid of the mosaic, see mosaicGrid (Mar 2016)
+# Update:   Half copied rasters held back, broken rasters quarantined, see rasterIntegrity (Mar 2016)
+# Update:   Statistics merged from those of each raster instead of read again, see itemStatistics (Mar 2016)
+# Update:   Dates of the catalog kept in a memory mapped index for the web application, see temporalIndex (Mar 2016)
 #
-# Usage:    python UpdateMosaicDatasetsLTA.py <target_folder> <source_folders> <log_file>
+# Usage:    python UpdateMosaicDatasetsLTA.py <target_folder> <source_folders> <log_file> [--resume]
+#           With --resume, only mosaic data sets not updated by the previous run are updated (see runCheckpoint).
 # Example:  python UpdateMosaicDatasetsLTA.py c:/ERMES/PRODUCTS/SCRIPTS IT_2016_folders_LTA.txt IT_2016_LTA.log
 
+# Import the modules
+import logging, sys, os
+import catalogQuery
+import fieldWriter
+import folderConfig
+import folderManifest
+import gpBackend
+import gpRetry
+import itemStatistics
+import mosaicGrid
+import rasterFingerprints
+import rasterIntegrity
+import rasterNames
+import runCheckpoint
+import spatialReferences
+import temporalIndex
+import toolMetrics
+
+gp = None  # geoprocessing backend (arcpy), set up by the main programme
+
 
 def log_tool():
     # log all informative messages returned by the last tool executed
-    if len(arcpy.GetMessages(0)) > 0:
-        logging.info(arcpy.GetMessages(0))
+    if len(gp.get_messages(0)) > 0:
+        logging.info(gp.get_messages(0))
     # Log all warnings messages returned by the last tool executed
-    if len(arcpy.GetMessages(1)) > 0:
-        logging.warning(arcpy.GetMessages(1))
+    if len(gp.get_messages(1)) > 0:
+        logging.warning(gp.get_messages(1))
 
 
-def update_mosaic(_database_path, _mosaic_name, _source_folder):
+def update_mosaic(_database_path, _mosaic_name, _source_folder, _manifest_folder=None):
     """Update mosaic data set with incoming raster files from LTA source folders
 
     :param _database_path:
     :param _mosaic_name:
     :param _source_folder:
+    :param _manifest_folder: if given, only raster files missing in the manifest of the mosaic are added
     :return:
     """
     mosaic_path = os.path.join(_database_path, _mosaic_name)
 
+    # Compare the source folder with the files handed to the add step in previous updates
+    input_path = _source_folder
+    refresh = []
+    parameters = None
+    if _manifest_folder is not None:
+        manifest_path = folderManifest.manifest_path(_manifest_folder, _database_path, _mosaic_name)
+        scan = folderManifest.scan_folder(_source_folder)
+        manifest = folderManifest.load_manifest(manifest_path)
+        # Content delivered again is skipped, new content under the same name replaces its item (rasterFingerprints)
+        fingerprints_path = rasterFingerprints.index_path(manifest_path)
+        fingerprints = rasterFingerprints.load_index(fingerprints_path)
+        plan = rasterFingerprints.plan(_source_folder, scan, manifest, fingerprints,
+                                       rasterFingerprints.product_key(rasterNames.parser_of(rasterNames.LTA)))
+        rasterFingerprints.log_plan(plan)
+        # Half copied files are held back, broken files moved to quarantine (rasterIntegrity)
+        plan, scan = rasterIntegrity.screen(_source_folder, plan, scan, manifest, fingerprints,
+                                            rasterIntegrity.quarantine_folder_of(_manifest_folder))
+        refresh = plan.refresh
+        new_files = sorted(plan.add + plan.refresh)
+        if not new_files:
+            logging.info("No new raster files for mosaic data set %s in geo database %s.",
+                         _mosaic_name, os.path.basename(_database_path))
+            if scan != manifest or plan.index != fingerprints:
+                folderManifest.save_manifest(manifest_path, scan)
+                rasterFingerprints.save_index(fingerprints_path, plan.index)
+            return
+        logging.info("%s new raster files in %s", len(new_files), _source_folder)
+        input_path = ";".join(os.path.join(_source_folder, filename) for filename in new_files)
+        # New rasters on the grid of the mosaic data set keep its boundary and cell size ranges (mosaicGrid)
+        grid_path = mosaicGrid.grid_path(manifest_path)
+        grid_check = mosaicGrid.check(_source_folder, new_files,
+                                      mosaicGrid.load_grid(grid_path) if manifest and not refresh else {})
+        parameters = mosaicGrid.add_parameters(grid_check)
+
     # Set up geoprocessing environment defaults
-    arcpy.env.workspace = _database_path  # that's more useful
+    gp.env.workspace = _database_path  # that's more useful
 
     logging.info("Updating mosaic data set %s in geo database %s.", _mosaic_name, os.path.basename(_database_path))
 
-    # it sets "Exclude Duplicates" to true. 
-    arcpy.AddRastersToMosaicDataset_management(in_mosaic_dataset=mosaic_path,
-                                               raster_type="Raster Dataset",
-                                               input_path=_source_folder,
-                                               update_cellsize_ranges="UPDATE_CELL_SIZES",
-                                               update_boundary="UPDATE_BOUNDARY",
-                                               update_overviews="NO_OVERVIEWS",
-                                               maximum_pyramid_levels="",
-                                               maximum_cell_size="0",
-                                               minimum_dimension="1500",
-                                               spatial_reference="",
-                                               filter="*.tif",
-                                               sub_folder="NO_SUBFOLDERS",
-                                               duplicate_items_action="EXCLUDE_DUPLICATES",
-                                               build_pyramids="BUILD_PYRAMIDS",
-                                               calculate_statistics="CALCULATE_STATISTICS",
-                                               build_thumbnails="NO_THUMBNAILS",
-                                               operation_description="#",
-                                               force_spatial_reference="NO_FORCE_SPATIAL_REFERENCE")
+    rasterFingerprints.remove_items(gp, mosaic_path, refresh)  # rasters with new content are added again
+    # it sets "Exclude Duplicates" to true (see gpBackend.ADD_RASTERS_DEFAULTS)
+    gp.add_rasters(mosaic_path, input_path, **spatialReferences.add_parameters(gp, parameters))
     log_tool()
 
-    logging.info("Updating custom fields...")
-    # Create the SQL expression for the update cursor. Custom fields are uppercase
-    fields = ["Name", "PARAMNAME", "YEAR", "SDATE", "DATE"]
-    # Create the update cursor that updates custom fields (all rows)
-    with arcpy.da.UpdateCursor(mosaic_path, fields) as cursor:
-        for row in cursor:
-            # Name is 0, PARAMNAME is 1, YEAR is 2, SDATE is 3, DATE is 4
-            raster_filename = row[0]
-            parts = raster_filename.split("_")  # Ex: IT_avg_Monitoring_NDVI_2003_2015_001.tif
-            row[1] = parts[1].upper()  # avg or std
-            row[2] = parts[5]  # 2015
-            day = int(parts[6])  # 001
-            date_value = datetime.datetime(int(parts[5]), 1, 1) + datetime.timedelta(day - 1)
-            date_formatted = date_value.strftime('%Y/%m/%d')
-            row[3] = date_formatted  # String/text type
-            row[4] = date_value  # Date type
-            cursor.updateRow(row)
-        del cursor, row
+    # If PARAMNAME is NA, that row is a new entry (or one whose custom fields could not be updated)
+    new_entries_expr = catalogQuery.sentinel_clause(gp, gp.env.workspace)
+    new_entries = catalogQuery.new_rows(gp, mosaic_path, ["Name"], new_entries_expr)
+    logging.info("Number of new entries after AddRasterToMosaicDataset: %s", len(new_entries))
+
+    values = {}  # custom field values of the new entries, for the temporal index
+    if new_entries:
+        logging.info("Updating custom fields...")
+        # Values of custom fields of the new entries, parsed from names. Ex: IT_avg_Monitoring_NDVI_2003_2015_001.tif
+        values, unparsed = fieldWriter.compute_values(new_entries, rasterNames.parser_of(rasterNames.LTA))
+        for raster_filename in unparsed:
+            logging.warning("Raster %s does not follow the naming convention. Custom fields not updated.",
+                            raster_filename)
+        catalogQuery.mark_unparsed(gp, mosaic_path, new_entries, values)  # not taken as new entries again
+        bulk_rows, cursor_rows = fieldWriter.write_values(gp, mosaic_path, fieldWriter.CUSTOM_FIELDS, values,
+                                                          new_entries_expr)
+        logging.info("Custom fields of %s entries updated in bulk and %s with the update cursor.",
+                     bulk_rows, cursor_rows)
+        logging.info("Rows examined: %s, rows written: %s", len(new_entries), bulk_rows + cursor_rows)
+    else:
+        logging.info("No updates for mosaic data set %s in geo database %s. Rows examined: 0, rows written: 0",
+                     _mosaic_name, os.path.basename(_database_path))
+
+    # Only once the mosaic data set is up to date, otherwise the same files are tried again in the next update
+    if _manifest_folder is not None:
+        # Statistics of the new rasters only, merged with those kept for the others (itemStatistics)
+        itemStatistics.refresh(gp, mosaic_path, _source_folder, manifest_path, scan, new_files)
+        # Dates of the new entries for the web application (temporalIndex)
+        temporalIndex.update(gp, mosaic_path, temporalIndex.index_path(manifest_path), values, _rebuild=bool(refresh))
+        folderManifest.save_manifest(manifest_path, scan)
+        rasterFingerprints.save_index(fingerprints_path, plan.index)
+        mosaicGrid.save_grid(grid_path, grid_check.grid)
 
 
 # main programme
-try:
-    # Import the modules
-    import arcpy, logging, sys, os
-    import datetime
-
-    # Set the workspace
-    ENV_PATH = os.path.normpath(os.path.join(sys.argv[1], ".."))
-    MOSAICS_FILENAME = sys.argv[2]
-    LOG_FILENAME = sys.argv[3]
-    arcpy.env.workspace = ENV_PATH
-    arcpy.env.overwriteOutput = True
-
-    # Do not spread operations across multiple processes.
-    arcpy.env.parallelProcessingFactor = "0"
-
-    # Create logger object
-    logging.basicConfig(level=logging.DEBUG,
-                        format='%(asctime)s %(filename)s %(levelname)-8s %(message)s',
-                        datefmt='%d %b %Y %H:%M:%S',
-                        filename=LOG_FILENAME)
-
-    logging.info("Script initiating...")
-    f = open(MOSAICS_FILENAME, "r")
-    mosaics = []
-    for x in f.readlines():
-        line = x.strip().split(";")
-        mosaics.append(line)
-
-    for mosaic in mosaics:
-        source_folder = mosaic[0]
-        database_name = mosaic[1]
-        country_code = database_name[:2]  # IT_2016.gdb --> IT
-        database_path = os.path.join(ENV_PATH, country_code, database_name)
-        mosaic_name = mosaic[2]
-        update_mosaic(database_path, mosaic_name, source_folder)
-
-    f.close()
-    logging.info("Script finished.")
-
-except arcpy.ExecuteError:
-    logging.debug("Script did not complete.")
-    # log errors
-    logging.error(arcpy.GetMessages(2))
-
-except:
-    logging.info(arcpy.GetMessages())
+if __name__ == "__main__":
+    try:
+        RESUME = runCheckpoint.pop_resume_option(sys.argv)  # before positional arguments are read
+        BACKEND_NAME, BACKEND_OPTIONS = gpBackend.backend_settings()  # arcpy, see gpBackend
+        gp = gpBackend.create_backend(BACKEND_NAME, **BACKEND_OPTIONS)
+
+        # Set the workspace
+        ENV_PATH = os.path.normpath(os.path.join(sys.argv[1], ".."))
+        MOSAICS_FILENAME = sys.argv[2]
+        LOG_FILENAME = sys.argv[3]
+        gp.env.workspace = ENV_PATH
+        gp.env.overwriteOutput = True
+
+        # Do not spread operations across multiple processes.
+        gp.env.parallelProcessingFactor = "0"
+        MANIFEST_FOLDER = folderManifest.manifest_folder_of(LOG_FILENAME)
+
+        # Create logger object
+        logging.basicConfig(level=logging.DEBUG,
+                            format='%(asctime)s %(filename)s %(levelname)-8s %(message)s',
+                            datefmt='%d %b %Y %H:%M:%S',
+                            filename=LOG_FILENAME)
+
+        logging.info("Script initiating...")
+        METRICS_FILENAME = toolMetrics.metrics_filename_of(LOG_FILENAME)  # time every tool, see toolMetrics
+        metrics_offset = toolMetrics.file_offset(METRICS_FILENAME)
+        gp = toolMetrics.instrument(gp, METRICS_FILENAME)
+        gp = gpRetry.retrying(gp, METRICS_FILENAME)  # wait for geo databases locked by others, see gpRetry
+        # Every line is checked before the first mosaic data set is updated
+        checkpoint = runCheckpoint.Checkpoint(runCheckpoint.checkpoint_filename_of(LOG_FILENAME))
+        jobs = checkpoint.select([(folderConfig.database_path(ENV_PATH, config), config.mosaic_name,
+                                   config.source_folder) for config in folderConfig.read_config(MOSAICS_FILENAME)],
+                                 RESUME)
+        for job in jobs:
+            # A failing mosaic data set is logged and recorded, and the next one is updated, see runCheckpoint
+            checkpoint.run(lambda _job: update_mosaic(*_job, _manifest_folder=MANIFEST_FOLDER), job)
+        checkpoint.log_outcome(jobs)
+        toolMetrics.log_summary(METRICS_FILENAME, metrics_offset)
+        logging.info("Script finished.")
+
+    except folderConfig.ConfigError as error:
+        logging.error("Folders file not valid, no mosaic data set touched:\n%s", error)
+
+    except gp.ExecuteError:
+        logging.debug("Script did not complete.")
+        # log errors
+        logging.error(gp.get_messages(2))
+
+    except:
+        logging.info(gp.get_messages())
@@ -0,0 +1,116 @@
+# Author:   GEOTEC, UJI
+# Date:     March 2016
+#
+# Purpose:  This script keeps running and adds new raster files to mosaic data sets as soon as they land in their
+#           source folders, instead of waiting for the nightly update. It reads the same folders files as
+#           updateAllMosaicDatasets.py (all variants), polls the source folders every <poll_seconds> and, when
+#           the new files of a source folder have settled (see folderWatcher), updates its mosaic data set with
+#           the update script of its variant. New forecasts are therefore served minutes after they arrive, and
+#           the work is spread across the day.
+#
+# Note:     Updates run one after another in this process: each one only adds the few files that have just
+#           arrived. A failed update is logged and tried again on the next poll.
+#           Manifests and metrics are shared with updateAllMosaicDatasets.py when both use the same log folder.
+#
+# Usage:    python watchMosaicDatasets.py <target_folder> <folders_files> <log_file> [<poll_seconds> [<settle_seconds>
+#           [<retention_days>]]]
+#           <folders_files>: comma separated list of folders files, which may hold wildcards
+#           Defaults: poll every 60 seconds, files settled after 30 seconds, all superseded forecasts kept
+# Example:  python watchMosaicDatasets.py c:/ERMES/PRODUCTS/SCRIPTS *_2016_folders*.txt ALL_2016_watch.log 60 30
+
+# Import the modules
+import logging, sys, os
+import time
+import folderConfig
+import folderManifest
+import folderWatcher
+import gpBackend
+import gpRetry
+import toolMetrics
+import updateAllMosaicDatasets
+
+POLL_SECONDS = 60
+
+
+def watch(_jobs, _poll_seconds=POLL_SECONDS, _settle_seconds=folderWatcher.SETTLE_SECONDS, _max_polls=None,
+          _sleep=time.sleep):
+    """Update mosaic data sets whenever new raster files of their source folders have settled
+
+    :param _jobs: as returned by updateAllMosaicDatasets.read_jobs
+    :param _poll_seconds:
+    :param _settle_seconds:
+    :param _max_polls: stop after a number of polls. None watches forever
+    :param _sleep: function waiting between polls, as time.sleep
+    :return: number of updates run
+    """
+    watcher = folderWatcher.FolderWatcher(_jobs, _settle_seconds, updateAllMosaicDatasets.manifest_folder)
+    logging.info("Watching %s source folders every %s seconds...", len(set(job[2] for job in _jobs)), _poll_seconds)
+    updates = 0
+    polls = 0
+    while _max_polls is None or polls < _max_polls:
+        for job, filenames in watcher.poll():
+            database_path, mosaic_name = job[0], job[1]
+            logging.info("%s new raster files for mosaic data set %s in geo database %s: %s", len(filenames),
+                         mosaic_name, os.path.basename(database_path), ", ".join(filenames))
+            try:
+                updateAllMosaicDatasets.update_job(job)
+            except Exception as error:
+                # As runCheckpoint does: a failing mosaic data set does not stop the others
+                logging.error("Update of mosaic data set %s did not complete, will be tried again: %s",
+                              mosaic_name, error)
+                continue
+            watcher.mark_added(job)
+            updates += 1
+        polls += 1
+        if _max_polls is None or polls < _max_polls:
+            _sleep(_poll_seconds)
+    return updates
+
+
+# main programme
+if __name__ == "__main__":
+    try:
+        BACKEND_NAME, BACKEND_OPTIONS = gpBackend.backend_settings()  # arcpy, see gpBackend
+        updateAllMosaicDatasets.set_backend(gpBackend.create_backend(BACKEND_NAME, **BACKEND_OPTIONS))
+        gp = updateAllMosaicDatasets.gp
+
+        # Set the workspace and global variables
+        ENV_PATH = os.path.normpath(os.path.join(sys.argv[1], ".."))
+        MOSAICS_FILENAMES = updateAllMosaicDatasets.folders_files(sys.argv[2])
+        LOG_FILENAME = sys.argv[3]
+        POLL = int(sys.argv[4]) if len(sys.argv) > 4 else POLL_SECONDS
+        SETTLE = int(sys.argv[5]) if len(sys.argv) > 5 else folderWatcher.SETTLE_SECONDS
+        updateAllMosaicDatasets.retention_days = int(sys.argv[6]) if len(sys.argv) > 6 else None
+        updateAllMosaicDatasets.manifest_folder = folderManifest.manifest_folder_of(LOG_FILENAME)
+        updateAllMosaicDatasets.set_up_environment(ENV_PATH)
+
+        # Create logger object
+        logging.basicConfig(level=logging.DEBUG,
+                            format=updateAllMosaicDatasets.LOG_FORMAT,
+                            datefmt='%d %b %Y %H:%M:%S',
+                            filename=LOG_FILENAME)
+
+        logging.info("Script initiating...")
+        METRICS_FILENAME = toolMetrics.metrics_filename_of(LOG_FILENAME)
+        updateAllMosaicDatasets.set_backend(gpRetry.retrying(toolMetrics.instrument(gp, METRICS_FILENAME),
+                                                             METRICS_FILENAME))  # see gpRetry
+        gp = updateAllMosaicDatasets.gp
+        jobs = []
+        for mosaics_filename in MOSAICS_FILENAMES:
+            jobs.extend(updateAllMosaicDatasets.read_jobs(ENV_PATH, mosaics_filename))
+
+        watch(jobs, POLL, SETTLE)
+
+    except KeyboardInterrupt:
+        logging.info("Script stopped.")
+
+    except folderConfig.ConfigError as error:
+        logging.error("Folders file not valid, no mosaic data set touched:\n%s", error)
+
+    except gp.ExecuteError:
+        logging.info("Script did not complete.")
+        # log errors
+        logging.error(gp.get_messages(2))
+
+    except:
+        logging.info(gp.get_messages())